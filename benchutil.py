@@ -0,0 +1,81 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Setup and teardown shared by the *-bench.py scripts: a fresh ostore in a
+# temporary directory with its own cache, timing of the runs being compared,
+# and the check that the fast path gives the results of the slow one.
+
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+import ostore
+import pdscache
+
+
+class BenchStore(object):
+    ''' An ostore in a temporary directory, with a PDSCache of
+    ''cachesize'' entries made with ''kwargs''. close() removes it all. '''
+
+    def __init__(self, cachesize, **kwargs):
+        self.path = tempfile.mkdtemp()
+        self.cache = pdscache.PDSCache(cachesize, **kwargs)
+        self.pstor, self.ofs = ostore.init_ostore(self.path, self.cache)
+
+    def close(self):
+        self.ofs.close()
+        self.pstor.close()
+        self.cache.close()
+        shutil.rmtree(self.path)
+
+
+def getargs(usage, nargs, defaults=()):
+    ''' Returns the integer arguments of the command line: ''nargs'' of
+    them, then ''defaults'' for the optional ones not given. Prints
+    ''usage'' and exits if there are too few. '''
+    if len(sys.argv) <= nargs:
+        print "%s: %s" % (sys.argv[0], usage)
+        exit(0)
+    args = [int(a) for a in sys.argv[1:]]
+    return args + list(defaults[len(args) - nargs:])
+
+def mkwords(n, letters="abcdefghijklmnop", minlen=4, maxlen=12):
+    ''' Returns ''n'' distinct random words (in no particular order) '''
+    words = set()
+    while len(words) < n:
+        words.add("".join([random.choice(letters)
+                           for i in range(random.randint(minlen, maxlen))]))
+    return list(words)
+
+def timed(func):
+    ''' Runs func(). Returns (seconds, what func() returned) '''
+    before = time.time()
+    result = func()
+    return time.time() - before, result
+
+def measure(cache, func):
+    ''' Runs func(). Returns (seconds, the change in ''cache'' metrics,
+    what func() returned) '''
+    start = cache.metrics.snapshot()
+    elapsed, result = timed(func)
+    return elapsed, cache.metrics.delta(start), result
+
+def check(name, result, expected):
+    ''' Raises RuntimeError if ''name'' didn't give the ''expected'' result,
+    that of the slow path it is compared with '''
+    if result != expected:
+        raise RuntimeError("%s: results differ from the slow path" % name)
@@ -0,0 +1,84 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Loads sorted random words into a Ptrie with one insert() per word and
+# with build_from_sorted(), and counts the trie nodes made by each: the
+# nodes of the resulting trie plus the garbage of copied search paths.
+# Then inserts half of the words, in batches of random words, into a trie
+# of the other half with insert() and with insert_many().
+#
+# Usage: build-bench.py numwords cachesize [batchsize]
+
+
+import random
+import ptrie
+import benchutil
+
+
+def mkitems(n):
+    random.seed(1)
+    return [(w, i) for i, w in enumerate(sorted(benchutil.mkwords(n)))]
+
+def load(cache, func):
+    ''' Runs func() and returns (usec, nodes made, the trie func()
+    returned) '''
+    elapsed, delta, trie = benchutil.measure(cache, func)
+    return elapsed * 1000000, delta["coids"] - delta["coldloads"], trie
+
+
+if __name__ == "__main__":
+    nwords, cachesize, batchsize = benchutil.getargs(
+        "numwords cachesize [batchsize]", 2, (1000,))
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    items = mkitems(nwords)
+    def insert_each():
+        root = ptrie.Nulltrie
+        for w, v in items:
+            root = ptrieObj.insert(root, w, v)
+        return root
+    def build():
+        return ptrieObj.build_from_sorted(items)
+    print "%-20s %10s %12s" % ("", "usec/key", "nodes/key")
+    for name, func in (("insert", insert_each),
+                       ("build_from_sorted", build)):
+        usec, nodes, trie = load(store.cache, func)
+        print "%-20s %10.1f %12.2f" % (name, usec / nwords,
+                                       float(nodes) / nwords)
+        benchutil.check(name, list(ptrieObj.items(trie)), items)
+    base = ptrieObj.build_from_sorted(items[::2])
+    rest = items[1::2]
+    random.shuffle(rest)
+    batches = [rest[i:i + batchsize] for i in range(0, len(rest), batchsize)]
+    def insert_batches():
+        root = base
+        for batch in batches:
+            for w, v in batch:
+                root = ptrieObj.insert(root, w, v)
+        return root
+    def insert_many():
+        root = base
+        for batch in batches:
+            root = ptrieObj.insert_many(root, batch)
+        return root
+    print "%-20s %10s %12s" % ("batch of %d" % batchsize, "usec/key",
+                               "nodes/key")
+    for name, func in (("insert", insert_batches),
+                       ("insert_many", insert_many)):
+        usec, nodes, trie = load(store.cache, func)
+        print "%-20s %10.1f %12.2f" % (name, usec / len(rest),
+                                       float(nodes) / len(rest))
+        benchutil.check(name, list(ptrieObj.items(trie)), items)
+    store.close()
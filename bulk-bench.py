@@ -0,0 +1,79 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Compares one make() per record with PStruct.make_many(), and one
+# getfield() per OID with getfield_many() on OIDs that are mostly not in
+# cache, visited in random order.
+#
+# Usage: bulk-bench.py numrecs cachesize
+
+
+import random
+import plist
+import benchutil
+
+
+def usec_per(func, n):
+    ''' Runs func(). Returns (microseconds per ''n'', what func()
+    returned) '''
+    elapsed, result = benchutil.timed(func)
+    return elapsed * 1000000 / n, result
+
+
+if __name__ == "__main__":
+    n, cachesize = benchutil.getargs("numrecs cachesize", 2)
+    store = benchutil.BenchStore(cachesize)
+    pstor = store.pstor
+    nodePS = plist.nodePS
+    plistObj = plist.Plist(pstor)
+    rows = [(i, plist.emptylist) for i in range(n)]
+    print "%-24s %10s" % ("", "usec/rec")
+    def make_each():
+        # Keep the OIDs, as make_many() does
+        return [nodePS.make(pstor, *row) for row in rows]
+    usec, oids = usec_per(make_each, n)
+    print "%-24s %10.2f" % ("make", usec)
+    benchutil.check("make", [nodePS.getfields(pstor, o) for o in oids], rows)
+    def make_many():
+        return nodePS.make_many(pstor, rows)
+    usec, oids = usec_per(make_many, n)
+    print "%-24s %10.2f" % ("make_many", usec)
+    benchutil.check("make_many", [nodePS.getfields(pstor, o) for o in oids],
+                    rows)
+    del oids
+    # A long list, saved and loaded back so that its nodes are on disk
+    store.ofs.store(plistObj.plist(*range(n)), "list")
+    ll = store.ofs.load("list")
+    nodes = []
+    while ll:
+        nodes.append(ll)
+        ll = plistObj.cdr(ll)
+    # The value of a node is its position in the list
+    order = range(n)
+    random.seed(1)
+    random.shuffle(order)
+    nodes = [nodes[i] for i in order]
+    half = len(nodes) / 2
+    def getfield_each():
+        return [nodePS.getfield(pstor, o, 'value') for o in nodes[:half]]
+    usec, values = usec_per(getfield_each, half)
+    print "%-24s %10.2f" % ("getfield", usec)
+    benchutil.check("getfield", values, order[:half])
+    def getfield_many():
+        return nodePS.getfield_many(pstor, nodes[half:], 'value')
+    usec, values = usec_per(getfield_many, half)
+    print "%-24s %10.2f" % ("getfield_many", usec)
+    benchutil.check("getfield_many", values, order[half:])
+    store.close()
@@ -0,0 +1,417 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+from lnklist import *
+
+
+##
+# Eviction policies for PDSCache. A policy keeps track of the resident cache
+# entries (''centry'') and decides which one is to be evicted when the cache
+# is full. The cache itself owns the entries; the policy only orders them.
+# Entries are linked into the policy's lists through ''centry.lnode'', and a
+# policy may keep its private per-entry state in ''centry.pstate''.
+#
+# Entries are identified by their ''seqnum''. When an evicted coid is read
+# back into cache it keeps its seqnum, so "ghost" entries (keys of recently
+# evicted entries) can be used to detect re-references.
+#
+class CachePolicy(object):
+    ''' Base class of all eviction policies. '''
+
+    def __init__(self, capacity):
+        ''' ''capacity'' is the number of cache slots of the cache '''
+        self.capacity = capacity
+
+    def add(self, centry):
+        ''' A new entry is added to cache. '''
+        raise NotImplementedError
+
+    def touch(self, centry):
+        ''' A resident entry is accessed (cache hit). '''
+        raise NotImplementedError
+
+    def remove(self, centry):
+        ''' A resident entry is removed from cache without being evicted (e.g.
+        it is garbage). '''
+        raise NotImplementedError
+
+    def evict(self):
+        ''' Chooses a victim and removes it from the policy. Returns the
+        victim or None if there are no entries. '''
+        raise NotImplementedError
+
+    def promote(self, centry):
+        ''' Priority hint: a resident entry is known to be hot. It should
+        be kept longer than an entry that was just touched. '''
+        self.touch(centry)
+
+    def demote(self, centry):
+        ''' Priority hint: a resident entry won't be needed again soon (e.g.
+        it is read by a scan). It should be among the next victims. '''
+        pass
+
+    def entries(self):
+        ''' Returns a list of all resident entries, roughly ordered from the
+        coldest to the hottest. '''
+        raise NotImplementedError
+
+    def __str__(self):
+        return "<%s capacity %d>" % (self.__class__.__name__, self.capacity)
+
+
+def _list_pop_head(head):
+    ''' Unlinks and returns the first entry of list ''head'' '''
+    node = head._next
+    list_del(node)
+    return node.data
+
+def _list_entries(head):
+    return [le.data for le in list_next_iter(head)]
+
+
+class LRUPolicy(CachePolicy):
+    ''' Least recently used. Most recent entries are at the tail of the LRU
+    list. This is the original PDSCache policy. '''
+
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._lrulist = ListEntry(None)
+
+    def add(self, centry):
+        list_add_tail(centry.lnode, self._lrulist)
+
+    def touch(self, centry):
+        list_move_tail(centry.lnode, self._lrulist)
+
+    def remove(self, centry):
+        list_del(centry.lnode)
+
+    def evict(self):
+        if list_empty(self._lrulist):
+            return None
+        return _list_pop_head(self._lrulist)
+
+    def demote(self, centry):
+        list_move(centry.lnode, self._lrulist)
+
+    def entries(self):
+        return _list_entries(self._lrulist)
+
+
+class ARCPolicy(CachePolicy):
+    ''' Adaptive Replacement Cache (Megiddo and Modha). Entries seen once live
+    in T1, entries seen at least twice live in T2. B1 and B2 remember the keys
+    evicted from T1 and T2, a hit on a ghost adapts ''p'', the target size of
+    T1. A scan only goes through T1 so it can't wipe out T2. '''
+
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._t1 = ListEntry(None)
+        self._t2 = ListEntry(None)
+        self._t1len = 0
+        self._t2len = 0
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+        self.p = 0
+
+    def _add_t2(self, centry):
+        centry.pstate = 2
+        list_add_tail(centry.lnode, self._t2)
+        self._t2len += 1
+
+    def add(self, centry):
+        key = centry.seqnum
+        c = self.capacity
+        if key in self._b1:
+            delta = max(len(self._b2) / len(self._b1), 1)
+            self.p = min(c, self.p + delta)
+            del self._b1[key]
+            self._add_t2(centry)
+        elif key in self._b2:
+            delta = max(len(self._b1) / len(self._b2), 1)
+            self.p = max(0, self.p - delta)
+            del self._b2[key]
+            self._add_t2(centry)
+        else:
+            centry.pstate = 1
+            list_add_tail(centry.lnode, self._t1)
+            self._t1len += 1
+        # Keep the directory bounded: |T1| + |B1| <= c and |B1| + |B2| <= c
+        while self._b1 and self._t1len + len(self._b1) > c:
+            self._b1.popitem(last=False)
+        while self._b2 and len(self._b1) + len(self._b2) > c:
+            self._b2.popitem(last=False)
+
+    def touch(self, centry):
+        if centry.pstate == 1:
+            list_del(centry.lnode)
+            self._t1len -= 1
+            self._add_t2(centry)
+        else:
+            list_move_tail(centry.lnode, self._t2)
+
+    def remove(self, centry):
+        list_del(centry.lnode)
+        if centry.pstate == 1:
+            self._t1len -= 1
+        else:
+            self._t2len -= 1
+
+    def evict(self):
+        if self._t1len and (self._t1len > self.p or not self._t2len):
+            centry = _list_pop_head(self._t1)
+            self._t1len -= 1
+            self._b1[centry.seqnum] = None
+        elif self._t2len:
+            centry = _list_pop_head(self._t2)
+            self._t2len -= 1
+            self._b2[centry.seqnum] = None
+        else:
+            return None
+        return centry
+
+    def demote(self, centry):
+        if centry.pstate == 2:
+            self._t2len -= 1
+            self._t1len += 1
+            centry.pstate = 1
+        list_move(centry.lnode, self._t1)
+
+    def entries(self):
+        return _list_entries(self._t1) + _list_entries(self._t2)
+
+
+class TwoQPolicy(CachePolicy):
+    ''' The full 2Q algorithm (Johnson and Shasha). First time entries go to
+    the A1in FIFO, their keys are remembered in A1out after eviction. Only an
+    entry re-referenced while in A1out is promoted to the Am LRU list, so a
+    scan passes through A1in without touching Am. '''
+
+    # Fraction of the cache used by A1in and the number of A1out ghosts, as
+    # recommended by the paper.
+    kin_ratio = 0.25
+    kout_ratio = 0.5
+
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._kin = max(1, int(capacity * TwoQPolicy.kin_ratio))
+        self._kout = max(1, int(capacity * TwoQPolicy.kout_ratio))
+        self._a1in = ListEntry(None)
+        self._am = ListEntry(None)
+        self._a1inlen = 0
+        self._amlen = 0
+        self._a1out = OrderedDict()
+
+    def add(self, centry):
+        key = centry.seqnum
+        if key in self._a1out:
+            del self._a1out[key]
+            centry.pstate = "am"
+            list_add_tail(centry.lnode, self._am)
+            self._amlen += 1
+        else:
+            centry.pstate = "a1in"
+            list_add_tail(centry.lnode, self._a1in)
+            self._a1inlen += 1
+
+    def touch(self, centry):
+        # Hits in A1in are ignored - they are most likely correlated
+        # references.
+        if centry.pstate == "am":
+            list_move_tail(centry.lnode, self._am)
+
+    def promote(self, centry):
+        if centry.pstate != "am":
+            self._a1inlen -= 1
+            self._amlen += 1
+            centry.pstate = "am"
+        list_move_tail(centry.lnode, self._am)
+
+    def demote(self, centry):
+        if centry.pstate == "am":
+            self._amlen -= 1
+            self._a1inlen += 1
+            centry.pstate = "a1in"
+        list_move(centry.lnode, self._a1in)
+
+    def remove(self, centry):
+        list_del(centry.lnode)
+        if centry.pstate == "am":
+            self._amlen -= 1
+        else:
+            self._a1inlen -= 1
+
+    def evict(self):
+        if self._a1inlen and (self._a1inlen > self._kin or not self._amlen):
+            centry = _list_pop_head(self._a1in)
+            self._a1inlen -= 1
+            self._a1out[centry.seqnum] = None
+            if len(self._a1out) > self._kout:
+                self._a1out.popitem(last=False)
+        elif self._amlen:
+            centry = _list_pop_head(self._am)
+            self._amlen -= 1
+        else:
+            return None
+        return centry
+
+    def entries(self):
+        return _list_entries(self._a1in) + _list_entries(self._am)
+
+
+class ClockProPolicy(CachePolicy):
+    ''' An approximation of CLOCK-Pro (Jiang, Chen and Zhang). Resident
+    entries are either hot or cold and each kept on its own clock, the hand
+    of a clock is at the head of its list. Cold entries start a "test period"
+    when they are added; a cold entry that is referenced during its test
+    period is promoted to hot. A cold entry evicted during its test period
+    leaves a non-resident ghost behind; a re-reference of a ghost grows the
+    cold target ''coldtarget'', a ghost that expires shrinks it. '''
+
+    # pstate bits
+    HOT = 1
+    REF = 2
+    TEST = 4
+
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._hot = ListEntry(None)
+        self._cold = ListEntry(None)
+        self._hotlen = 0
+        self._coldlen = 0
+        self._ghosts = OrderedDict()
+        self.coldtarget = max(1, capacity / 100)
+
+    def _maxhot(self):
+        return max(1, self.capacity - self.coldtarget)
+
+    def _add_hot(self, centry):
+        centry.pstate = ClockProPolicy.HOT
+        list_add_tail(centry.lnode, self._hot)
+        self._hotlen += 1
+
+    def _add_cold(self, centry, state):
+        centry.pstate = state
+        list_add_tail(centry.lnode, self._cold)
+        self._coldlen += 1
+
+    def add(self, centry):
+        key = centry.seqnum
+        if key in self._ghosts:
+            # Re-referenced within its test period: cold entries deserve
+            # more space.
+            del self._ghosts[key]
+            self.coldtarget = min(self.capacity - 1, self.coldtarget + 1)
+            self._add_hot(centry)
+            self._run_hothand()
+        else:
+            self._add_cold(centry, ClockProPolicy.TEST)
+
+    def touch(self, centry):
+        centry.pstate |= ClockProPolicy.REF
+
+    def remove(self, centry):
+        list_del(centry.lnode)
+        if centry.pstate & ClockProPolicy.HOT:
+            self._hotlen -= 1
+        else:
+            self._coldlen -= 1
+
+    def promote(self, centry):
+        if centry.pstate & ClockProPolicy.HOT:
+            centry.pstate |= ClockProPolicy.REF
+            return
+        self.remove(centry)
+        self._add_hot(centry)
+        self._run_hothand()
+
+    def demote(self, centry):
+        # A cold entry out of its test period, right at the cold hand
+        self.remove(centry)
+        self._add_cold(centry, 0)
+        list_move(centry.lnode, self._cold)
+
+    def _run_hothand(self):
+        ''' Demotes hot entries to cold until the hot clock is back within its
+        limit. Referenced hot entries get a second chance. '''
+        while self._hotlen > self._maxhot():
+            self._demote_one()
+
+    def _demote_one(self):
+        while True:
+            node = self._hot._next
+            centry = node.data
+            list_del(node)
+            if centry.pstate & ClockProPolicy.REF:
+                centry.pstate &= ~ClockProPolicy.REF
+                list_add_tail(node, self._hot)
+                continue
+            self._hotlen -= 1
+            self._add_cold(centry, 0)
+            return
+
+    def evict(self):
+        if not self._coldlen:
+            if not self._hotlen:
+                return None
+            self._demote_one()
+        while True:
+            node = self._cold._next
+            centry = node.data
+            list_del(node)
+            self._coldlen -= 1
+            state = centry.pstate
+            if state & ClockProPolicy.REF:
+                if state & ClockProPolicy.TEST:
+                    # Re-referenced during test period: promote to hot
+                    self._add_hot(centry)
+                    self._run_hothand()
+                else:
+                    self._add_cold(centry, ClockProPolicy.TEST)
+                if not self._coldlen:
+                    self._demote_one()
+                continue
+            if state & ClockProPolicy.TEST:
+                self._ghosts[centry.seqnum] = None
+                if len(self._ghosts) > self.capacity:
+                    # Test period ended without a re-reference.
+                    self._ghosts.popitem(last=False)
+                    self.coldtarget = max(1, self.coldtarget - 1)
+            return centry
+
+    def entries(self):
+        return _list_entries(self._cold) + _list_entries(self._hot)
+
+
+# Registered policies, by name.
+policy_table = {
+    "lru": LRUPolicy,
+    "arc": ARCPolicy,
+    "2q": TwoQPolicy,
+    "clockpro": ClockProPolicy,
+}
+
+def mkpolicy(policy, capacity):
+    ''' Returns an eviction policy object. ''policy'' is either the name of a
+    registered policy, a CachePolicy subclass, or an already constructed
+    CachePolicy object, which is returned as is. '''
+    if isinstance(policy, CachePolicy):
+        return policy
+    if isinstance(policy, str):
+        if policy not in policy_table:
+            raise KeyError("Unknown cache policy '%s'" % policy)
+        policy = policy_table[policy]
+    return policy(capacity)
@@ -0,0 +1,72 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Counts the keys under random prefixes and finds the k-th key of a trie
+# of random words, by scanning a Ptrie with items() and with the counts of
+# a CountedPtrie, and compares the time of building both tries.
+#
+# Usage: count-bench.py numwords numqueries cachesize
+
+
+import random
+from itertools import islice
+import ptrie
+import countedptrie
+import benchutil
+
+
+if __name__ == "__main__":
+    nwords, nqueries, cachesize = benchutil.getargs(
+        "numwords numqueries cachesize", 3)
+    store = benchutil.BenchStore(cachesize)
+    plain = ptrie.Ptrie(store.pstor)
+    counted = countedptrie.CountedPtrie(store.pstor)
+    random.seed(1)
+    words = benchutil.mkwords(nwords)
+    prefixes = [w[:2] for w in random.sample(words, nqueries)]
+    ks = [random.randrange(nwords) for i in range(nqueries)]
+    tries = {}
+    print "%-24s %10s" % ("", "seconds")
+    for name, obj in (("Ptrie", plain), ("CountedPtrie", counted)):
+        def build():
+            trie = ptrie.Nulltrie
+            for w in words:
+                trie = obj.insert(trie, w, 1)
+            return trie
+        elapsed, tries[name] = benchutil.timed(build)
+        print "%-24s %10.2f" % ("insert " + name, elapsed)
+    # The slow paths scan a Ptrie with items(), the counts of a
+    # CountedPtrie must give the same results
+    def count_scan():
+        return [sum(1 for kv in plain.items(tries["Ptrie"], prefix=p))
+                for p in prefixes]
+    elapsed, expected = benchutil.timed(count_scan)
+    print "%-24s %10.2f" % ("count by items()", elapsed)
+    def count():
+        return [counted.count(tries["CountedPtrie"], p) for p in prefixes]
+    elapsed, counts = benchutil.timed(count)
+    print "%-24s %10.2f" % ("count()", elapsed)
+    benchutil.check("count()", counts, expected)
+    def select_scan():
+        return [next(islice(plain.items(tries["Ptrie"]), k, None))
+                for k in ks]
+    elapsed, expected = benchutil.timed(select_scan)
+    print "%-24s %10.2f" % ("select by items()", elapsed)
+    def select():
+        return [counted.select(tries["CountedPtrie"], k) for k in ks]
+    elapsed, selected = benchutil.timed(select)
+    print "%-24s %10.2f" % ("select()", elapsed)
+    benchutil.check("select()", selected, expected)
+    store.close()
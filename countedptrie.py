@@ -0,0 +1,165 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import persistds
+from pstructstor import BatchRef
+from ptrie import Ptrie, Nulltrie, _default_tnode_fields
+
+#
+# Counted trie node PStruct
+# The fields of a Ptrie node, plus:
+# count:        The number of final nodes in the node itself, its lcp
+#               subtree and its rsp chain (with their subtrees). The keys
+#               under a node are count(node) - count(rsp), and the keys of
+#               the siblings before a node s of chain head are count(head) -
+#               count(s).
+# A node's count is set when it is made, from those of its lcp and rsp.
+# Since nodes never change, insert, delete and merge keep the counts up to
+# date as they are. A TransientPtrie, which does change its nodes, tells
+# about the keys it adds (see _transient_added()).
+#
+
+countedStruct = persistds.PStruct.mkpstruct('countednode',
+        _default_tnode_fields + (('count', 0),))
+
+_nfields = len(_default_tnode_fields)
+_defaults = [f[1] for f in _default_tnode_fields]
+_fnames = [f[0] for f in _default_tnode_fields]
+
+class CountedPtrie(Ptrie):
+    ''' A Ptrie whose nodes know the number of keys under them, so that
+    count(), rank(), select() and sample() take as many node reads as
+    find(). '''
+    pstruct = countedStruct
+
+    def _count(self, node):
+        if not node:
+            return 0
+        count, = self.getfields(node, ('count',))
+        return count
+
+    def makeTnode(self, *args, **kwargs):
+        ''' Makes a trie node, as Ptrie.makeTnode(). The count is worked
+        out, it can't be passed. '''
+        fields = list(args[:_nfields]) + _defaults[len(args):]
+        for k, v in kwargs.items():
+            if k != 'count':
+                fields[_fnames.index(k)] = v
+        prefix, value, final, lcp, rsp = fields
+        count = int(bool(final)) + self._count(lcp) + self._count(rsp)
+        return countedStruct.make(self.pstor, prefix, value, final, lcp, rsp,
+                                  count)
+
+    def _make_many(self, rows):
+        ''' Ptrie._make_many() with the counts of ''rows'' worked out. The
+        count of a BatchRef is that of its row. '''
+        counts = []
+        full = []
+        for row in rows:
+            fields = list(row[:_nfields]) + _defaults[len(row):]
+            count = int(bool(fields[2]))
+            for f in fields[3:5]:
+                if isinstance(f, BatchRef):
+                    count += counts[f.index]
+                else:
+                    count += self._count(f)
+            counts.append(count)
+            full.append(fields + [count])
+        return countedStruct.make_many(self.pstor, full)
+
+    def _transient_added(self, nodes):
+        ''' A TransientPtrie added a key under ''nodes'' '''
+        for node in nodes:
+            count, = self.getfields(node, ('count',))
+            countedStruct.setfields(self.pstor, node, count=count + 1)
+
+    def _subtree_count(self, node):
+        ''' The number of keys of ''node'' and its lcp subtree '''
+        count, rsp = self.getfields(node, ('count', 'rsp'))
+        return count - self._count(rsp)
+
+    def count(self, trie, prefix=''):
+        ''' Returns the number of keys that start with ''prefix''. '''
+        if not trie:
+            return 0
+        if not prefix:
+            return self._count(trie)
+        node = self.find(trie, prefix, finalOnly=False)
+        if not node:
+            return 0
+        return self._subtree_count(node)
+
+    def rank(self, trie, key):
+        ''' Returns the number of keys less than ''key''. '''
+        if not trie:
+            return 0
+        rank = 0
+        node = trie
+        pos = 0
+        while True:
+            final, lcp = self.getfields(node, ('final', 'lcp'))
+            if pos == len(key):
+                return rank
+            if final:
+                rank += 1
+            # Skip the siblings before key[pos]
+            head = lcp
+            while lcp:
+                prefix, rsp = self.getfields(lcp, ('prefix', 'rsp'))
+                if prefix[pos] >= key[pos]:
+                    break
+                lcp = rsp
+            rank += self._count(head) - self._count(lcp)
+            if not lcp or prefix[pos] != key[pos]:
+                return rank
+            node = lcp
+            pos += 1
+
+    def select(self, trie, k, prefix=''):
+        ''' Returns the (key, value) of the ''k''th (from 0) key that starts
+        with ''prefix'', in key order. Raises IndexError if there are not
+        that many. '''
+        if k < 0:
+            raise IndexError("select index %d out of range" % k)
+        node = self.find(trie, prefix, finalOnly=False) if trie else Nulltrie
+        while node:
+            key, value, final, lcp = self.getfields(
+                    node, ('prefix', 'value', 'final', 'lcp'))
+            if final:
+                if k == 0:
+                    return (key, value)
+                k -= 1
+            # Find the child whose subtree holds the kth key
+            node = Nulltrie
+            count = self._count(lcp)
+            while lcp:
+                rsp, = self.getfields(lcp, ('rsp',))
+                rest = self._count(rsp)
+                if k < count - rest:
+                    node = lcp
+                    break
+                k -= count - rest
+                lcp, count = rsp, rest
+        raise IndexError("select index out of range")
+
+    def sample(self, trie, prefix='', rng=random):
+        ''' Returns a (key, value) picked uniformly at random from the keys
+        that start with ''prefix'', or None if there are none. ''rng'' is
+        a random.Random, or the random module. '''
+        count = self.count(trie, prefix)
+        if not count:
+            return None
+        return self.select(trie, rng.randrange(count), prefix)
@@ -0,0 +1,68 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Looks up a batch of random words, half of them in the trie, with one
+# find() per word and with find_many(), and counts the trie nodes read
+# from storage by each.
+#
+# Usage: find-bench.py numwords numlookups cachesize
+
+
+import random
+import ptrie
+import benchutil
+
+
+def lookup(cache, func):
+    ''' Runs func() and returns (seconds, nodes read, what func()
+    returned) '''
+    elapsed, delta, result = benchutil.measure(cache, func)
+    return elapsed, delta["coldloads"], result
+
+
+if __name__ == "__main__":
+    nwords, nlookups, cachesize = benchutil.getargs(
+        "numwords numlookups cachesize", 3)
+    store = benchutil.BenchStore(cachesize)
+    ofs = store.ofs
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    words = benchutil.mkwords(nwords + nlookups / 2)
+    ofs.store(ptrieObj.build_from_sorted(sorted((w, i) for i, w in
+                                                enumerate(words[:nwords]))),
+              "trie")
+    ofs.gc()
+    keys = random.sample(words[:nwords], nlookups / 2) + words[nwords:]
+    random.shuffle(keys)
+    # The value of a word in the trie is its index in words
+    index = dict((w, i) for i, w in enumerate(words[:nwords]))
+    expected = [index.get(k) for k in keys]
+    def values(nodes):
+        return [ptrieObj.getfields(n, ('value',))[0] if n else None
+                for n in nodes]
+    print "%-12s %10s %12s" % ("", "seconds", "nodes read")
+    def find():
+        # Load the trie again, so that both start with a cold cache
+        trie = ofs.load("trie")
+        return [ptrieObj.find(trie, k) for k in keys]
+    def find_many():
+        trie = ofs.load("trie")
+        return ptrieObj.find_many(trie, keys)
+    for name, func in (("find", find), ("find_many", find_many)):
+        seconds, nodes, found = lookup(store.cache, func)
+        print "%-12s %10.2f %12d" % (name, seconds, nodes)
+        benchutil.check(name, values(found), expected)
+        del found
+    store.close()
@@ -13,14 +13,19 @@
 # limitations under the License.
 
 
+import threading
 from oid import OID
 
 # Fixed size records
 class StorPool(object):
-    ''' Uses a sequence number for the obj_id '''
+    ''' Uses a sequence number for the obj_id. All file accesses hold the
+    pool's lock because they share a file position (seek then read/write).
+    Pools of different record sizes have their own files and locks, so
+    readers of different size classes don't block each other. '''
     def __init__(self, recsize, fobj):
         self.recsize = recsize
         self.fobj = fobj
+        self.lock = threading.Lock()
         # If the file is newly created (file size is 0), leave one unused
         # recsize in the beginning because oid of 0 is not allowed.
         self.fobj.seek(0, 2)
@@ -31,12 +36,18 @@ class StorPool(object):
             self.filesz = recsize
 
     def close(self):
-        self.fobj.close()
-        self.fobj = None
+        with self.lock:
+            self.fobj.close()
+            self.fobj = None
+
+    def flush(self):
+        ''' Writes out buffered records, so that other processes see them '''
+        with self.lock:
+            self.fobj.flush()
 
     def _locate(self, seqnum):
         ''' seek the offset denoted by @seqnum. Throws an exception if that
-        offset is not less than file size '''
+        offset is not less than file size. Caller must hold the lock. '''
         # Get file size
         offset = seqnum * self.recsize
         if offset >= self.filesz:
@@ -50,36 +61,83 @@ class StorPool(object):
         ''' Creates a record @rec and returns the oid '''
         if len(rec) > self.recsize:
             raise ValueError("Record too big")
-        # Append the record the end of file
-        self.fobj.seek(0, 2)
-        off1 = self.fobj.tell()
-        self.fobj.write(rec)
-        off2 = self.fobj.tell()
-        if (off2 < off1 + self.recsize):
-            # Extend file to (off1 + self.recsize)
-            self.fobj.truncate(off1 + self.recsize)
-        self.filesz += self.recsize
+        with self.lock:
+            # Append the record the end of file
+            self.fobj.seek(0, 2)
+            off1 = self.fobj.tell()
+            self.fobj.write(rec)
+            off2 = self.fobj.tell()
+            if (off2 < off1 + self.recsize):
+                # Extend file to (off1 + self.recsize)
+                self.fobj.truncate(off1 + self.recsize)
+            self.filesz += self.recsize
         seqnum = (off1 / self.recsize)
         #print "Spool%d: created oid @ offset %x seqnum %d" % (self.recsize, off1, seqnum)
         return OID(seqnum, self.recsize)
 
+    def create_many(self, recs, seqnum=None):
+        ''' Appends records @recs to the end of file with a single write.
+        Returns the oids in the same order as @recs. With @seqnum, the
+        records must land at that sequence number (the oids were handed out
+        already, see BatchWriter): if anything was appended in between,
+        nothing is written and RuntimeError is raised. '''
+        for rec in recs:
+            if len(rec) > self.recsize:
+                raise ValueError("Record too big")
+        buf = "".join([rec.ljust(self.recsize, "\0") for rec in recs])
+        with self.lock:
+            self.fobj.seek(0, 2)
+            off1 = self.fobj.tell()
+            if seqnum is not None and off1 / self.recsize != seqnum:
+                raise RuntimeError("Spool%d: batch expected at seqnum %d, "
+                                   "end of file is at %d" % (
+                        self.recsize, seqnum, off1 / self.recsize))
+            self.fobj.write(buf)
+            self.filesz += len(buf)
+        seqnum = (off1 / self.recsize)
+        return [OID(seqnum + i, self.recsize) for i in range(len(recs))]
+
     def retrieve(self, seqnum):
         ''' Returns the record at @seqnum '''
-        self._locate(seqnum)
-        #print "Spool%d: retrieving rec @ seqnum %d" % (self.recsize, seqnum)
-        return self.fobj.read(self.recsize)
+        with self.lock:
+            self._locate(seqnum)
+            #print "Spool%d: retrieving rec @ seqnum %d" % (self.recsize, seqnum)
+            return self.fobj.read(self.recsize)
+
+    def retrieve_many(self, seqnums, maxgap=8):
+        ''' Returns the records at @seqnums, which must be sorted. Records
+        no more than @maxgap records apart are read with a single read. '''
+        recs = []
+        recsize = self.recsize
+        with self.lock:
+            i = 0
+            while i < len(seqnums):
+                j = i + 1
+                while (j < len(seqnums) and
+                       seqnums[j] - seqnums[j-1] <= maxgap + 1):
+                    j += 1
+                first = seqnums[i]
+                self._locate(seqnums[j-1])
+                self._locate(first)
+                buf = self.fobj.read((seqnums[j-1] - first + 1) * recsize)
+                for seqnum in seqnums[i:j]:
+                    off = (seqnum - first) * recsize
+                    recs.append(buf[off:off+recsize])
+                i = j
+        return recs
 
     def update(self, seqnum, offset, partial):
         ''' Change a record partially at offset with new value partial '''
         if len(partial) > self.recsize:
             raise ValueError("newValue too large")
-        self._locate(seqnum)
-        # seek to offset within the record and overwrite
-        self.fobj.seek(offset, 1)
-        mark = self.fobj.tell()
-        self.fobj.write(partial)
-        self.fobj.seek(mark, 0)
-        return self.fobj.read(self.recsize)
+        with self.lock:
+            self._locate(seqnum)
+            # seek to offset within the record and overwrite
+            self.fobj.seek(offset, 1)
+            mark = self.fobj.tell()
+            self.fobj.write(partial)
+            self.fobj.seek(mark, 0)
+            return self.fobj.read(self.recsize)
 
 
 def roundToPowerOf2(sz):
@@ -93,6 +151,34 @@ def roundToPowerOf2(sz):
         p += 1
     return (1 << p)
 
+class BatchWriter(object):
+    ''' Collects records to be created in a FixszPDS. The oid of a record is
+    handed out as soon as the record is added, but records are not written
+    until commit(), which writes all records of the same size class with a
+    single write. Records of a size class are written in the order they are
+    added. Nothing else may append to a size class of the batch before
+    commit(), which raises RuntimeError if that happened. '''
+    def __init__(self, pds):
+        self._pds = pds
+        # Pending records: storpool => (seqnum of the first, list of records)
+        self._pending = {}
+
+    def create(self, rec):
+        if len(rec) == 0:
+            return OID.Nulloid
+        spool = self._pds._getStorPool(len(rec))
+        if spool not in self._pending:
+            self._pending[spool] = (spool.filesz / spool.recsize, [])
+        first, recs = self._pending[spool]
+        recs.append(rec)
+        return OID(first + len(recs) - 1, spool.recsize)
+
+    def commit(self):
+        for spool, (first, recs) in self._pending.items():
+            spool.create_many(recs, first)
+        self._pending = {}
+
+
 import os
 import re
 class FixszPDS(object):
@@ -113,6 +199,8 @@ class FixszPDS(object):
         self._stordir= stordir
         # Global StorPool dict
         self._stor_pools = {}
+        # Serializes creation of new stor pools
+        self._lock = threading.Lock()
         for fname in os.listdir(self._stordir):
             m = FixszPDS.namepat.match(fname)
             if m is None:
@@ -132,6 +220,11 @@ class FixszPDS(object):
             #print "Closing %s" % fname
             spool.close()
 
+    def flush(self):
+        ''' Flushes all stor pools, see StorPool.flush() '''
+        for spool in self._stor_pools.values():
+            spool.flush()
+
     def expunge(self):
         ''' Delete or otherwise Invalidate all records in the storage and
         reclaim storage space '''
@@ -150,15 +243,19 @@ class FixszPDS(object):
             raise ValueError("There is no zero sized storage pool.")
         recsize = roundToPowerOf2(recsize)
         fname = FixszPDS.nameOfStorfile(recsize)
-        if fname in self._stor_pools:
-            return self._stor_pools[fname]
-        # Create a new stor pool and add it to the dict
-        fpath = os.path.join(self._stordir, fname)
-        assert(not os.path.exists(fpath))
-        fo = open(fpath, "wb+")
-        spool = StorPool(recsize, fo)
-        self._stor_pools[fname] = spool
-        return spool
+        spool = self._stor_pools.get(fname)
+        if spool is not None:
+            return spool
+        with self._lock:
+            if fname in self._stor_pools:
+                return self._stor_pools[fname]
+            # Create a new stor pool and add it to the dict
+            fpath = os.path.join(self._stordir, fname)
+            assert(not os.path.exists(fpath))
+            fo = open(fpath, "wb+")
+            spool = StorPool(recsize, fo)
+            self._stor_pools[fname] = spool
+            return spool
 
     def create(self, rec):
         sz = len(rec)
@@ -167,6 +264,10 @@ class FixszPDS(object):
         spool = self._getStorPool(len(rec))
         return spool.create(rec)
 
+    def batch(self):
+        ''' Returns a BatchWriter for creating records in bulk '''
+        return BatchWriter(self)
+
     def getrec(self, oid):
         if type(oid) is not OID:
             raise TypeError("oid Must be type OID (Got %s instead)" % type(oid))
@@ -175,6 +276,26 @@ class FixszPDS(object):
         spool = self._getStorPool(oid.size)
         return spool.retrieve(oid.oid)
 
+    def getrecs(self, oids):
+        ''' Returns the records of @oids. Records are read in storage order,
+        nearby records of a size class with a single read. '''
+        for o in oids:
+            if type(o) is not OID:
+                raise TypeError("oid Must be type OID (Got %s instead)"
+                                % type(o))
+        recs = [""] * len(oids)
+        bysize = {}
+        for i, o in enumerate(oids):
+            if o is not OID.Nulloid:
+                bysize.setdefault(o.size, []).append(i)
+        for size, positions in bysize.items():
+            positions.sort(key=lambda i: oids[i].oid)
+            spool = self._getStorPool(size)
+            srecs = spool.retrieve_many([oids[i].oid for i in positions])
+            for i, rec in zip(positions, srecs):
+                recs[i] = rec
+        return recs
+
     def updaterec(self, oid, offset, newValue):
         if type(oid) is not OID:
             raise TypeError("oid Must be type OID")
@@ -0,0 +1,67 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Inserts random batches with insert_many() and with one insert() per key,
+# for each kind of mergevalue, and checks that the tries have the same
+# nodes. The keys share prefixes, so that batches hit nodes which are not
+# final (the root among them).
+#
+# Usage: insert-many-tester.py [rounds [batchsize]]
+
+
+import sys
+import random
+import shutil
+import tempfile
+import ostore
+import ptrie
+import pdscache
+
+
+def add_values(v1, v2):
+    return v1 + v2
+
+def nodes(ptrieObj, trie):
+    return [(f.prefix, f.value, f.final) for f in
+            [ptrieObj.getfields(node) for node in ptrieObj.dfiter(trie)]]
+
+def random_key():
+    return "".join([random.choice("abc") for j in range(random.randint(0, 5))])
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    batchsize = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    ostore_path = tempfile.mkdtemp()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(2000))
+    ptrieObj = ptrie.Ptrie(pstor)
+    random.seed(1)
+    for mergevalue in (ptrie.replace_value, None, add_values):
+        for r in range(rounds):
+            base = ptrie.Nulltrie
+            for i in range(random.randint(0, batchsize)):
+                base = ptrieObj.insert(base, random_key(), i)
+            batch = [(random_key(), i) for i in range(batchsize)]
+            expected = base
+            for k, v in batch:
+                expected = ptrieObj.insert(expected, k, v, mergevalue)
+            got = ptrieObj.insert_many(base, batch, mergevalue)
+            if nodes(ptrieObj, got) != nodes(ptrieObj, expected):
+                raise AssertionError("insert_many(%r) on %r differs" %
+                        (batch, list(ptrieObj.items(base))))
+        print "%s: OK" % getattr(mergevalue, '__name__', mergevalue)
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
@@ -0,0 +1,68 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+# Merges k stored tries of random words into one, pairwise with
+# merge_trie() and in one pass with merge_many(), and counts the trie
+# nodes made by each.
+#
+# Usage: merge-bench.py numtries numwords cachesize
+
+
+import random
+import ptrie
+import benchutil
+
+
+def merge(cache, func):
+    ''' Runs func() and returns (seconds, nodes made, the trie func()
+    returned) '''
+    elapsed, delta, trie = benchutil.measure(cache, func)
+    return elapsed, delta["coids"] - delta["coldloads"], trie
+
+
+if __name__ == "__main__":
+    ntries, nwords, cachesize = benchutil.getargs(
+        "numtries numwords cachesize", 3)
+    store = benchutil.BenchStore(cachesize)
+    ofs = store.ofs
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    # The merged trie counts the tries each word is in
+    counts = {}
+    for i in range(ntries):
+        words = sorted(benchutil.mkwords(nwords))
+        for w in words:
+            counts[w] = counts.get(w, 0) + 1
+        trie = ptrieObj.build_from_sorted([(w, 1) for w in words])
+        ofs.store(trie, "part%d" % i)
+    ofs.gc()
+    add = lambda v1, v2: v1 + v2
+    def merge_pairwise():
+        merged = ptrie.Nulltrie
+        for i in range(ntries):
+            merged = ptrieObj.merge_trie(merged, ofs.load("part%d" % i), add)
+        return merged
+    def merge_many():
+        return ptrieObj.merge_many([ofs.load("part%d" % i)
+                                    for i in range(ntries)], add)
+    print "%-12s %10s %12s" % ("", "seconds", "nodes made")
+    for name, func in (("merge_trie", merge_pairwise),
+                       ("merge_many", merge_many)):
+        seconds, nodes, trie = merge(store.cache, func)
+        print "%-12s %10.1f %12d" % (name, seconds, nodes)
+        benchutil.check(name, list(ptrieObj.items(trie)),
+                        sorted(counts.items()))
+    store.close()
@@ -0,0 +1,79 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Checks Ptrie.merge_trie() against dicts: first tries whose first-level
+# nodes interleave ({a, c} and {b, d}: a sibling chain is inserted into the
+# other, siblings and all), then random tries, for each kind of mergevalue.
+#
+# Usage: merge-tester.py [rounds]
+
+
+import sys
+import random
+import shutil
+import tempfile
+import ostore
+import ptrie
+import pdscache
+
+
+def add_values(v1, v2):
+    return v1 + v2
+
+def merge_dicts(d1, d2, mergevalue):
+    res = dict(d2)
+    for k, v in d1.items():
+        if k in d2 and mergevalue is not None:
+            res[k] = mergevalue(v, d2[k])
+        else:
+            res[k] = v
+    return res
+
+def random_dict(n):
+    d = {}
+    for i in range(n):
+        d["".join([random.choice("abcd")
+                   for j in range(random.randint(0, 5))])] = i
+    return d
+
+def check(ptrieObj, d1, d2, mergevalue):
+    t1 = ptrieObj.build_from_sorted(sorted(d1.items()))
+    t2 = ptrieObj.build_from_sorted(sorted(d2.items()))
+    merged = ptrieObj.merge_trie(t1, t2, mergevalue)
+    expected = sorted(merge_dicts(d1, d2, mergevalue).items())
+    if list(ptrieObj.items(merged)) != expected:
+        raise AssertionError("merge_trie(%r, %r) is %r" %
+                (d1, d2, list(ptrieObj.items(merged))))
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    ostore_path = tempfile.mkdtemp()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(2000))
+    ptrieObj = ptrie.Ptrie(pstor)
+    check(ptrieObj, {"a": 1, "c": 3}, {"b": 2, "d": 4}, ptrie.replace_value)
+    check(ptrieObj, {"b": 2, "d": 4}, {"a": 1, "c": 3}, ptrie.replace_value)
+    check(ptrieObj, {"ab": 1, "ad": 3}, {"ac": 2, "ae": 4, "b": 5},
+          ptrie.replace_value)
+    print "Interleaved siblings: OK"
+    random.seed(1)
+    for mergevalue in (ptrie.replace_value, None, add_values):
+        for r in range(rounds):
+            check(ptrieObj, random_dict(random.randint(0, 20)),
+                  random_dict(random.randint(0, 20)), mergevalue)
+        print "%s: OK" % getattr(mergevalue, '__name__', mergevalue)
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
@@ -14,6 +14,13 @@
 
 
 class OID(object):
+    ''' A reference to a record in a PStor: the record's ''oid'' value and
+    its ''size'' class. OIDs are hashed, compared and sorted on (size, oid),
+    so they can be used as dict keys; OIDs from different pstors can collide
+    and must not be mixed in the same dict. Millions of OIDs are alive at
+    once in a big structure, so instances have no __dict__ and share
+    (intern) their pstor and name strings. '''
+    __slots__ = ("_oid", "_size", "_pstor", "_name")
     Nulloid = None
 
     def __new__(cls, oid, size):
@@ -27,21 +34,36 @@ class OID(object):
                 OID.Nulloid._name = "Nulloid"
             return OID.Nulloid
         else:
-            return super(OID, cls).__new__(cls)
+            # Set here rather than in __init__(), as unpickling only calls
+            # __new__() with __getnewargs__() and then __setstate__().
+            o = super(OID, cls).__new__(cls)
+            o._oid = oid
+            o._size = size
+            o._pstor = None
+            o._name = "anonymous"
+            return o
 
     def __init__(self, oid, size):
         if self is OID.Nulloid:
             return
         if oid == 0:
             raise RuntimeError("0 is an invalid oid value!")
-        self._oid = oid
-        self._size = size
-        self._pstor = None
-        self._name = "anonymous"
 
     def __getnewargs__(self):
         return (self._oid, self._size)
 
+    def __getstate__(self):
+        return (self._pstor, self._name)
+
+    def __setstate__(self, state):
+        if self is OID.Nulloid:
+            return
+        if isinstance(state, dict):
+            # Pickled by an older OID that had a __dict__
+            state = (state.get("_pstor"), state.get("_name", "anonymous"))
+        self._pstor = _intern(state[0])
+        self._name = _intern(state[1])
+
     @property
     def oid(self):
         return self._oid
@@ -55,7 +77,7 @@ class OID(object):
     def name(self, oname):
         if self is OID.Nulloid:
             raise RuntimeError("Nulloid is read-only!")
-        self._name = oname
+        self._name = _intern(oname)
     @property
     def pstor(self):
         return self._pstor
@@ -63,7 +85,40 @@ class OID(object):
     def pstor(self, pstor):
         if self is OID.Nulloid:
             raise RuntimeError("Nulloid is read-only!")
-        self._pstor = pstor
+        self._pstor = _intern(pstor)
+
+    def __hash__(self):
+        return hash((self._size, self._oid))
+
+    def __eq__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return self._oid == other._oid and self._size == other._size
+
+    def __ne__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return self._oid != other._oid or self._size != other._size
+
+    def __lt__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return (self._size, self._oid) < (other._size, other._oid)
+
+    def __le__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return (self._size, self._oid) <= (other._size, other._oid)
+
+    def __gt__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return (self._size, self._oid) > (other._size, other._oid)
+
+    def __ge__(self, other):
+        if not isinstance(other, OID):
+            return NotImplemented
+        return (self._size, self._oid) >= (other._size, other._oid)
 
     def __str__(self):
         if self is OID.Nulloid:
@@ -75,17 +130,25 @@ class OID(object):
     def __nonzero__(self):
         return self is not OID.Nulloid
 
+def _intern(s):
+    ''' Returns the one shared copy of string ''s''. Every OID of a pstor
+    then refers to the same pstor and type name strings. '''
+    if type(s) is str:
+        return intern(s)
+    return s
+
 # Create OID.Nulloid
 OID(0, 0)
 
 if __name__ == "__main__":
+    import sys
     import pickle
 
     r0 = OID(0, 0)
     print bool(r0)
     print r0 is OID.Nulloid  # should print True
-    r2 = OID(0, 32)
-    r3 = OID(0, 32)
+    r2 = OID(1, 32)
+    r3 = OID(1, 32)
     print r2 is r3              # should print False
     print bool(r2)
 
@@ -95,3 +158,42 @@ if __name__ == "__main__":
     print r0_recovered is OID.Nulloid        # should print True
     print bool(r0_recovered)
 
+    r4 = OID(0x40, 32)
+    r4.pstor, r4.name = "/tmp/pstor", "ptrieNode"
+    r4_recovered = pickle.loads(pickle.dumps(r4, 2))
+    print r4_recovered == r4, r4_recovered is not r4     # True True
+    print r4_recovered.name is r4.name                   # True (interned)
+    print len({r4: 1, r4_recovered: 2}), r0 < r4         # 1 True
+
+    # Memory used by a million OIDs, against OIDs with a __dict__ and a
+    # private copy of their strings (what unpickling each record gave).
+    class DictOID(object):
+        def __init__(self, oid, size, pstor, name):
+            self._oid, self._size = oid, size
+            self._pstor, self._name = pstor, name
+    def footprint(oids):
+        ''' Bytes used by ''oids'', counting each distinct string once '''
+        seen = set()
+        total = 0
+        for o in oids:
+            total += sys.getsizeof(o)
+            if hasattr(o, "__dict__"):
+                total += sys.getsizeof(o.__dict__)
+            for s in (o._pstor, o._name):
+                if id(s) not in seen:
+                    seen.add(id(s))
+                    total += sys.getsizeof(s)
+        return total
+    n = 100000
+    pstor = "/var/lib/persistds/ostore/pstor-0001"
+    copy = lambda s: (s + ".")[:-1]
+    old = [DictOID(i, 32, copy(pstor), copy("ptrieNode"))
+           for i in xrange(1, n + 1)]
+    new = []
+    for i in xrange(1, n + 1):
+        o = OID(i, 32)
+        o.pstor, o.name = copy(pstor), copy("ptrieNode")
+        new.append(o)
+    mb = lambda nbytes: nbytes * (1000000.0 / n) / (1 << 20)
+    print "MB per million OIDs: __dict__ %.1f, slotted %.1f" % (
+        mb(footprint(old)), mb(footprint(new)))
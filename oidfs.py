@@ -41,11 +41,11 @@ class OidFS(object):
     rootoid_filename = "root-oid"
     oidtable_pstor_dir = "pds-storage"
 
-    def _getPStor(self, pstorpath):
+    def _getPStor(self, pstorpath, cache):
         ''' Creates a PStructStor to store Oids '''
         if not os.path.isdir(pstorpath):
             os.mkdir(pstorpath)
-        return pstructstor.PStructStor.mkpstor(pstorpath)
+        return pstructstor.PStructStor.mkpstor(pstorpath, cache)
 
     def _writeRootoid(self):
         ''' writes the root OID to file '''
@@ -70,7 +70,9 @@ class OidFS(object):
             rootoid = pdscache.read_oid(rootoid)
         return rootoid
 
-    def __init__(self, storpath):
+    def __init__(self, storpath, cache=None):
+        ''' ''cache'' is the PDSCache for OidFS's internal Ptrie. None means
+        pdscache.default_meta_cache(), which is not shared with user data. '''
         if not os.path.isabs(storpath):
             raise ValueError("storpath for OidFS must be absolute")
         if not os.path.isdir(storpath):
@@ -78,7 +80,9 @@ class OidFS(object):
         self._storpath = storpath
         # Get a PStructStor to store our OID Ptrie
         pstorPath = os.path.join(storpath, OidFS.oidtable_pstor_dir)
-        self._oidPstor = self._getPStor(pstorPath)
+        if cache is None:
+            cache = pdscache.default_meta_cache()
+        self._oidPstor = self._getPStor(pstorPath, cache)
         # Use a Ptrie as our oid table
         self._ptrieObj = ptrie.Ptrie(self._oidPstor)
         # Create or find the root of OID trie: The root OID is saved in a file
@@ -115,7 +119,7 @@ class OidFS(object):
         if not oidnode:
             return oidnode
         fields = self._ptrieObj.getfields(oidnode)
-        coid = fields['value']
+        coid = fields.value
         return coid
 
     def delete(self, oidname):
@@ -178,5 +182,5 @@ class OidFS(object):
         (alphabetical) order. An Oid record is an (oidname, oid) tuple.'''
         for node in self._ptrieObj.dfiter(self._rootoid):
             f = self._ptrieObj.getfields(node)
-            if f['final']:
-                yield (f['prefix'], f['value'],)
+            if f.final:
+                yield (f.prefix, f.value,)
@@ -7,12 +7,16 @@ from oidfs import OidFS
 # pstructstor and a oidfs. The oidfs thus created only manages OIDs in
 # the same pstor.
 #
+# ''cache'' is the PDSCache for user data, ''meta_cache'' the one for oidfs's
+# internal name trie. None means the default cache (see pdscache).
+#
 def init_ostore(ostore_path=os.path.join(os.environ['HOME'],
-                                         "local/run/test_ostore")):
+                                         "local/run/test_ostore"),
+                cache=None, meta_cache=None):
     if not os.path.isdir(ostore_path):
         os.makedirs(ostore_path)
-    pstor = PStructStor.mkpstor(os.path.join(ostore_path, "pstor"))
-    oidfs = OidFS(os.path.join(ostore_path, "oidfs"))
+    pstor = PStructStor.mkpstor(os.path.join(ostore_path, "pstor"), cache)
+    oidfs = OidFS(os.path.join(ostore_path, "oidfs"), meta_cache)
     print "OStore: initialized %s" % ostore_path
     return (pstor, oidfs)
 
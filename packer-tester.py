@@ -0,0 +1,82 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Packs records with FieldPacker and checks that they unpack to the same
+# fields, whole and field by field: OIDs with short and long names, local
+# and foreign pstors, many fields and large fields. Then stores records that
+# refer to a PStruct with a long name, and loads them back.
+#
+# Usage: packer-tester.py
+
+
+import shutil
+import tempfile
+import ostore
+import pdscache
+import persistds
+from oid import OID
+from pstructstor import FieldPacker
+
+
+def mkoid(oidval, size, name, pstor):
+    o = OID(oidval, size)
+    o.name = name
+    o.pstor = pstor
+    return o
+
+def same(f1, f2):
+    if isinstance(f1, OID):
+        return (isinstance(f2, OID) and f1 == f2 and f1.name == f2.name and
+                f1.pstor == f2.pstor)
+    return f1 == f2
+
+def check(packer, ofields, stordir):
+    buf = packer.pack(ofields, stordir)
+    for got in (packer.unpack(buf, stordir),
+                [packer.unpack_fields(buf, [i], stordir)[i]
+                 for i in range(len(ofields))]):
+        if len(got) != len(ofields) or not all(map(same, ofields, got)):
+            raise AssertionError("Fields differ: %r" % (ofields,))
+
+
+if __name__ == "__main__":
+    packer = FieldPacker()
+    stordir = "/some/pstor"
+    for namelen in (1, 255, 256, 300, 0xffff, 0x10000):
+        name = "n" * namelen
+        check(packer, [mkoid(7, 64, name, stordir)], stordir)
+        check(packer, [mkoid(7, 64, name, "/other"), "x", 1], stordir)
+    check(packer, [OID.Nulloid, None, "", u"u", (1, 2), {"a": [1]}], stordir)
+    check(packer, range(300), stordir)
+    check(packer, ["x" * 70000, mkoid(3, 128, "big", stordir)], stordir)
+    print "FieldPacker: OK"
+    ostore_path = tempfile.mkdtemp()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(100))
+    longPS = persistds.PStruct.mkpstruct("l" * 300, (("value", None),))
+    refPS = persistds.PStruct.mkpstruct("ref", (("target", None),))
+    refs = [refPS.make(pstor, longPS.make(pstor, i)) for i in range(10)]
+    for i, r in enumerate(refs):
+        ofs.store(r, "ref%d" % i)
+    ofs.close()
+    pstor.close()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(100))
+    for i in range(10):
+        target = refPS.getfield(pstor, ofs.load("ref%d" % i), "target")
+        if longPS.getfield(pstor, target, "value") != i:
+            raise AssertionError("Bad record %d" % i)
+    print "Long PStruct names: OK"
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
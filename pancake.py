@@ -96,8 +96,8 @@ class Pancake(object):
         prevTrie = self.plistObj.car(curlist)
         for node in self.ptrieObj.bfiter(prevTrie):
             f = self.ptrieObj.getfields(node)
-            if f['final']:
-                prevseq = f['prefix']
+            if f.final:
+                prevseq = f.prefix
                 #print "Flipping prevseq '%s'" % prevseq
                 # Now do prefix reversals on ''prevseq'' and insert the
                 # resulting sequence into ''pcakeTrie'' if it is not a duplicate.
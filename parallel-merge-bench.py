@@ -0,0 +1,60 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Merges k stored tries of random words into one with merge_many(), and
+# with parallel_merge() using 1 to maxprocs worker processes. The letters
+# of the words are spread evenly, so that there are 16 partitions.
+#
+# Usage: parallel-merge-bench.py numtries numwords cachesize [maxprocs]
+
+
+import os
+import random
+import operator
+import ptrie
+import benchutil
+
+
+if __name__ == "__main__":
+    ntries, nwords, cachesize, maxprocs = benchutil.getargs(
+        "numtries numwords cachesize [maxprocs]", 3, (4,))
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    for i in range(ntries):
+        words = sorted(benchutil.mkwords(nwords))
+        trie = ptrieObj.build_from_sorted([(w, 1) for w in words])
+        store.ofs.store(trie, "part%d" % i)
+    store.ofs.gc()
+    tries = [store.ofs.load("part%d" % i) for i in range(ntries)]
+    print "%-20s %10s" % ("", "seconds")
+    def merge_many():
+        return ptrieObj.merge_many(tries, operator.add)
+    elapsed, trie = benchutil.timed(merge_many)
+    print "%-20s %10.1f" % ("merge_many", elapsed)
+    expected = list(ptrieObj.items(trie))
+    procs = 1
+    while procs <= maxprocs:
+        workdir = os.path.join(store.path, "work%d" % procs)
+        os.mkdir(workdir)
+        def parallel_merge():
+            return ptrieObj.parallel_merge(tries, workdir, operator.add,
+                                           procs)
+        elapsed, trie = benchutil.timed(parallel_merge)
+        print "%-20s %10.1f" % ("parallel_merge(%d)" % procs, elapsed)
+        benchutil.check("parallel_merge(%d)" % procs,
+                        list(ptrieObj.items(trie)), expected)
+        procs *= 2
+    store.close()
@@ -0,0 +1,71 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Measures Ptrie lookups in a trie whose values are heavy payloads, with
+# partial field decoding (only prefix, lcp and rsp of the nodes on the
+# search path are unpacked) and with whole records unpacked. The cache is
+# small so that most nodes are read back from storage.
+#
+# Usage: partial-bench.py numwords payloadsize cachesize
+
+
+import random
+import ptrie
+import pstructstor
+import benchutil
+
+
+def lookups(ptrieObj, root, words):
+    ''' Returns the microseconds per lookup of ''words'' and the values
+    of the nodes found. Only the lookups are timed. '''
+    def find():
+        nodes = []
+        for w in words:
+            node = ptrieObj.find(root, w)
+            if not node:
+                raise RuntimeError("%s not found" % w)
+            nodes.append(node)
+        return nodes
+    elapsed, nodes = benchutil.timed(find)
+    values = [ptrieObj.getfields(n, ('value',))[0] for n in nodes]
+    return elapsed * 1000000 / len(words), values
+
+
+if __name__ == "__main__":
+    nwords, psize, cachesize = benchutil.getargs(
+        "numwords payloadsize cachesize", 3)
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    words = benchutil.mkwords(nwords, "abcdefgh", 8, 8)
+    root = ptrie.Nulltrie
+    for i, w in enumerate(words):
+        # A payload that is costly to unpickle
+        payload = [(j, str(j)) for j in range(i, i + psize / 16)]
+        root = ptrieObj.insert(root, w, payload)
+    store.ofs.store(root, "payloads")
+    store.ofs.gc()
+    root = store.ofs.load("payloads")
+    packer = pstructstor.PStructStor.default_packer
+    print "%-10s %12s" % ("decoding", "usec/lookup")
+    usec, partial = lookups(ptrieObj, root, words)
+    print "%-10s %12.1f" % ("partial", usec)
+    # Pretend no record can be partially unpacked
+    packer.partial = lambda strbuf: False
+    usec, whole = lookups(ptrieObj, root, words)
+    print "%-10s %12.1f" % ("whole", usec)
+    del packer.partial
+    benchutil.check("partial", partial, whole)
+    store.close()
@@ -12,8 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+import itertools
+import cPickle
 import weakref
+import threading
 from lnklist import *
+import cachepolicy
+import reccache
 import oid
 import persistds
 import pstructstor
@@ -26,29 +33,32 @@ class _CachedOid(object):
     in persistent storage (PStor), then it becomes a proxy with a "backup".
     '''
     # A strictly incrementing counter used to identify an OID. Also used
-    # as the hash key.
-    _seqcount = 0
+    # as the hash key. (next() of itertools.count is atomic)
+    _seqcounter = itertools.count(1)
 
     def __init__(self, pstor, o=None):
         ''' A "freshly" created _CachedOid doesn't have a "real" OID ''o'',
         it will be created when the coid is "flushed" to it pstor. On the
         other hand, a _CachedOid created from "backing" OID just need to save
         the ''o''. '''
-        _CachedOid._seqcount += 1
-        self.seqnum = _CachedOid._seqcount
+        self.seqnum = next(_CachedOid._seqcounter)
         assert(isinstance(pstor, pstructstor.PStructStor))
         if o is not None:
             assert(isinstance(o, oid.OID))
         self.pstor = pstor
         self.oid = o
+        # pstor.generation at the time ''oid'' was assigned. OIDs of older
+        # generations have been moved by the pstor's garbage collector.
+        self.generation = None
+        if o is not None:
+            self.generation = pstor.generation
         #print "Created coid %d" % self.seqnum
-        if _cprof:
-            _cprof.coidcnt += 1
 
 
 # The "centry" functions are helpers to manipulate the cache entries.
 class _CacheEntry(object):
-    __slots__ = ["seqnum", "ofields", "coidwref", "lnode"]
+    __slots__ = ["seqnum", "ofields", "coidwref", "lnode", "pstate", "dirty",
+                 "pins", "raw"]
 
     def __init__(self, coid, ofields):
         assert(isinstance(coid, _CachedOid))
@@ -57,27 +67,304 @@ class _CacheEntry(object):
         # Careful: circular reference here - (Don't define __del__)
         self.coidwref = weakref.ref(coid)
         self.lnode = ListEntry(self)
+        # Private state of the eviction policy
+        self.pstate = None
+        # Entry not written to PStor yet
+        self.dirty = coid.oid is None
+        # Pin count, a pinned entry is not known to the eviction policy
+        self.pins = 0
+        # Packed record of an entry whose fields are partially unpacked. The
+        # fields not unpacked yet are pstructstor.FieldPacker.unpacked.
+        self.raw = None
         #print "Cached coid %d <%s>" % (coid.seqnum, ofields)
-        if _cprof:
-            _cprof.centrycnt += 1
 
 
+class CacheMetrics(object):
+    ''' Always-on counters and latency histograms of a PDSCache. Counters are
+    plain attributes. A latency histogram has ''nbuckets'' buckets, bucket
+    i counts the calls that took less than 2**i microseconds (and at least
+    2**(i-1)), the last bucket also counts anything slower. Use snapshot()
+    and delta() to scrape the metrics. '''
+
+    counter_names = (
+        "coids",          # coids created
+        "centries",       # cache entries created
+        "hits",           # oidfields() served from cache
+        "misses",         # oidfields() of an evicted coid, re-read from PStor
+        "coldloads",      # coids created from saved oids (read lazily)
+        "rechits",        # records found in the record cache
+        "recmisses",      # records not found in the record cache
+        "recputs",        # evicted records put into the record cache
+        "writethroughs",  # coids written to PStor
+        "writebehinds",   # batches written by the background flusher
+        "fulls",          # times a full cache had to evict
+        "evictions",      # entries evicted
+        "sweeps",         # garbage sweeps
+        "dead_swept",     # garbage entries deleted by sweeps
+        "dead_evicted",   # garbage entries found among evicted entries
+        "prefetched",     # records prefetched by warm start
+    )
+    histogram_names = ("oidfields", "create_oid")
+    nbuckets = 24
+
+    def __init__(self, gauges=None):
+        ''' ''gauges'' is a function returning a dict of current values to
+        include in snapshots. '''
+        self._gauges = gauges
+        self.reset()
+
+    def reset(self):
+        for name in CacheMetrics.counter_names:
+            setattr(self, name, 0)
+        self.latency = dict([(name, [0] * CacheMetrics.nbuckets)
+                             for name in CacheMetrics.histogram_names])
+
+    def observe(self, name, seconds):
+        ''' Records a call of ''name'' that took ''seconds''. '''
+        bucket = int(seconds * 1000000).bit_length()
+        if bucket >= CacheMetrics.nbuckets:
+            bucket = CacheMetrics.nbuckets - 1
+        self.latency[name][bucket] += 1
+
+    def snapshot(self):
+        ''' Returns a dict of all counters, the latency histograms (under
+        "latency") and the current gauges. '''
+        snap = dict([(name, getattr(self, name))
+                     for name in CacheMetrics.counter_names])
+        snap["latency"] = dict([(name, list(hist))
+                                for name, hist in self.latency.items()])
+        if self._gauges:
+            snap.update(self._gauges())
+        return snap
+
+    def delta(self, since):
+        ''' Returns a snapshot where counters and histograms are relative to
+        an earlier snapshot ''since''. '''
+        snap = self.snapshot()
+        for name in CacheMetrics.counter_names:
+            snap[name] -= since[name]
+        for name, hist in snap["latency"].items():
+            old = since["latency"][name]
+            snap["latency"][name] = [n - o for n, o in zip(hist, old)]
+        return snap
+
+
+class _Flusher(threading.Thread):
+    ''' Background write-behind thread of a PDSCache. When the number of
+    dirty (unwritten) entries that are not pinned goes above the high
+    watermark, the coldest dirty entries are written to PStor until the
+    number drops to the low watermark. Entries stay in cache, they just
+    become clean, so that evicting them later costs nothing. Each batch is
+    written with the cache lock held: a foreground create() or lookup waits
+    for the batch being written, if any. '''
+
+    def __init__(self, cache, high, low, interval):
+        threading.Thread.__init__(self, name="pdscache-flusher")
+        self.daemon = True
+        self._pdscache = cache
+        self.high = high
+        self.low = low
+        self.interval = interval
+        self.stopping = False
+
+    def run(self):
+        cache = self._pdscache
+        idle_until = 0
+        while True:
+            with cache._lock:
+                while not self.stopping:
+                    now = time.time()
+                    if now < idle_until:
+                        cache._flushcond.wait(idle_until - now)
+                    elif cache._unpinned_dirty() > self.high:
+                        break
+                    else:
+                        cache._flushcond.wait(self.interval)
+                if self.stopping:
+                    return
+                coids = cache._cold_dirty_coids(cache._unpinned_dirty() -
+                                                self.low)
+                if not coids:
+                    # The dirty count includes entries whose coids are dead,
+                    # which are never written: sweep them out.
+                    cache._sweep_garbage()
+                    coids = cache._cold_dirty_coids(cache._unpinned_dirty() -
+                                                    self.low)
+                if not coids:
+                    # Nothing to write, don't check again before the next
+                    # interval.
+                    idle_until = time.time() + self.interval
+                    continue
+            # Write in batches, giving up the lock in between so that the
+            # foreground waits for one batch at most, not the whole lot.
+            batchsz = cache._flush_batch
+            for i in range(0, len(coids), batchsz):
+                with cache._lock:
+                    # The lock was given up since the coids were picked:
+                    # some may have been written or pinned since. A pinned
+                    # dirty coid may be about to change in place (see
+                    # ptrie.TransientPtrie), it must not be written.
+                    cache._write_coids([coid for coid in coids[i:i+batchsz]
+                                        if cache._flushable(coid)])
+                    cache.metrics.writebehinds += 1
+            del coids
+
+
+class _Prefetcher(threading.Thread):
+    ''' Background warm start of a PDSCache: reads the records listed in the
+    hot set manifest of a pstor, in storage order, into the record cache. '''
+
+    def __init__(self, cache, pstor, oids):
+        threading.Thread.__init__(self, name="pdscache-prefetcher")
+        self.daemon = True
+        self._pdscache = cache
+        self._pstor = pstor
+        self._oids = oids
+        self.stopping = False
+
+    def run(self):
+        self._pdscache._prefetch(self._pstor, self._oids, self)
+
+
+##
+# Concurrency model: any number of reader threads (oidfields, lookups) may
+# run at the same time as one writer thread (create_oid, write_coid). A
+# PDSCache has a single reentrant lock, held only while the cache dictionary,
+# the eviction policy and the metrics are touched. The lock is never held
+# during a disk read, so a miss in one thread doesn't stall hits in others.
+# It is held while records are written (evictions, write_coid() and the
+# batches of the background flusher), other threads wait for those.
+# Disk I/O is serialized per StorPool (one lock per record size class, see
+# fixszPDS), PStructStor stats have their own lock, and coid sequence numbers
+# come from an atomic counter. Writes never cross caches: an unwritten coid
+# of another cache is written before a coid of this cache refers to it, and
+# before this cache's lock is taken (see _write_foreign()). With a cache
+# lock held, a thread may take the PStructStor table lock (never the other
+# way round) and, when a record refers to a pstor that isn't open yet, the
+# lock of the default cache that the pstor is opened with (see
+# _cache_oid()). No other lock of a cache is taken with a cache lock held,
+# so caches whose structures refer to each other can't deadlock. Operations
+# that move OIDs (PStructStor.keepOids or OidFS.gc) and close() must not run
+# concurrently with readers.
+#
 class PDSCache(object):
     ''' Implements a cache for PDS. A PDS oid is always created in cache
     first. Access to an oid goes through the cache also. Cached oids are
-    flushed to PStor when cache is getting full. '''
+    flushed to PStor when cache is getting full.
+    A cache is attached to one or more PStructStors (see
+    PStructStor.mkpstor()), a coid is always cached by the cache of its
+    pstor. A PDSCache can be shared by threads, see the concurrency model
+    above. '''
+
+    # Hot set manifest file, in the pstor's directory
+    hotset_filename = "hotset"
 
-    def __init__(self, max_entries):
-        ''' A PDS cache of ''max_entries'' cache slots '''
+    def __init__(self, max_entries, policy="lru", flush_ratio=0.02,
+                 reccache_bytes=0, compress=True, hotset=0):
+        ''' A PDS cache of ''max_entries'' cache slots. ''policy'' is the
+        eviction policy, see cachepolicy.mkpolicy(). When the cache is full,
+        a batch of ''flush_ratio'' * ''max_entries'' entries (at least one)
+        is evicted at a time. A non-zero ''reccache_bytes'' adds a second
+        level RecordCache of that many bytes, which keeps evicted records
+        packed (and ''compress''ed) in memory. A non-zero ''hotset'' turns
+        on warm start: the OIDs of up to ''hotset'' most recently used clean
+        entries of a pstor are saved when the pstor (or the cache) is closed,
+        and prefetched when the pstor is opened again. '''
         self._max_entries = max_entries
+        self._flush_batch = max(1, int(max_entries * flush_ratio))
         self._num_entries = 0
         # Cache is implemented as a dictionary
         self._cache = {}
-        # Least recently used cache entries
-        self._lrulist = ListEntry(None)
+        # The eviction policy orders the cache entries
+        self._policy = cachepolicy.mkpolicy(policy, max_entries)
+        self.metrics = CacheMetrics(self._gauges)
+        # Second level cache
+        self._reccache = None
+        if reccache_bytes:
+            self._reccache = reccache.RecordCache(reccache_bytes, compress)
         # Number of entries swept (garbage) during last sweeping
         self._last_swept = None
         self._full_since_last_swept = 0
+        # Number of entries not written to PStor yet, and how many of those
+        # are pinned (the flusher leaves them alone)
+        self._num_dirty = 0
+        self._num_pinned_dirty = 0
+        # Pinned coids (strong references) by seqnum. Pinned entries are
+        # kept in addition to the ''max_entries'' slots.
+        self._pinned = {}
+        self._lock = threading.RLock()
+        # Background write-behind flusher, see start_flusher()
+        self._flushcond = threading.Condition(self._lock)
+        self._flusher = None
+        # Warm start
+        self._hotset_size = hotset
+        self._prefetchers = {}
+        # The pstors opened with this cache
+        self._pstors = weakref.WeakKeyDictionary()
+
+    def start_flusher(self, high=0.5, low=0.25, interval=1.0):
+        ''' Starts a background thread that writes cold dirty entries ahead of
+        time, whenever more than ''high'' * max_entries entries are dirty,
+        until no more than ''low'' * max_entries are dirty. The flusher also
+        checks every ''interval'' seconds. Entries are written in batches
+        of flush_ratio * max_entries with the cache lock held, so the
+        foreground may wait for one batch write (see _Flusher). '''
+        if not 0 <= low < high <= 1:
+            raise ValueError("Bad watermarks: need 0 <= low < high <= 1")
+        with self._lock:
+            if self._flusher:
+                raise RuntimeError("Flusher already started")
+            self._flusher = _Flusher(self, int(self._max_entries * high),
+                                     int(self._max_entries * low), interval)
+            self._flusher.start()
+
+    def stop_flusher(self):
+        ''' Stops the background flusher, if any. '''
+        with self._lock:
+            flusher = self._flusher
+            if not flusher:
+                return
+            flusher.stopping = True
+            self._flushcond.notify()
+            self._flusher = None
+        flusher.join()
+
+    def _gauges(self):
+        ''' Current values reported with metrics snapshots. '''
+        gauges = {"capacity": self._max_entries,
+                  "entries": self._num_entries,
+                  "pinned": len(self._pinned),
+                  "dirty": self._num_dirty,
+                  "pinned_dirty": self._num_pinned_dirty}
+        if self._reccache is not None:
+            gauges["recbytes"] = self._reccache.nbytes
+            gauges["records"] = len(self._reccache)
+        return gauges
+
+    def _unpinned_dirty(self):
+        ''' Number of dirty entries that are not pinned, the ones the
+        flusher may write (those of dead coids included). '''
+        return self._num_dirty - self._num_pinned_dirty
+
+    def _cold_dirty_coids(self, n):
+        ''' Returns up to ''n'' live, dirty coids, coldest first. '''
+        coids = []
+        if n <= 0:
+            return coids
+        for ce in self._policy.entries():
+            if not ce.dirty:
+                continue
+            coid = ce.coidwref()
+            if coid:
+                coids.append(coid)
+                if len(coids) >= n:
+                    break
+        return coids
+
+    def _flushable(self, coid):
+        ''' Returns True if ''coid'' is in cache, dirty and not pinned. '''
+        centry = self._cache.get(coid.seqnum)
+        return centry is not None and centry.dirty and not centry.pins
 
     def _add(self, coid, ofields):
         ''' Add a PDS instance to cache. Use the coid's seqnum as the
@@ -88,24 +375,42 @@ class PDSCache(object):
             assert(self._num_entries < self._max_entries)
         centry = _CacheEntry(coid, ofields)
         self._addcentry(centry)
+        self.metrics.centries += 1
         return centry
 
     def _addcentry(self, centry):
         assert(self._num_entries < self._max_entries)
         self._num_entries += 1
+        if centry.dirty:
+            self._num_dirty += 1
         self._cache[centry.seqnum] = centry
-        # Most recent entries are added to the tail
-        list_add_tail(centry.lnode, self._lrulist)
+        self._policy.add(centry)
 
-    def _delcentry(self, centry):
+    def _delcentry(self, centry, evicted=False):
+        ''' Deletes ''centry'' from cache. An ''evicted'' entry has already
+        been removed from the eviction policy. '''
         #print "delcentry: %d (%s)" % (centry.seqnum, centry.ofields[0])
-        # Delete from list
-        list_del(centry.lnode)
+        if not evicted:
+            self._policy.remove(centry)
         # This breaks the reference cycle: (''data'' refers to centry)
         # Is this needed? If it doesn't help performance then get rid of it.
         centry.lnode.data = None
         del self._cache[centry.seqnum]
         self._num_entries -= 1
+        if centry.dirty:
+            self._num_dirty -= 1
+
+    def _set_oid(self, coid, o):
+        ''' Gives a coid its backing OID ''o''. The cache entry of coid, if
+        any, is now clean. '''
+        coid.oid = o
+        coid.generation = coid.pstor.generation
+        centry = self._cache.get(coid.seqnum)
+        if centry is not None and centry.dirty:
+            centry.dirty = False
+            self._num_dirty -= 1
+            if centry.pins:
+                self._num_pinned_dirty -= 1
 
     def _freeup_centries(self):
         ''' Try to free up some cache entries: First collect all the garbages.
@@ -122,8 +427,7 @@ class PDSCache(object):
             if self._last_swept > 0:
                 return
         # Now either there is no garbage or we skipped sweeping
-        self._full_since_last_swept += 1
-        self._flush_lru_entry()
+        self._full_since_last_swept += self._flush_victims()
 
     def _sweep_garbage(self):
         ''' Go through all the cache entries and sweeps (delete) any cache
@@ -138,11 +442,11 @@ class PDSCache(object):
         rn = 1
         while True:
             num_swept = 0
-            # We iteration throught the LRU list backwards, garbages are more
-            # likely to be situated at the most recent end. This heuristic
-            # only works for Python because of its reference counting GC.
-            for le in list_prev_iter(self._lrulist):
-                ce = le.data
+            # We iteration throught the cache entries backwards, garbages are
+            # more likely to be situated at the most recent end. This
+            # heuristic only works for Python because of its reference
+            # counting GC.
+            for ce in reversed(self._policy.entries()):
                 coid = ce.coidwref()
                 if not coid:
                     self._delcentry(ce)
@@ -155,16 +459,14 @@ class PDSCache(object):
             total_swept += num_swept
         self._last_swept = total_swept
         #print "Sweep: %d rounds %d dead coids" % (rn, total_swept)
-        if _cprof:
-            _cprof.sweepcnt += 1
-            _cprof.deadcoid1cnt += total_swept
+        self.metrics.sweeps += 1
+        self.metrics.dead_swept += total_swept
         return total_swept
 
     def dump_lrulist(self):
-        print "LRU List: [",
-        for e in list_next_iter(self._lrulist):
-            centry = e.data
-            s = centry.ofields[0]
+        print "%s: [" % self._policy,
+        for centry in self._policy.entries():
+            s = self._complete(centry)[0]
             if s == "":
                 s = '@'
             if not centry.coidwref():
@@ -172,34 +474,181 @@ class PDSCache(object):
             print s,
         print "]"
 
-    def _flush_lru_entry(self):
-        ''' Free up some cache entries by "flusing" the least recently used
-        entries to PStor '''
-        # least recently used entries are from head of list
-        if _cprof:
-            _cprof.fullcnt += 1
-        if list_empty(self._lrulist):
-            return
-        # LRU entry is next of list head
-        node = self._lrulist._next
-        centry = node.data
-        self._flush(centry)
+    def _flush_victims(self):
+        ''' Free up some cache entries by "flusing" a batch of victims chosen
+        by the eviction policy (the least recently used entries for LRU) to
+        PStor. Returns the number of entries evicted. '''
+        self.metrics.fulls += 1
+        victims = []
+        coids = []
+        while len(victims) < self._flush_batch:
+            centry = self._policy.evict()
+            if centry is None:
+                break
+            victims.append(centry)
+            coid = centry.coidwref()
+            if coid:
+                coids.append(coid)
+            else:
+                # the coid is garbage.
+                self.metrics.dead_evicted += 1
+        # Live coids are written through to PStor in one go. Entries must
+        # stay in cache until they are written.
+        self._write_coids(coids)
+        if self._reccache is not None:
+            # All live victims are clean now, keep their records around.
+            for coid in coids:
+                self._put_record(coid)
+        for centry in victims:
+            self._delcentry(centry, evicted=True)
+        self.metrics.evictions += len(victims)
+        return len(victims)
 
-    def _flush(self, centry):
-        ''' Flushes a cache entry ''centry'' to PStor and delete the entry. '''
-        coid = centry.coidwref()
-        if coid:
-            # coid is valid, write-through to PStor
-            self._write_coid(coid)
+    def _put_record(self, coid):
+        ''' Puts the record of the clean coid ''coid'' in the record cache.
+        The packed record of a partially unpacked entry is put as it is, the
+        fields of other entries are packed. '''
+        if coid.generation != coid.pstor.generation:
+            # A stale coid, its OID may well be reused by now
+            return
+        centry = self._cache[coid.seqnum]
+        if centry.raw is not None:
+            self._reccache.put_raw(coid.oid, centry.raw)
         else:
-            # the coid is garbage.
-            if _cprof:
-                _cprof.deadcoid2cnt += 1
-            #print "Flush: Seeing garbage coid %d" % centry.seqnum
-            pass
-        # Delete cache entry
-        self._delcentry(centry)
-        #print "Flushed centry %d" % centry.seqnum
+            self._reccache.put(coid.oid, [f.oid if isinstance(f, _CachedOid)
+                                          else f for f in centry.ofields])
+        self.metrics.recputs += 1
+
+    def _cached_rec(self, coid, indexes):
+        ''' Returns (fields, packed record) of ''coid'' from the record cache,
+        as _read() does, or None if not found there. '''
+        if self._reccache is None:
+            return None
+        raw = self._reccache.get_raw(coid.oid)
+        if raw is None:
+            self.metrics.recmisses += 1
+            return None
+        self.metrics.rechits += 1
+        return self._unpack_raw(coid, raw, indexes)
+
+    def discard_pstor(self, pstor):
+        ''' Forgets the cached records and the hot set of ''pstor''. Must be
+        called when the OIDs of ''pstor'' are moved. '''
+        self._stop_prefetch(pstor)
+        with self._lock:
+            if self._reccache is not None:
+                self._reccache.discard_pstor(pstor._stordir)
+        path = PDSCache._hotset_path(pstor)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Warm start
+    @staticmethod
+    def _hotset_path(pstor):
+        return os.path.join(pstor._stordir, PDSCache.hotset_filename)
+
+    def _hotsets(self, pstors=None):
+        ''' Returns a dict of pstor => hot set, for the pstors with clean
+        entries in cache (only those in ''pstors'' if given). A hot set is a
+        list of (size, oid) pairs, most recently used first: pinned entries,
+        cache entries and then the record cache. '''
+        hotsets = {}
+        def addoid(pstor, o):
+            if pstors is not None and pstor not in pstors:
+                return
+            hotset = hotsets.setdefault(pstor, [])
+            if len(hotset) < self._hotset_size:
+                hotset.append((o.size, o.oid))
+        centries = [self._cache[seqnum] for seqnum in self._pinned]
+        centries.extend(reversed(self._policy.entries()))
+        for ce in centries:
+            coid = ce.coidwref()
+            if ce.dirty or not coid:
+                continue
+            if coid.generation == coid.pstor.generation:
+                addoid(coid.pstor, coid.oid)
+        if self._reccache is not None:
+            for pstor in set(hotsets.keys()) | set(pstors or []):
+                for size, oidval in self._reccache.oids(pstor._stordir):
+                    hotset = hotsets.setdefault(pstor, [])
+                    if len(hotset) >= self._hotset_size:
+                        break
+                    hotset.append((size, oidval))
+        return hotsets
+
+    def _save_hotsets(self, pstors=None):
+        with self._lock:
+            hotsets = self._hotsets(pstors)
+        for pstor, hotset in hotsets.items():
+            path = PDSCache._hotset_path(pstor)
+            fobj = open(path + ".tmp", "wb")
+            cPickle.dump(hotset, fobj, 2)
+            fobj.close()
+            os.rename(path + ".tmp", path)
+
+    def attach(self, pstor):
+        ''' Called when the pstor ''pstor'' is opened with this cache. With
+        warm start on, the records in the hot set manifest of ''pstor'' are
+        prefetched by a background thread, see warm_start(). '''
+        self._pstors[pstor] = True
+        if self._hotset_size:
+            self.warm_start(pstor)
+
+    def detach(self, pstor):
+        ''' Called when the pstor ''pstor'' is closed. Stops prefetching
+        and, with warm start on, saves the hot set manifest of ''pstor''. '''
+        self._pstors.pop(pstor, None)
+        self._stop_prefetch(pstor)
+        if self._hotset_size:
+            self._save_hotsets([pstor])
+
+    def warm_start(self, pstor, background=True):
+        ''' Prefetches the records in the hot set manifest of ''pstor'' into
+        the record cache, in storage (size class, then oid) order. Without a
+        record cache, the records are still read, which warms up the OS
+        page cache. Prefetching stops when the record cache is full. Returns
+        the number of records to prefetch. '''
+        path = PDSCache._hotset_path(pstor)
+        if not os.path.exists(path):
+            return 0
+        fobj = open(path, "rb")
+        oids = sorted(set(cPickle.load(fobj)))
+        fobj.close()
+        if not background:
+            self._prefetch(pstor, oids, None)
+            return len(oids)
+        self._stop_prefetch(pstor)
+        prefetcher = _Prefetcher(self, pstor, oids)
+        with self._lock:
+            self._prefetchers[pstor] = prefetcher
+        prefetcher.start()
+        return len(oids)
+
+    def _stop_prefetch(self, pstor):
+        with self._lock:
+            prefetcher = self._prefetchers.pop(pstor, None)
+        if prefetcher:
+            prefetcher.stopping = True
+            prefetcher.join()
+
+    def _prefetch(self, pstor, oids, prefetcher):
+        for size, oidval in oids:
+            if prefetcher and prefetcher.stopping:
+                return
+            o = oid.OID(oidval, size)
+            pstor._stampOid(o)
+            try:
+                raw = pstor.getrawrec(o)
+            except ValueError:
+                # Beyond the end of its storage file, the manifest is stale
+                return
+            if self._reccache is None:
+                continue
+            with self._lock:
+                self._reccache.put_raw(o, raw)
+                self.metrics.prefetched += 1
+                if self._reccache.nbytes >= self._reccache.max_bytes:
+                    return
 
     def _write_coid(self, coid):
         ''' Write the cached oid ''coid'' to PStor. Return the resulting OID.
@@ -214,66 +663,208 @@ class PDSCache(object):
             # This coid has already been written (to PStor). It won't ever
             # change.
             return coid.oid
-        # Now this coid MUST be in cache, otherwise it would be a "phantom" coid...
-        assert(coid.seqnum in self._cache)
-        centry = self._cache[coid.seqnum]
-        # ''ofields'' MUST contain only native Python objects or a "real" OID
-        ofields = centry.ofields[:]
-        #print "Writing coid %d: %s" % (coid.seqnum, ofields)
-        for i, f in enumerate(ofields):
-            if isinstance(f, _CachedOid):
-                # Note that we substitute a coid with the "real" OID created
-                # through _write_coid. Also note that the original coid is
-                # modified (added a ''oid'').
-                ofields[i] = self._write_coid(f)
-        o = coid.pstor.create(ofields)
-        assert(hasattr(coid, "name"))
-        ps = persistds.PStruct.mkpstruct(coid.name)
-        ps.initOid(o)
-        coid.oid = o
-        if _cprof:
-            _cprof.wtcnt += 1
+        self._write_coids([coid])
         return coid.oid
 
+    def _gather_dirty(self, coids):
+        ''' Returns the unwritten coids reachable from ''coids'' in
+        post-order (children before parents). This is done with an explicit
+        stack, a long plist or a deep trie can't overflow the Python
+        stack. '''
+        dirty = []
+        seen = set()
+        # (coid, expanded): a coid is appended to ''dirty'' when it is popped
+        # the second time, that is after all its children.
+        stack = [(coid, False) for coid in reversed(coids)]
+        while stack:
+            coid, expanded = stack.pop()
+            if expanded:
+                dirty.append(coid)
+                continue
+            if coid is oid.OID.Nulloid or coid.oid is not None:
+                continue
+            if coid.seqnum in seen:
+                continue
+            # A "foreign" coid was written before anything referred to it,
+            # see _write_foreign().
+            assert(coid.pstor.cache is self)
+            seen.add(coid.seqnum)
+            # Now this coid MUST be in cache, otherwise it would be a
+            # "phantom" coid...
+            assert(coid.seqnum in self._cache)
+            stack.append((coid, True))
+            for f in reversed(self._cache[coid.seqnum].ofields):
+                if isinstance(f, _CachedOid):
+                    stack.append((f, False))
+        return dirty
+
+    # Maximum number of records written with one PStructStor.create_many()
+    bulk_limit = 65536
+
+    def _write_coids(self, coids):
+        ''' Writes the cached oids ''coids'', and every unwritten coid they
+        refer to, to PStor. Unwritten coids are collected in post-order and
+        written with one PStructStor.create_many() per pstor (for up to
+        ''bulk_limit'' records), so that records of a size class are appended
+        together and parents land after their children. '''
+        # pstor => (coids, list of ofields, {seqnum: index in batch})
+        pending = {}
+        for coid in self._gather_dirty(coids):
+            if coid.pstor not in pending:
+                pending[coid.pstor] = ([], [], {})
+            batch = pending[coid.pstor]
+            # ''ofields'' MUST contain only native Python objects, a "real"
+            # OID or a reference to an earlier record of the batch
+            ofields = self._cache[coid.seqnum].ofields[:]
+            for i, f in enumerate(ofields):
+                if not isinstance(f, _CachedOid):
+                    continue
+                if f.oid is None:
+                    fbatch = pending[f.pstor]
+                    if fbatch is batch:
+                        ofields[i] = pstructstor.BatchRef(batch[2][f.seqnum])
+                        continue
+                    # A child in another pstor has to be written first
+                    self._commit_batch(f.pstor, fbatch)
+                    del pending[f.pstor]
+                ofields[i] = f.oid
+            batch[2][coid.seqnum] = len(batch[1])
+            batch[0].append(coid)
+            batch[1].append(ofields)
+            if len(batch[1]) >= PDSCache.bulk_limit:
+                self._commit_batch(coid.pstor, batch)
+                del pending[coid.pstor]
+        for pstor, batch in pending.items():
+            self._commit_batch(pstor, batch)
+
+    def _commit_batch(self, pstor, batch):
+        ''' Creates the batch of coids in ''pstor'' and gives each coid its
+        backing OID. '''
+        coids, recs, unused = batch
+        oids = pstor.create_many(recs, [coid.name for coid in coids])
+        for coid, o in zip(coids, oids):
+            self._set_oid(coid, o)
+            self.metrics.writethroughs += 1
+
     def _write_all_coids(self):
         ''' Collect garbage and write out all coids. '''
         self._sweep_garbage()
         # Now there is no more garbage. We flush out all coids.
-        for le in list_next_iter(self._lrulist):
-            ce = le.data
+        coids = self._pinned.values()
+        for ce in self._policy.entries():
             coid = ce.coidwref()
             assert(coid)
-            self._write_coid(coid)
+            coids.append(coid)
+        self._write_coids(coids)
 
     def close(self):
-        ''' Destroys cache '''
-        self._write_all_coids()
-        self._cache = {}
-        _list_init(self._lrulist)
+        ''' Destroys cache. The pstors still open with this cache are
+        flushed and forgotten (see PStructStor.forget()), so that their
+        stordirs can be opened again with another cache. '''
+        self.stop_flusher()
+        for pstor in self._prefetchers.keys():
+            self._stop_prefetch(pstor)
+        with self._lock:
+            self._write_all_coids()
+            if self._hotset_size:
+                self._save_hotsets()
+            self._cache = {}
+            self._pinned = {}
+            self._num_entries = 0
+            self._num_dirty = 0
+            self._num_pinned_dirty = 0
+            self._policy = cachepolicy.mkpolicy(self._policy.__class__,
+                                                self._max_entries)
+            if self._reccache is not None:
+                self._reccache.clear()
+        for pstor in self._pstors.keys():
+            pstor.flush()
+            pstructstor.PStructStor.forget(pstor)
 
-    def create(self, ofields, pstor):
-        ''' Interface to PersistDS's OID create '''
-        coid = _CachedOid(pstor)
-        self._add(coid, ofields)
-        return coid
+    def write_coid(self, coid):
+        ''' Writes through a cached oid ''coid''. Return the resulting oid. '''
+        if coid is not oid.OID.Nulloid and coid.pstor.cache is not self:
+            # A "foreign" coid is written by the cache of its own pstor
+            return coid.pstor.cache.write_coid(coid)
+        with self._lock:
+            return self._write_coid(coid)
+
+    def update(self, coid, indexes, values):
+        ''' Sets the fields at ''indexes'' of ''coid'' to ''values'', in
+        place. Only a coid that hasn't been written to PStor can change,
+        ValueError is raised otherwise. '''
+        self._write_foreign(values)
+        with self._lock:
+            centry = self._cache.get(coid.seqnum)
+            if coid.oid is not None or centry is None:
+                raise ValueError("coid %d has been written" % coid.seqnum)
+            for i, v in zip(indexes, values):
+                centry.ofields[i] = v
+
+    def _write_foreign(self, ofields):
+        ''' Writes the unwritten coids of other caches in ''ofields'' before
+        a coid of this cache refers to them, so that writing a coid of this
+        cache never takes the lock of another cache (see the concurrency
+        model). Must not be called with the lock held. '''
+        for f in ofields:
+            if (isinstance(f, _CachedOid) and f.oid is None and
+                    f.pstor.cache is not self):
+                f.pstor.cache.write_coid(f)
+
+    def create(self, ofields, pstor, initfunc=None):
+        ''' Interface to PersistDS's OID create. The coid is initialized with
+        ''initfunc'' (PStruct.initOid()) before it is added, see
+        create_many(). '''
+        self._write_foreign(ofields)
+        with self._lock:
+            coid = _CachedOid(pstor)
+            if initfunc is not None:
+                initfunc(coid)
+            self._add(coid, ofields)
+            self.metrics.coids += 1
+            if self._flusher and self._unpinned_dirty() > self._flusher.high:
+                self._flushcond.notify()
+            return coid
+
+    def create_many(self, rows, pstor, initfunc):
+        ''' Creates a coid for each list of fields in ''rows''. A field can
+        be a pstructstor.BatchRef to the coid of an earlier row. A coid is
+        initialized with ''initfunc'' (PStruct.initOid()) before it is added,
+        since adding a coid may evict the ones before it. Returns the
+        coids. '''
+        coids = []
+        for ofields in rows:
+            self._write_foreign(ofields)
+        with self._lock:
+            for ofields in rows:
+                for i, f in enumerate(ofields):
+                    if isinstance(f, pstructstor.BatchRef):
+                        ofields[i] = coids[f.index]
+                coid = _CachedOid(pstor)
+                initfunc(coid)
+                self._add(coid, ofields)
+                coids.append(coid)
+            self.metrics.coids += len(coids)
+            if self._flusher and self._unpinned_dirty() > self._flusher.high:
+                self._flushcond.notify()
+        return coids
 
     def _cache_oid(self, o):
-        ''' Load an OID ''o'' from PStor and add it to our cache. Return the
-        resulting coid. '''
+        ''' Creates a coid with the backing OID ''o''. The record of ''o'' is
+        not read until the coid is accessed (oidfields()), which goes through
+        the miss path of _get_coidrec(). '''
         # oid.pstor is a string
         pstor = pstructstor.PStructStor.mkpstor(o.pstor)
-        ofields = pstor.getrec(o)
-        # Create a _CachedOid based on the real OID
+        # Create a _CachedOid based on the real OID. Note is possible that
+        # multiple coids refer to the same underlying OID as a result of doing
+        # this. If we maintain a reverse hash (oid -> coid) then this can be
+        # avoided.
         coid = _CachedOid(pstor, o)
         # Have to give it a name
         ps = persistds.PStruct.mkpstruct(o.name)
         ps.initOid(coid)
-        # Put it back into cache. Note is possible that multiple coids refer
-        # to the same underlying OID as a result of doing this. If we maintain
-        # a reverse hash (oid -> coid) then this can be avoided.
-        self._add(coid, ofields)
-        if _cprof:
-            _cprof.coldcnt += 1
+        self.metrics.coids += 1
+        self.metrics.coldloads += 1
         return coid
 
     def _cache_ofields(self, ofields):
@@ -301,128 +892,353 @@ class PDSCache(object):
         # Nulloid is not cached.
         if o is oid.OID.Nulloid:
             return o
-        coid = self._cache_oid(o)
-        centry = _pdscache._cache[coid.seqnum]
-        _pdscache._cache_ofields(centry.ofields)
-        return coid
+        with self._lock:
+            return self._cache_oid(o)
 
-    def _get_coidrec(self, coid):
+    def _get_coidrec(self, coid, indexes=None):
         ''' Interface to PersistDS's OID getrec when the passed oid is a
-        cached oid ''coid''. '''
-        try:
-            centry = self._cache[coid.seqnum]
-            # Coid in cache: Move it to the tail of LRU list
-            list_move_tail(centry.lnode, self._lrulist)
-            #print "Getting centry %d" % centry.seqnum
-            if _cprof:
-                _cprof.hitcnt += 1
-            return self._cache_ofields(centry.ofields)
-        except KeyError:
-            # This Oid Cache has been moved to pstor, we have to get it back first.
+        cached oid ''coid''. Many threads can get records at the same time,
+        the cache lock is not held while a record is read from disk.
+        With ''indexes'', only the fields at ''indexes'' are returned (and
+        unpacked, if the record is read from PStor). '''
+        with self._lock:
+            centry = self._cache.get(coid.seqnum)
+            if centry is not None:
+                return self._hit(centry, indexes)
+            # This Oid Cache has been moved to pstor, we have to get it back
+            # first.
             #print "Getting coid (%d) from PStor" % coid.seqnum
             assert(coid.oid is not None)
-            ofields = coid.pstor.getrec(coid.oid)
-            # Put the coid back into cache. Note coid.seqnum is reused here.
-            self._add(coid, ofields)
-            if _cprof:
-                _cprof.misscnt += 1
-            return self._cache_ofields(ofields)
+            cached = self._cached_rec(coid, indexes)
+        if cached is None:
+            ofields, raw = self._read(coid, indexes)
+        else:
+            ofields, raw = cached
+        with self._lock:
+            centry = self._cache.get(coid.seqnum)
+            if centry is not None:
+                # Another thread got it back in the meantime.
+                return self._hit(centry, indexes)
+            return self._readd(coid, ofields, raw, indexes)
 
+    def _get_coidrecs(self, coids, indexes=None):
+        ''' Same as _get_coidrec() for a list of coids, returns a list of
+        results. The records of coids not in cache are read from PStor in
+        storage (size class, then oid) order. '''
+        res = [None] * len(coids)
+        misses = []
+        with self._lock:
+            for i, coid in enumerate(coids):
+                centry = self._cache.get(coid.seqnum)
+                if centry is not None:
+                    res[i] = self._hit(centry, indexes)
+                    continue
+                cached = self._cached_rec(coid, indexes)
+                if cached is not None:
+                    res[i] = self._readd(coid, cached[0], cached[1], indexes)
+                else:
+                    misses.append(i)
+        loaded = zip(misses, self._read_many([coids[i] for i in misses],
+                                             indexes))
+        with self._lock:
+            for i, (ofields, raw) in loaded:
+                coid = coids[i]
+                centry = self._cache.get(coid.seqnum)
+                if centry is not None:
+                    res[i] = self._hit(centry, indexes)
+                else:
+                    res[i] = self._readd(coid, ofields, raw, indexes)
+        return res
 
-import os
-import datetime
-class _CacheProf(object):
-    def reset_stats(self):
-        self.coidcnt = 0
-        self.centrycnt = 0
-        self.fullcnt = 0
-        self.wtcnt = 0
-        self.coldcnt = 0
-        self.hitcnt = 0
-        self.misscnt = 0
-        self.sweepcnt = 0
-        self.deadcoid1cnt = 0
-        self.deadcoid2cnt = 0
- 
-    def __init__(self):
-        self.clock = 0
-        self.reset_stats()
-        fpath = "cacheprof.stats-%d-%s" % (_pdscache_size,
-                                           datetime.date.today().isoformat())
-        self.statsfo = open(fpath, "w")
-        fmtstr = "%13s" * 11 + "\n"
-        self.statsfo.write(fmtstr % \
-                               ("clock",
-                                "coidcnt",
-                                "centrycnt",
-                                "fullcnt",
-                                "wtcnt",
-                                "coldcnt",
-                                "hitcnt",
-                                "misscnt",
-                                "sweepcnt",
-                                "deadcoid1cnt",
-                                "deadcoid2cnt"))
-
-    def tick(self):
-        self.clock += 1
-        if self.clock % 1000 == 0:
-            self.calc()
-            self.reset_stats()
-            #print "%s: " % self.clock,
-            #_pdscache.dump_lrulist()
-
-    def calc(self):
-        fmtstr = "%13d" * 11 + "\n"
-        self.statsfo.write(fmtstr % \
-                               (self.clock,
-                                self.coidcnt,
-                                self.centrycnt,
-                                self.fullcnt,
-                                self.wtcnt,
-                                self.coldcnt,
-                                self.hitcnt,
-                                self.misscnt,
-                                self.sweepcnt,
-                                self.deadcoid1cnt,
-                                self.deadcoid2cnt))
-
-# Cache stats
-#_cprof = _CacheProf()
-_cprof = None
-
-# Cache Size (Number of cache entries)
+    def _read(self, coid, indexes):
+        ''' Reads the record of ''coid'' from its pstor, without the cache
+        lock. Returns (fields, packed record), the packed record is None
+        unless only the fields at ''indexes'' are unpacked. '''
+        if indexes is None:
+            return coid.pstor.getrec(coid.oid), None
+        return self._unpack_raw(coid, coid.pstor.getrawrec(coid.oid), indexes)
+
+    def _read_many(self, coids, indexes):
+        ''' Same as _read() for a list of coids. Records are read in
+        storage order, per pstor. Returns a list of (fields, packed
+        record). '''
+        res = [None] * len(coids)
+        bypstor = {}
+        for i, coid in enumerate(coids):
+            bypstor.setdefault(coid.pstor, []).append(i)
+        for pstor, positions in bypstor.items():
+            raws = pstor.getrawrecs([coids[i].oid for i in positions])
+            for i, raw in zip(positions, raws):
+                res[i] = self._unpack_raw(coids[i], raw, indexes)
+        return res
+
+    def _unpack_raw(self, coid, raw, indexes):
+        ''' Unpacks the packed record ''raw'' of ''coid'', see _read(). '''
+        packer = pstructstor.PStructStor.default_packer
+        if indexes is not None and packer.partial(raw):
+            return (packer.unpack_fields(raw, indexes, coid.pstor._stordir),
+                    raw)
+        return packer.unpack(raw, coid.pstor._stordir), None
+
+    def _readd(self, coid, ofields, raw, indexes):
+        ''' Puts a coid read back from PStor into cache. Returns its fields
+        at ''indexes''. '''
+        # Note coid.seqnum is reused here.
+        centry = self._add(coid, ofields)
+        centry.raw = raw
+        self.metrics.misses += 1
+        return self._fields(centry, indexes)
+
+    def _hit(self, centry, indexes=None):
+        # Coid in cache: Let the eviction policy know
+        if not centry.pins:
+            self._policy.touch(centry)
+        self.metrics.hits += 1
+        #print "Getting centry %d" % centry.seqnum
+        return self._fields(centry, indexes)
+
+    def _fields(self, centry, indexes):
+        ''' Returns the fields of ''centry'' (only those at ''indexes'' if
+        not None), unpacking them first if needed. '''
+        if indexes is None:
+            return self._cache_ofields(self._complete(centry))
+        ofields = centry.ofields
+        if centry.raw is not None:
+            unpacked = pstructstor.FieldPacker.unpacked
+            self._unpack(centry, [i for i in indexes
+                                  if ofields[i] is unpacked])
+        res = [ofields[i] for i in indexes]
+        for i, f in enumerate(res):
+            if isinstance(f, oid.OID) and f is not oid.OID.Nulloid:
+                # Same as _cache_ofields(), for the selected fields only
+                res[i] = ofields[indexes[i]] = self._cache_oid(f)
+        return res
+
+    def _unpack(self, centry, indexes):
+        ''' Unpacks the fields at ''indexes'' of a partially unpacked
+        entry. '''
+        if not indexes:
+            return
+        coid = centry.coidwref()
+        ofields = pstructstor.PStructStor.default_packer.unpack_fields(
+            centry.raw, indexes, coid.pstor._stordir if coid else None)
+        unpacked = pstructstor.FieldPacker.unpacked
+        for i in indexes:
+            centry.ofields[i] = ofields[i]
+        for f in centry.ofields:
+            if f is unpacked:
+                return
+        centry.raw = None
+
+    def _complete(self, centry):
+        ''' Unpacks all fields of ''centry''. Returns its fields. '''
+        if centry.raw is not None:
+            unpacked = pstructstor.FieldPacker.unpacked
+            self._unpack(centry, [i for i, f in enumerate(centry.ofields)
+                                  if f is unpacked])
+        return centry.ofields
+
+    def _pin_one(self, coid):
+        ''' Pins ''coid'' in cache, reading it back first if needed. Returns
+        its fields. '''
+        while True:
+            ofields = self._get_coidrec(coid)
+            with self._lock:
+                centry = self._cache.get(coid.seqnum)
+                if centry is None:
+                    # Evicted again by another thread, retry.
+                    continue
+                if not centry.pins:
+                    self._policy.remove(centry)
+                    self._num_entries -= 1
+                    self._pinned[coid.seqnum] = coid
+                    if centry.dirty:
+                        self._num_pinned_dirty += 1
+                centry.pins += 1
+                return ofields
+
+    def _unpin_one(self, coid):
+        ''' Drops a pin of ''coid''. An entry that is no longer pinned goes
+        back to the eviction policy. Returns its fields. '''
+        with self._lock:
+            centry = self._cache.get(coid.seqnum)
+            if centry is None or not centry.pins:
+                raise ValueError("coid %d is not pinned" % coid.seqnum)
+            ofields = self._cache_ofields(self._complete(centry))
+            centry.pins -= 1
+            if not centry.pins:
+                if self._num_entries >= self._max_entries:
+                    self._freeup_centries()
+                del self._pinned[coid.seqnum]
+                if centry.dirty:
+                    self._num_pinned_dirty -= 1
+                self._num_entries += 1
+                self._policy.add(centry)
+            return ofields
+
+    def _pin_walk(self, coid, depth, pinfunc, walkfunc):
+        ''' Applies ''pinfunc'' to ''coid'' and the coids it refers to, up to
+        ''depth'' references away, level by level. Coids of another cache
+        are handed over to ''walkfunc'' of that cache. '''
+        level = [coid]
+        for d in range(depth + 1):
+            nextlevel = []
+            for c in level:
+                if c.pstor.cache is not self:
+                    walkfunc(c.pstor.cache)(c, depth - d)
+                    continue
+                ofields = pinfunc(c)
+                if d < depth:
+                    nextlevel.extend([f for f in ofields
+                                      if isinstance(f, _CachedOid)])
+            level = nextlevel
+
+    def pin(self, coid, depth=0):
+        ''' Pins ''coid'' and, for a non-zero ''depth'', the coids it refers
+        to up to ''depth'' references away (e.g. the top levels of a trie).
+        Pinned entries are never evicted, aren't counted as cache entries
+        (so they don't take slots or trigger sweeping) and are reported as
+        the "pinned" gauge, a number of entries (not bytes). Pinned dirty
+        entries are left alone by the flusher, and don't count towards its
+        watermarks (they are the "pinned_dirty" gauge). A pin holds a strong
+        reference, the pinned coids stay alive until unpin() is called with
+        the same ''depth''. Pins nest; close() drops all pins. '''
+        self._pin_walk(coid, depth, self._pin_one, lambda cache: cache.pin)
+
+    def unpin(self, coid, depth=0):
+        ''' Undoes a pin(''coid'', ''depth''). '''
+        self._pin_walk(coid, depth, self._unpin_one, lambda cache: cache.unpin)
+
+    def hint(self, coid, hot=True):
+        ''' A priority hint for a resident ''coid'': a ''hot'' coid is kept
+        longer than one that was just accessed, a cold one (e.g. read by a
+        scan) is to be evicted soon. Does nothing if ''coid'' is not in
+        cache or pinned. '''
+        with self._lock:
+            centry = self._cache.get(coid.seqnum)
+            if centry is None or centry.pins:
+                return
+            if hot:
+                self._policy.promote(centry)
+            else:
+                self._policy.demote(centry)
+
+# Size (number of cache entries) and eviction policy (one of
+# cachepolicy.policy_table) of the default caches.
 _pdscache_size = 8192
-# This is the global singleton PDS cache object that everyone uses.
-_pdscache = PDSCache(_pdscache_size)
-print "PDSCache %s: Size %d" % (_pdscache, _pdscache_size)
+_pdscache_policy = "lru"
+_meta_cache_size = 1024
+
+_default_lock = threading.Lock()
+_default_caches = {}
+
+def _get_default(name, size):
+    with _default_lock:
+        if name not in _default_caches:
+            _default_caches[name] = PDSCache(size, _pdscache_policy)
+        return _default_caches[name]
+
+def forget_default_caches():
+    ''' Drops the default caches. This is for a forked child process (see
+    PStructStor.forget_all()), new default caches are created on next use. '''
+    global _default_lock, _default_caches
+    _default_lock = threading.Lock()
+    _default_caches = {}
+
+def default_cache():
+    ''' Returns the cache shared by all PStructStors that are not given a
+    cache of their own. It is created on first use. '''
+    return _get_default("data", _pdscache_size)
+
+def default_meta_cache():
+    ''' Returns the (small) cache shared by the internal pstors of OidFS
+    instances that are not given a cache of their own, so that user data
+    can't thrash OidFS's name trie. It is created on first use. '''
+    return _get_default("meta", _meta_cache_size)
 
 # Cache Management
 def write_coid(coid):
     ''' Write through a cached oid ''coid''. Return the resulting oid. '''
-    return _pdscache._write_coid(coid)
+    if coid is oid.OID.Nulloid:
+        return coid
+    return coid.pstor.cache.write_coid(coid)
 
 def read_oid(o):
     ''' Read (load) an oid ''o'' from pstor. Return the resulting coid. '''
-    return _pdscache._coid_from_oid(o)
+    if o is oid.OID.Nulloid:
+        return o
+    pstor = pstructstor.PStructStor.mkpstor(o.pstor)
+    return pstor.cache._coid_from_oid(o)
 
 
 # Interface to PStructStor
 # Use these public functions to create and get OIDs. These functions are
-# inserted between persistds.PStruct and pstructstor.PStructStor.
-def create_oid(ofields, pstor):
-    ''' Create a cached OID. '''
-    coid = _pdscache.create(ofields, pstor)
-    if _cprof:
-        _cprof.tick()
+# inserted between persistds.PStruct and pstructstor.PStructStor. The cache
+# used is the one attached to the pstor.
+def create_oid(ofields, pstor, initfunc=None):
+    ''' Create a cached OID, see PDSCache.create(). '''
+    cache = pstor.cache
+    before = time.time()
+    coid = cache.create(ofields, pstor, initfunc)
+    elapsed = time.time() - before
+    with cache._lock:
+        cache.metrics.observe("create_oid", elapsed)
     return coid
 
-def oidfields(coid):
-    ''' Return fields of a coid. '''
+def update_oid(coid, indexes, values):
+    ''' Changes fields of an unwritten coid in place, see
+    PDSCache.update() '''
+    coid.pstor.cache.update(coid, indexes, values)
+
+def pin(coid, depth=0):
+    ''' Pins a coid in the cache of its pstor, see PDSCache.pin() '''
+    if coid is not oid.OID.Nulloid:
+        coid.pstor.cache.pin(coid, depth)
+
+def unpin(coid, depth=0):
+    ''' Unpins a coid pinned with pin() '''
+    if coid is not oid.OID.Nulloid:
+        coid.pstor.cache.unpin(coid, depth)
+
+def hint(coid, hot=True):
+    ''' Gives the cache of a coid a priority hint, see PDSCache.hint() '''
+    if coid is not oid.OID.Nulloid:
+        coid.pstor.cache.hint(coid, hot)
+
+def create_oids(rows, pstor, initfunc):
+    ''' Create a cached OID for each list of fields in ''rows'', see
+    PDSCache.create_many(). '''
+    return pstor.cache.create_many(rows, pstor, initfunc)
+
+def oidfields_many(coids, indexes=None):
+    ''' Return the fields of each of ''coids'', see oidfields(). Cache
+    lookups are done in one go per cache, records not in cache are read in
+    storage order. '''
+    bycache = {}
+    for i, coid in enumerate(coids):
+        if not isinstance(coid, _CachedOid):
+            raise TypeError("Wrong type: %s of %s. Must be _CachedOid" % \
+                                (coid, type(coid)))
+        bycache.setdefault(coid.pstor.cache, []).append(i)
+    res = [None] * len(coids)
+    for cache, positions in bycache.items():
+        ofieldslist = cache._get_coidrecs([coids[i] for i in positions],
+                                          indexes)
+        for i, ofields in zip(positions, ofieldslist):
+            res[i] = ofields
+    return res
+
+def oidfields(coid, indexes=None):
+    ''' Return fields of a coid. With ''indexes'', only the fields at
+    ''indexes'' are returned, in that order, and the other fields are not
+    unpacked if the coid is read back from PStor. '''
     if not isinstance(coid, _CachedOid):
         raise TypeError("Wrong type: %s of %s. Must be _CachedOid" % \
                             (coid, type(coid)))
-    ofields = _pdscache._get_coidrec(coid)
-    if _cprof:
-        _cprof.tick()
+    cache = coid.pstor.cache
+    before = time.time()
+    ofields = cache._get_coidrec(coid, indexes)
+    elapsed = time.time() - before
+    with cache._lock:
+        cache.metrics.observe("oidfields", elapsed)
     return ofields
@@ -13,25 +13,18 @@
 # limitations under the License.
 
 
-import sys
-
+import re
+from collections import namedtuple
 from oid import OID
 import pstructstor
-
-# Use PDSCache
+# OIDs are created and accessed through the PDSCache attached to the pstor
 import pdscache
-# Whether PDSCache is use
-if "pdscache" in sys.modules:
-    oidcreate_func = pdscache.create_oid
-    oidfields_func = pdscache.oidfields
-else:
-    def create(ofields, pstor):
-        return pstor.create(ofields)
-    oidcreate_func = create
-    def ofields(o):
-        pstor = pstructstor.PStructStor.mkpstor(o.pstor)
-        return pstor.getrec(o)
-    oidfields_func = ofields
+
+
+def _mkrecord(sname, fnames):
+    ''' Returns the record class (a namedtuple) for the PStruct ''sname''
+    with fields ''fnames''. Fields are accessed by attribute or by index. '''
+    return namedtuple(re.sub(r'\W', '_', sname), fnames, rename=True)
 
 
 class PStruct(object):
@@ -67,24 +60,17 @@ class PStruct(object):
             raise TypeError("sspec must be a list of tuple")
         self.sspec = tuple(sspec)
         self.sspec_fields = tuple([f[1] for f in sspec])
+        self.fnames = tuple([f[0] for f in sspec])
+        self._findex = dict([(f, i) for i, f in enumerate(self.fnames)])
+        # Field names => field indexes, for getfields()
+        self._indexes = {}
+        # The record class returned by getfields()
+        self.record = _mkrecord(sname, self.fnames)
 
     def _fieldIndex(self, fname):
-        for i, f in enumerate(self.sspec):
-            if f[0] == fname:
-                return i
-        raise KeyError("%s: Bad field name '%s'" % (self, fname))
-
-    def _list2Dict(self, fields=[]):
-        res = {}
-        for f, spec in zip(fields, self.sspec):
-            res[spec[0]] = f
-        return res
-
-    def _dict2List(self, fieldsDict):
-       sf = list(self.sspec_fields)
-       for k, v in fieldsDict.items():
-           sf[self._fieldIndex(k)] = v
-       return sf
+        if fname not in self._findex:
+            raise KeyError("%s: Bad field name '%s'" % (self, fname))
+        return self._findex[fname]
 
     def __str__(self):
         return "<PStruct %s>" % self.sname
@@ -96,22 +82,85 @@ class PStruct(object):
         oid.name = self.sname
 
     def _make(self, pstor, fields):
-        oid = oidcreate_func(fields, pstor)
-        self.initOid(oid)
-        return oid
-
-    def make(self, pstor, **kwargs):
-        ''' pass fields in keyword args '''
-        fields = self._dict2List(kwargs)
+        # The oid is named before it is added to cache, where another
+        # thread may write it out (see PDSCache.create_many())
+        return pdscache.create_oid(fields, pstor, self.initOid)
+
+    def make(self, pstor, *args, **kwargs):
+        ''' Pass fields in spec order as positional args, and/or by name in
+        keyword args. Missing fields get their default values. '''
+        nargs = len(args)
+        if nargs == len(self.sspec_fields) and not kwargs:
+            return self._make(pstor, list(args))
+        fields = list(args) + list(self.sspec_fields[nargs:])
+        for k, v in kwargs.items():
+            i = self._fieldIndex(k)
+            if i < nargs:
+                raise TypeError("%s: Field '%s' given twice" % (self, k))
+            fields[i] = v
         return self._make(pstor, fields)
 
+    def make_many(self, pstor, rows):
+        ''' Makes a struct for each of ''rows'', a sequence of fields in spec
+        order as in make() (missing fields get their default values), in
+        one go. A field can be a pstructstor.BatchRef(i), which refers to
+        the struct made from rows[i], an earlier row. Returns the OIDs. '''
+        nfields = len(self.sspec_fields)
+        fieldslist = []
+        for row in rows:
+            if len(row) > nfields:
+                raise TypeError("%s: Too many fields %s" % (self, row))
+            fieldslist.append(list(row) + list(self.sspec_fields[len(row):]))
+        return pdscache.create_oids(fieldslist, pstor, self.initOid)
+
+    def setfields(self, pstor, o, **fields):
+        ''' Changes fields of ''o'', given by name, in place. Only an oid
+        that hasn't been written to storage can change, and only its maker
+        may change it while no one else has seen it (see
+        ptrie.TransientPtrie): an oid is immutable otherwise. '''
+        self.checkType(o)
+        fnames = fields.keys()
+        pdscache.update_oid(o, [self._fieldIndex(f) for f in fnames],
+                            [fields[f] for f in fnames])
+
     def checkType(self, o):
         if o.name != self.sname:
             raise TypeError("Wrong OID type: Expecting %s, got %s"
                     % (self.sname, o.name))
 
-    def getfields(self, pstor, o):
-        ''' Get fields of an oid. '''
+    def getfields(self, pstor, o, fnames=None):
+        ''' Get fields of an oid, as a record (see self.record). With a tuple
+        of field names ''fnames'', returns just those fields, in that order,
+        as a list; when the oid is read back from storage, other fields
+        aren't unpacked. '''
         self.checkType(o)
-        fields = oidfields_func(o)
-        return self._list2Dict(fields)
+        if fnames is None:
+            return tuple.__new__(self.record, pdscache.oidfields(o))
+        return pdscache.oidfields(o, self._fnames2indexes(fnames))
+
+    def _fnames2indexes(self, fnames):
+        indexes = self._indexes.get(fnames)
+        if indexes is None:
+            indexes = [self._fieldIndex(f) for f in fnames]
+            self._indexes[fnames] = indexes
+        return indexes
+
+    def getfields_many(self, pstor, oids, fnames=None):
+        ''' getfields() of each of ''oids''. Cache lookups are batched and
+        the records that have to be read from storage are read in storage
+        order. Returns a list. '''
+        for o in oids:
+            self.checkType(o)
+        if fnames is None:
+            return [tuple.__new__(self.record, ofields)
+                    for ofields in pdscache.oidfields_many(oids)]
+        return pdscache.oidfields_many(oids, self._fnames2indexes(fnames))
+
+    def getfield_many(self, pstor, oids, fname):
+        ''' Returns the field ''fname'' of each of ''oids'', see
+        getfields_many(). '''
+        return [f[0] for f in self.getfields_many(pstor, oids, (fname,))]
+
+    def getfield(self, pstor, o, fname):
+        ''' Get a single field of an oid, see getfields(). '''
+        return self.getfields(pstor, o, (fname,))[0]
@@ -15,6 +15,7 @@
 
 from fixszPDS import *
 from persistds import PStruct
+from pstructstor import BatchRef
 from oid import OID
 
 # Global list node PStruct
@@ -34,26 +35,30 @@ class Plist(object):
         self.pstor = pstor
 
     def cons(self, val, lnode):
-        return nodePS.make(self.pstor, value=val, nxt=lnode)
+        return nodePS.make(self.pstor, val, lnode)
 
     def car(self, lnode):
         if not lnode:
             raise ValueError("car: emptylist")
         fields = nodePS.getfields(self.pstor, lnode)
-        return fields['value']
+        return fields.value
 
     def cdr(self, lnode):
         if not lnode:
             raise ValueError("cdr: emptylist")
         fields = nodePS.getfields(self.pstor, lnode)
-        return fields['nxt']
+        return fields.nxt
 
     def plist(self, *args):
         ''' A plist constructor that takes variable number of values and make
         them into a plist '''
         if len(args) == 0:
             return emptylist
-        return nodePS.make(self.pstor, value=args[0], nxt=self.plist(*args[1:]))
+        # Nodes are made from the tail, each refers to the one made before
+        rows = [(args[-1], emptylist)]
+        for i in range(len(args) - 2, -1, -1):
+            rows.append((args[i], BatchRef(len(rows) - 1)))
+        return nodePS.make_many(self.pstor, rows)[-1]
 
     def liter(self, ll):
         ''' returns a generator of the linked list '''
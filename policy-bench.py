@@ -0,0 +1,84 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Compares the hit rates of PDSCache eviction policies on the perm.py and
+# pancake.py workloads. The perm workload does a breadth-first scan of the
+# trie half way through the insertions, which is what hurts plain LRU.
+# Each run must end with the same keys and values as the LRU run.
+#
+# Usage: policy-bench.py cachesize numperm numpancakes
+
+
+import random
+import ptrie
+import cachepolicy
+import perm
+import pancake
+import benchutil
+
+
+def perm_workload(pstor, ofs, n):
+    ptrieObj = ptrie.Ptrie(pstor)
+    root = ptrie.Nulltrie
+    perms = list(perm.rand_perm(perm.sortedSeq(n)))
+    half = len(perms) / 2
+    for s in perms[:half]:
+        root = ptrieObj.insert(root, s, None, None)
+    for node in ptrieObj.bfiter(root):
+        pass
+    for s in perms[half:]:
+        root = ptrieObj.insert(root, s, None, None)
+    return list(ptrieObj.items(root))
+
+def pancake_workload(pstor, ofs, n):
+    pcakeObj = pancake.Pancake(n, pstor, ofs)
+    pcakeObj.build()
+    return list(pcakeObj.ptrieObj.items(pcakeObj.pcakeTrieAll))
+
+def run(workload, n, cachesize, policy):
+    ''' Runs ''workload'' in a fresh ostore with a fresh cache. Returns the
+    hit rate, the run time and the keys and values the workload ended
+    with. '''
+    store = benchutil.BenchStore(cachesize, policy=policy)
+    # Every policy gets the same permutations
+    random.seed(1)
+    elapsed, items = benchutil.timed(lambda: workload(store.pstor,
+                                                      store.ofs, n))
+    metrics = store.cache.metrics.snapshot()
+    total = metrics["hits"] + metrics["misses"]
+    hitrate = float(metrics["hits"]) / total if total else 0.0
+    store.close()
+    return hitrate, elapsed, items
+
+
+if __name__ == "__main__":
+    cachesize, nperm, npcakes = benchutil.getargs(
+        "cachesize numperm numpancakes", 3)
+    results = []
+    for wname, workload, n in (("perm", perm_workload, nperm),
+                               ("pancake", pancake_workload, npcakes)):
+        # Eviction must not change what a workload computes: all policies
+        # end with the keys and values of LRU
+        expected = None
+        for name in ["lru"] + sorted(set(cachepolicy.policy_table) -
+                                     set(["lru"])):
+            hitrate, elapsed, items = run(workload, n, cachesize, name)
+            if expected is None:
+                expected = items
+            benchutil.check("%s %s" % (wname, name), items, expected)
+            results.append((wname, name, hitrate, elapsed))
+    print "%10s %10s %10s %10s" % ("workload", "policy", "hitrate", "seconds")
+    for r in sorted(results):
+        print "%10s %10s %10.4f %10.2f" % r
@@ -0,0 +1,123 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Measures the per-node overhead of PStruct make() and getfields(): the old
+# dict round trip (dict2list()/list2dict(), as PStruct used to do) against
+# the record classes, and the cost per node visited of Ptrie insert() and
+# find(). The cache is big enough to hold everything, so no disk access is
+# timed.
+#
+# Usage: pstruct-bench.py numnodes
+
+
+import time
+import random
+import ptrie
+import pdscache
+import benchutil
+
+
+def timeit(func, n):
+    ''' Returns microseconds per call of func(i) for i in range(n) '''
+    before = time.time()
+    for i in xrange(n):
+        func(i)
+    return (time.time() - before) * 1000000 / n
+
+def list2dict(ps, fields):
+    res = {}
+    for f, spec in zip(fields, ps.sspec):
+        res[spec[0]] = f
+    return res
+
+def dict2list(ps, fieldsDict):
+    sf = list(ps.sspec_fields)
+    for k, v in fieldsDict.items():
+        sf[ps._fieldIndex(k)] = v
+    return sf
+
+def bench_pstruct(pstor, n):
+    ps = ptrie.ptrieStruct
+    Nulltrie = ptrie.Nulltrie
+    nodes, kwnodes, posnodes = [], [], []
+    def make_dict(i):
+        kw = dict(prefix="abc", value=i, final=True, lcp=Nulltrie,
+                  rsp=Nulltrie)
+        nodes.append(ps._make(pstor, dict2list(ps, kw)))
+    def make_kw(i):
+        kwnodes.append(ps.make(pstor, prefix="abc", value=i, final=True,
+                               lcp=Nulltrie, rsp=Nulltrie))
+    def make_pos(i):
+        posnodes.append(ps.make(pstor, "abc", i, True, Nulltrie, Nulltrie))
+    def get_dict(i):
+        ps.checkType(nodes[i])
+        f = list2dict(ps, pdscache.oidfields(nodes[i]))
+        return (f['prefix'], f['value'], f['final'], f['lcp'], f['rsp'])
+    def get_record(i):
+        f = ps.getfields(pstor, nodes[i])
+        return (f.prefix, f.value, f.final, f.lcp, f.rsp)
+    print "%-28s %10s" % ("PStruct", "usec/node")
+    for name, func in (("make, dict round trip", make_dict),
+                       ("make, keyword args", make_kw),
+                       ("make, positional args", make_pos),
+                       ("getfields, dict round trip", get_dict),
+                       ("getfields, record", get_record)):
+        print "%-28s %10.2f" % (name, timeit(func, n))
+    # The record classes must give what the dict round trip gives
+    expected = [get_dict(i) for i in xrange(n)]
+    benchutil.check("getfields, record", [get_record(i) for i in xrange(n)],
+                    expected)
+    for name, made in (("make, keyword args", kwnodes),
+                       ("make, positional args", posnodes)):
+        fields = [tuple(ps.getfields(pstor, o)) for o in made]
+        benchutil.check(name, fields, expected)
+
+def bench_ptrie(pstor, n):
+    ptrieObj = ptrie.Ptrie(pstor)
+    random.seed(1)
+    words = ["".join([random.choice("abcdefgh") for i in range(8)])
+             for j in range(n)]
+    root = [ptrie.Nulltrie]
+    visited = []
+    # Count nodes visited by counting getfields() calls
+    getfields = ptrieObj.getfields
+    def counting_getfields(o, fnames=None):
+        visited.append(None)
+        return getfields(o, fnames)
+    ptrieObj.getfields = counting_getfields
+    def insert(i):
+        root[0] = ptrieObj.insert(root[0], words[i], i)
+    def find(i):
+        ptrieObj.find(root[0], words[i])
+    print "%-28s %10s" % ("Ptrie", "usec/visit")
+    for name, func in (("insert", insert), ("find", find)):
+        del visited[:]
+        usec = timeit(func, n) * n / max(len(visited), 1)
+        print "%-28s %10.2f" % (name, usec)
+    # A word inserted twice keeps the value of its last insert()
+    expected = dict((w, i) for i, w in enumerate(words))
+    benchutil.check("insert", list(ptrieObj.items(root[0])),
+                    sorted(expected.items()))
+    benchutil.check("find", [ptrieObj.getfields(ptrieObj.find(root[0], w),
+                                                ('value',))[0]
+                             for w in words], [expected[w] for w in words])
+
+
+if __name__ == "__main__":
+    n, = benchutil.getargs("numnodes", 1)
+    store = benchutil.BenchStore(n * 20)
+    bench_pstruct(store.pstor, n)
+    bench_ptrie(store.pstor, n)
+    store.close()
@@ -16,28 +16,171 @@
 import os
 import struct
 import persistds
+import pdscache
 from fixszPDS import *
 import cPickle
 import weakref
+import threading
 
 class PicklePacker(object):
     ''' Uses Python's Pickle protocol 2 and above to pack/unpack PStructs '''
     def __init__(self):
         # Needs at least protocol 2 for __getnewargs__
         self.ver = cPickle.HIGHEST_PROTOCOL
-    def pack(self, o):
+    def pack(self, o, stordir=None):
         return cPickle.dumps(o, self.ver)
-    def unpack(self, strbuf):
+    def unpack(self, strbuf, stordir=None):
         return cPickle.loads(strbuf)
 
 
+class FieldPacker(PicklePacker):
+    ''' Packs the fields of a PStruct one by one, after a table of field
+    offsets, so that a single field can be unpacked without unpacking the
+    rest (see unpack_fields()). The layout is:
+        magic (1 byte), number of fields (1 byte, 2 bytes for "wide"
+        records of more than 255 fields),
+        end offset of each field (2 or 4 bytes each, depending on magic),
+        fields
+    A field is tagged by its first byte: OIDs are packed as their oid value,
+    size and name, plus the pstor if it's not ''stordir'' (the pstor of the
+    record), other fields are pickled. An OID name takes a 1 byte length,
+    or 2 bytes (tag "W") for names of more than 255 characters; OIDs with
+    even longer names are pickled. Records packed by PicklePacker are
+    still unpacked, a pickle never starts with the magic bytes. '''
+
+    magic16 = "\xfe"
+    magic32 = "\xfd"
+    wide16 = "\xfc"
+    wide32 = "\xfb"
+    _magics = (magic16, magic32, wide16, wide32)
+    _nfields = struct.Struct("<H")
+    _oidhdr = struct.Struct("<QIB")
+    _wideoidhdr = struct.Struct("<QIH")
+    _pstorlen = struct.Struct("<H")
+    # Pickle protocol 2 header, stripped from pickled fields
+    _proto = cPickle.dumps(None, 2)[:2]
+
+    def _packfield(self, f, stordir):
+        if isinstance(f, OID) and len(f.name) <= 0xffff:
+            if f is OID.Nulloid:
+                return "N"
+            if f.pstor == stordir:
+                pstor = "L"
+            else:
+                fpstor = f.pstor or ""
+                pstor = "F" + FieldPacker._pstorlen.pack(len(fpstor)) + fpstor
+            if len(f.name) > 255:
+                hdr = "W" + FieldPacker._wideoidhdr.pack(f.oid, f.size,
+                                                         len(f.name))
+            else:
+                hdr = "O" + FieldPacker._oidhdr.pack(f.oid, f.size,
+                                                     len(f.name))
+            return hdr + f.name + pstor
+        return "P" + cPickle.dumps(f, self.ver)[2:]
+
+    def _unpackfield(self, buf, stordir):
+        tag = buf[0]
+        if tag == "P":
+            return cPickle.loads(FieldPacker._proto + buf[1:])
+        if tag == "N":
+            return OID.Nulloid
+        if tag == "W":
+            hdr = FieldPacker._wideoidhdr
+        else:
+            hdr = FieldPacker._oidhdr
+        oidval, size, namelen = hdr.unpack_from(buf, 1)
+        pos = 1 + hdr.size
+        o = OID(oidval, size)
+        o.name = buf[pos:pos+namelen]
+        pos += namelen
+        if buf[pos] == "L":
+            o.pstor = stordir
+        else:
+            pstorlen, = FieldPacker._pstorlen.unpack_from(buf, pos + 1)
+            pos += 1 + FieldPacker._pstorlen.size
+            o.pstor = buf[pos:pos+pstorlen] or None
+        return o
+
+    def pack(self, ofields, stordir=None):
+        if len(ofields) > 0xffff:
+            return PicklePacker.pack(self, ofields)
+        parts = [self._packfield(f, stordir) for f in ofields]
+        ends = []
+        end = 0
+        for p in parts:
+            end += len(p)
+            ends.append(end)
+        fmt = "<%dH" % len(parts)
+        if len(parts) > 255:
+            magic16, magic32 = FieldPacker.wide16, FieldPacker.wide32
+            nfields = FieldPacker._nfields.pack(len(parts))
+        else:
+            magic16, magic32 = FieldPacker.magic16, FieldPacker.magic32
+            nfields = chr(len(parts))
+        magic = magic16
+        if end > 0xffff:
+            fmt = "<%dI" % len(parts)
+            magic = magic32
+        return (magic + nfields + struct.pack(fmt, *ends) + "".join(parts))
+
+    def _layout(self, strbuf):
+        ''' Returns (start of fields, end offsets) of a record '''
+        magic = strbuf[0]
+        if magic in (FieldPacker.magic16, FieldPacker.magic32):
+            nfields = ord(strbuf[1])
+            pos = 2
+        else:
+            nfields, = FieldPacker._nfields.unpack_from(strbuf, 1)
+            pos = 1 + FieldPacker._nfields.size
+        if magic in (FieldPacker.magic16, FieldPacker.wide16):
+            fmt = "<%dH" % nfields
+        else:
+            fmt = "<%dI" % nfields
+        return pos + struct.calcsize(fmt), struct.unpack_from(fmt, strbuf, pos)
+
+    def unpack(self, strbuf, stordir=None):
+        if strbuf[0] not in FieldPacker._magics:
+            return PicklePacker.unpack(self, strbuf)
+        return self.unpack_fields(strbuf, None, stordir)
+
+    def partial(self, strbuf):
+        ''' True if fields of the packed record ''strbuf'' can be unpacked
+        with unpack_fields() '''
+        return strbuf[0] in FieldPacker._magics
+
+    def unpack_fields(self, strbuf, indexes, stordir=None):
+        ''' Unpacks the fields at ''indexes'' (all fields if None) of a
+        record packed by pack(). Returns a list of all fields, in which the
+        fields not unpacked are ''FieldPacker.unpacked''. '''
+        base, ends = self._layout(strbuf)
+        if indexes is None:
+            indexes = range(len(ends))
+        ofields = [FieldPacker.unpacked] * len(ends)
+        for i in indexes:
+            start = base + (ends[i-1] if i else 0)
+            ofields[i] = self._unpackfield(strbuf[start:base+ends[i]], stordir)
+        return ofields
+
+# Placeholder for a field not unpacked (yet) by FieldPacker.unpack_fields()
+FieldPacker.unpacked = object()
+
+
+class BatchRef(object):
+    ''' Refers to the OID of an earlier record of the same
+    PStructStor.create_many() call. '''
+    __slots__ = ["index"]
+
+    def __init__(self, index):
+        self.index = index
+
+
 class PStructStor(object):
     ''' Manages a pair of OID stores and has the ability to copy/move OIDs
     between the two. This can be used by a garbage collector to "copy collect"
     dead OIDs. '''
     
     # OID packer
-    default_packer = PicklePacker()
+    default_packer = FieldPacker()
 
     # Active/Standby PDS
     mem1name = "mem1"
@@ -46,29 +189,66 @@ class PStructStor(object):
 
     # Global PStor Table
     _pstor_table = {}
+    # Protects _pstor_table
+    _pstor_table_lock = threading.Lock()
 
     @staticmethod
-    def mkpstor(stordir):
+    def mkpstor(stordir, cache=None):
         ''' Create a new PStor or return an existing PStor when ''stordir''
         exists. Use this function instead of using the constructor directly
         to avoid having multiple PStors pointing to the same underlying
-        PDS, as dictated by the ''stordir''. '''
+        PDS, as dictated by the ''stordir''.
+        ''cache'' is the PDSCache to attach to a new PStor, None means
+        pdscache.default_cache(). An existing PStor keeps its cache. '''
         if not os.path.isabs(stordir):
             raise TypeError("Must pass an absolute path as stordir (%s)"
                             % stordir)
+        with PStructStor._pstor_table_lock:
+            pstorObj, new = PStructStor._mkpstor(stordir, cache)
+        if new:
+            # Not under the table lock, see the concurrency model in pdscache
+            pstorObj.cache.attach(pstorObj)
+        return pstorObj
+
+    @staticmethod
+    def forget_all():
+        ''' Forgets all PStors without closing them. This is for a forked
+        child process, whose inherited PStors share their open files (and
+        file positions) with the parent: mkpstor() then opens new ones.
+        The lock is replaced as well, it may have been held by another
+        thread of the parent at the time of the fork. '''
+        PStructStor._pstor_table = {}
+        PStructStor._pstor_table_lock = threading.Lock()
+
+    @staticmethod
+    def forget(pstorObj):
+        ''' Forgets ''pstorObj'' without closing it, mkpstor() of its
+        stordir then opens a new PStor. '''
+        with PStructStor._pstor_table_lock:
+            ref = PStructStor._pstor_table.get(pstorObj._stordir)
+            if ref is not None and ref() is pstorObj:
+                del PStructStor._pstor_table[pstorObj._stordir]
+
+    @staticmethod
+    def _mkpstor(stordir, cache):
         if stordir in PStructStor._pstor_table:
             pstorObj = PStructStor._pstor_table[stordir]()
             if pstorObj:
-                return pstorObj
+                if cache is not None and cache is not pstorObj.cache:
+                    raise RuntimeError("%s already has a different cache"
+                                       % pstorObj)
+                return pstorObj, False
             else:
                 # pstorObj has been garbage collected, need to recreate
                 # delete entry to prevent __init__ from asserting
                 del PStructStor._pstor_table[stordir]
         # Create new pstorObj
+        if cache is None:
+            cache = pdscache.default_cache()
         pstorObj = PStructStor.__new__(PStructStor, stordir)
-        pstorObj.__init__(stordir)
+        pstorObj.__init__(stordir, cache)
         PStructStor._pstor_table[stordir] = weakref.ref(pstorObj)
-        return pstorObj
+        return pstorObj, True
 
     def _create_pds(self, stor_dir):
         ''' Creates PStor top directory. ''stor_dir'' is an absolute path '''
@@ -121,14 +301,20 @@ class PStructStor(object):
         else:
             assert(False)
 
-    def __init__(self, stor_dir):
+    def __init__(self, stor_dir, cache):
         ''' Must use PStructStor.mkpstor() to create pstor. '''
         # Kill program if someone tries to construct a pstor object directly.
         assert(stor_dir not in PStructStor._pstor_table)
+        # The PDSCache that caches OIDs of this pstor
+        self.cache = cache
         self._create_pds(stor_dir)
         # Set active pds according to the active link
         self._set_active(self._get_active())
         self.moving = False
+        # Bumped whenever OIDs are moved by keepOids()
+        self.generation = 0
+        # Protects the stats, which are updated by concurrent readers
+        self._statslock = threading.Lock()
         self.reset_stats()
 
     def reset_stats(self):
@@ -185,19 +371,25 @@ class PStructStor(object):
         ''' Writes a record in storage and return the OID. A "forward pointer"
         field is added. It points to new "forwarded location during copying.
         The pds to write the record to must be specified '''
+        return self._create_rec(pds.create, ofields)
+
+    def _create_rec(self, createfunc, ofields):
+        ''' Packs ''ofields'' and creates the record with ''createfunc'', which
+        is either a pds's or a pds batch writer's create(). '''
         # Pack oid fields (a list)
-        oidrec = PStructStor.default_packer.pack(ofields)
+        oidrec = PStructStor.default_packer.pack(ofields, self._stordir)
         # Newly created OIDs have a zero Oidval as its forward pointer.
         # "Real" OIDs always have a non-zero oid value.
         internalRec = PStructStor._packOidval(0) + oidrec
-        o = pds.create(internalRec)
+        o = createfunc(internalRec)
         # Save this pstor inside the OID - Use self._stordir as the unique
         # identification for this pstor
         self._stampOid(o)
         # Collect creation stats
-        statstup = (self.tot_oids, self.tot_jumps, self.avg_chld_distance)
-        (self.tot_oids, self.tot_jumps, self.avg_chld_distance) = \
-            self.cumulate_stats(statstup, o, ofields)
+        with self._statslock:
+            statstup = (self.tot_oids, self.tot_jumps, self.avg_chld_distance)
+            (self.tot_oids, self.tot_jumps, self.avg_chld_distance) = \
+                self.cumulate_stats(statstup, o, ofields)
         # Now return the newly created Oid ''o''
         return o
 
@@ -233,30 +425,75 @@ class PStructStor(object):
         ''' Creates an OID object in the active pds '''
         return self._create(self.active_pds, oidfields)
 
-    def _getrec(self, pds, o):
-        ''' Get the internal rec for the oid. Unpack and return a tuple of
-        (oidval, oidfields) '''
+    def create_many(self, recs, snames):
+        ''' Creates OIDs for a list of oid fields ''recs'' in the active pds
+        in one go. ''snames'' are the PStruct names of the records. Records of
+        the same size class are written together, in the order they appear in
+        ''recs''. A field can be a BatchRef, which is replaced with the OID of
+        the referred (earlier) record, so a parent can be created in the same
+        batch as its children. Returns the OIDs in the same order as
+        ''recs''. '''
+        writer = self.active_pds.batch()
+        oids = []
+        for ofields, sname in zip(recs, snames):
+            ofields = [oids[f.index] if isinstance(f, BatchRef) else f
+                       for f in ofields]
+            o = self._create_rec(writer.create, ofields)
+            # Must be initialized before a parent refers to it
+            persistds.PStruct.mkpstruct(sname).initOid(o)
+            oids.append(o)
+        writer.commit()
+        return oids
+
+    def _getrawrec(self, pds, o):
+        ''' Get the internal rec for the oid. Return a tuple of (oidval,
+        packed oidfields) '''
         internalRec = pds.getrec(o)
         offset = PStructStor._sizeofPackedOidval()
         oidvalStr = internalRec[:offset]
         forwardOidval = PStructStor._unpackOidval(oidvalStr)
-        rec = internalRec[offset:]
-        ofields = PStructStor.default_packer.unpack(rec)
+        return (forwardOidval, internalRec[offset:])
+
+    def _getrec(self, pds, o):
+        ''' Get the internal rec for the oid. Unpack and return a tuple of
+        (oidval, oidfields) '''
+        forwardOidval, rec = self._getrawrec(pds, o)
+        ofields = PStructStor.default_packer.unpack(rec, self._stordir)
         # Collect access stats
-        statstup = (self.accessed_tot_oids, self.accessed_tot_jumps,
-                    self.accessed_avg_chld_distance)
-        (self.accessed_tot_oids, self.accessed_tot_jumps,
-         self.accessed_avg_chld_distance) = self.cumulate_stats(statstup, o, ofields)
+        with self._statslock:
+            statstup = (self.accessed_tot_oids, self.accessed_tot_jumps,
+                        self.accessed_avg_chld_distance)
+            (self.accessed_tot_oids, self.accessed_tot_jumps,
+             self.accessed_avg_chld_distance) = self.cumulate_stats(statstup, o, ofields)
         return (forwardOidval, ofields)
 
     def getrec(self, o):
         unused, oidfields = self._getrec(self.active_pds, o)
         return oidfields
 
+    def getrawrec(self, o):
+        ''' Returns the packed record of ''o'', to be unpacked with
+        default_packer (passing this pstor's stordir). Access stats are not
+        collected for packed records. '''
+        unused, rec = self._getrawrec(self.active_pds, o)
+        return rec
+
+    def getrawrecs(self, oids):
+        ''' getrawrec() of each of ''oids'', read in storage order. '''
+        offset = PStructStor._sizeofPackedOidval()
+        return [rec[offset:] for rec in self.active_pds.getrecs(oids)]
+
     def close(self):
+        self.cache.detach(self)
+        PStructStor.forget(self)
         self.active_pds.close()
         self.standby_pds.close()
 
+    def flush(self):
+        ''' Makes the records written so far visible to other processes that
+        open the same stordir. '''
+        self.active_pds.flush()
+
     def keepOids(self, roots):
         ''' Start the moving operation. roots are a list of "root OIDs" to
         save. OIDs will be copied starting from these roots in depth first
@@ -271,6 +508,9 @@ class PStructStor(object):
             #print "moving %s" % r
             newroots.append(self._move(r))
         self._swap_active()
+        # Records cached by OID are stale now
+        self.generation += 1
+        self.cache.discard_pstor(self)
         # Expunge the old PDS
         self.standby_pds.expunge()
         self.garbage_cnt = oldoidcnt - self.tot_oids
@@ -293,6 +533,7 @@ class PStructStor(object):
             # this oid is already copied (moved). Just create an OID object
             # that points to the new oidval
             newoid = OID(forwardOidval, oid.size)
+            self._stampOid(newoid)
             ps.initOid(newoid)
             return newoid
         # Go through each field in the list. If a
@@ -51,7 +51,7 @@ class PtrieTester(object):
                 print "Cannot find %s" % w
             else:
                 fields = self.ptrieObj.getfields(wnode)
-                print "Found %s (%d) at %s" % (w, fields['value'], wnode)
+                print "Found %s (%d) at %s" % (w, fields.value, wnode)
 
     def delete(self, word):
         newroot = self.ptrieObj.delete(self.root, word)
@@ -63,18 +63,18 @@ class PtrieTester(object):
 
     def printNode(self, node):
         f = self.ptrieObj.getfields(node)
-        if f['final']:
-            print "(%s : %s)" % (f['prefix'], f['value'])
+        if f.final:
+            print "(%s : %s)" % (f.prefix, f.value)
 
     def makeBFSPrintFunc(self, initialLevel=-1):
         env = {'level': initialLevel}
         def prnode(tn):
             fields = self.ptrieObj.getfields(tn)
-            prefix = fields['prefix']
-            if fields['final']:
-                pfxString = "(%s : %s)" % (fields['prefix'], fields['value'])
+            prefix = fields.prefix
+            if fields.final:
+                pfxString = "(%s : %s)" % (fields.prefix, fields.value)
             else:
-                assert(fields['value'] is None)
+                assert(fields.value is None)
                 pfxString = prefix
             if len(prefix) != env['level']:
                 env['level'] += 1
@@ -86,11 +86,11 @@ class PtrieTester(object):
         level = -1
         for node in self.ptrieObj.bfiter(self.root):
             fields = self.ptrieObj.getfields(node)
-            prefix = fields['prefix']
-            if fields['final']:
-                pfxString = "(%s : %s)" % (fields['prefix'], fields['value'])
+            prefix = fields.prefix
+            if fields.final:
+                pfxString = "(%s : %s)" % (fields.prefix, fields.value)
             else:
-                assert(fields['value'] is None)
+                assert(fields.value is None)
                 pfxString = prefix
             if len(prefix) != level:
                 level += 1
@@ -115,7 +115,8 @@ class PtrieTester(object):
 
             if cmd == "help":
                 print """Type a command. Commands are:
-help quit read load find delete insert dfwalk bfwalk save ls gc inspect stats"""
+help quit read load find delete insert dfwalk bfwalk scan save ls gc inspect
+stats"""
             elif cmd == "quit":
                 ans = raw_input("Save? (y/n)")
                 if ans == "y":
@@ -173,6 +174,13 @@ help quit read load find delete insert dfwalk bfwalk save ls gc inspect stats"""
             elif cmd == "bfwalk":
                 print "Breadth-First Walk:"
                 self.bfwalk()
+            elif cmd == "scan":
+                # scan [prefix [limit]]: words starting with prefix, in order
+                prefix = args[0] if len(args) else None
+                limit = int(args[1]) if len(args) > 1 else None
+                for w, v in self.ptrieObj.items(self.root, prefix,
+                                                limit=limit):
+                    print "(%s : %s)" % (w, v)
             elif cmd == "gc":
                 ans = raw_input(
                     """GC will destroy any unsaved OIDs. After GC is complete,
@@ -14,8 +14,16 @@
 
 
 import os
+import heapq
+import shutil
+import tempfile
+import multiprocessing
+from collections import deque
+from itertools import islice
 import persistds
 from oid import OID
+import pdscache
+from pstructstor import BatchRef, PStructStor
 
 #
 # Global trie node PStruct
@@ -40,27 +48,52 @@ _default_tnode_fields = (
 
 ptrieStruct = persistds.PStruct.mkpstruct('trienode', _default_tnode_fields)
 
+# Fields needed to walk a trie, see Ptrie.getfields()
+_child_fields = ('lcp', 'rsp')
+_search_fields = ('prefix', 'lcp', 'rsp')
+_scan_fields = ('prefix', 'final', 'lcp', 'rsp')
+
 def replace_value(v1, v2):
     return v2
 
+def _swapped(mergevalue):
+    ''' Returns a mergevalue that merges (v1, v2) as ''mergevalue'' merges
+    (v2, v1). '''
+    if mergevalue is None:
+        return replace_value
+    return lambda v1, v2: mergevalue(v2, v1)
+
 class Ptrie(object):
+    # The PStruct of trie nodes. A subclass may use a PStruct with more
+    # fields after those of ptrieStruct, see makeTnode() and _make_many().
+    pstruct = ptrieStruct
+
     def __init__(self, pstor):
         self.pstor = pstor
         
-    def makeTnode(self, **kwargs):
-        return ptrieStruct.make(self.pstor, **kwargs)
+    def makeTnode(self, *args, **kwargs):
+        ''' Makes a trie node. Fields are passed in ptrieStruct order
+        (prefix, value, final, lcp, rsp) and/or by name. '''
+        return self.pstruct.make(self.pstor, *args, **kwargs)
 
-    def getfields(self, oid):
-        return ptrieStruct.getfields(self.pstor, oid)
+    def _make_many(self, rows):
+        ''' Makes a trie node for each of ''rows'', see PStruct.make_many().
+        Returns the OIDs. '''
+        return self.pstruct.make_many(self.pstor, rows)
+
+    def getfields(self, oid, fnames=None):
+        ''' Returns the fields of trie node ''oid'' as a record, or just the
+        fields named in the tuple ''fnames'' as a list. '''
+        return self.pstruct.getfields(self.pstor, oid, fnames)
 
     # A trie is constructed via insertions
     def insert(self, trie, key, value, mergevalue=replace_value):
         ''' Insert a (key, value) as a child node into ''trie''.
         ''key'' is a text key, trie is organized based on the text key.
-        If key exists then the nodes are "merged" '''
+        If key exists then the nodes are "merged": the value is
+        mergevalue(oldval, value), or the old one if mergevalue is None. '''
         #print "Insert: '%s'" % key
-        fields = {'prefix': key, 'value': value, 'final': True,
-                  'lcp': Nulltrie, 'rsp': Nulltrie}
+        fields = ptrieStruct.record(key, value, True, Nulltrie, Nulltrie)
         if not trie:
             return self._create_trie_branch(0, fields)
         return self._insert(trie, fields, mergevalue)
@@ -68,20 +101,19 @@ class Ptrie(object):
     def _insert(self, trie, nodefields, mergevalue):
         ''' Insert a trie node with ''nodefields'' into a trie. '''
         pfinder = PtriePathFinder(self, trie)
-        pfinder.search(nodefields['prefix'])
+        pfinder.search(nodefields.prefix)
         #print pfinder.path
         # The last of node of the search path is either a trie node if the key
         # exists, or Nulltrie if key doesn't.
         if pfinder.target:
-            # key exists, needs merging.
-            newnode = self.makeTnode(
-                prefix=nodefields['prefix'],
-                value=nodefields['value'],
-                final=nodefields['final'],
-                lcp=nodefields['lcp'],
-                rsp=nodefields['rsp'])
-            if mergevalue is None:
+            # The node exists, needs merging. With mergevalue None, a final
+            # node keeps its value, a non-final one takes the new value.
+            final, = self.getfields(pfinder.target, ('final',))
+            if mergevalue is None and final and not nodefields.lcp:
                 return trie
+            newnode = self.makeTnode(nodefields.prefix, nodefields.value,
+                                     nodefields.final, nodefields.lcp,
+                                     nodefields.rsp)
             newnode = self._merge_tnodes(pfinder.target, newnode, mergevalue)
         else:
             # Need to create a new trie node
@@ -89,26 +121,187 @@ class Ptrie(object):
             pn_f = self.getfields(pn)
             if rel == 'rsp':
                 # new node is on the sibling chain
-                pos = len(pn_f['prefix'])
-                rsp = pn_f['rsp']
+                pos = len(pn_f.prefix)
+                rsp = pn_f.rsp
             elif rel == 'lcp':
                 # new node is the lcp
-                pos = len(pn_f['prefix']) + 1
-                rsp = pn_f['lcp']
+                pos = len(pn_f.prefix) + 1
+                rsp = pn_f.lcp
             newnode = self._create_trie_branch(pos, nodefields)
             # Now append the rsp determined from above to the newnode
             fields = self.getfields(newnode)
-            newnode = self.makeTnode(
-                prefix=fields['prefix'],
-                value=fields['value'],
-                final=fields['final'],
-                lcp=fields['lcp'],
-                rsp=rsp)
+            newnode = self.makeTnode(fields.prefix, fields.value, fields.final,
+                                     fields.lcp, rsp)
         # Now reconstruct the search path
         return pfinder.retrace(newnode)
 
+    def insert_many(self, trie, items, mergevalue=replace_value):
+        ''' Inserts ''items'', a sequence of (key, value) pairs, into
+        ''trie'' as insert() would for each pair in turn, but walks the
+        trie once for the whole batch: each node on the search paths is
+        made again only once, however many keys go under it. Returns the
+        new trie, which is ''trie'' itself if nothing changed. '''
+        if not items:
+            return trie
+        # A stable sort, equal keys are merged in batch order
+        items = sorted(items, key=lambda item: item[0])
+        if trie:
+            prefix, = self.getfields(trie, ('prefix',))
+            pos = len(prefix)
+        else:
+            pos = 0
+        if len(items[0][0]) < pos:
+            raise ValueError("Key length must be at least that of the root (%d)"
+                             % pos)
+        return self._insert_chain(trie, items, pos, mergevalue)
+
+    def transient(self, trie=Nulltrie):
+        ''' Returns a TransientPtrie that builds on ''trie'' '''
+        return TransientPtrie(self, trie)
+
+    def _transient_added(self, nodes):
+        ''' Called by TransientPtrie.insert() when it adds a key to the lcp
+        subtree or rsp chain of each of ''nodes'', which it owns. A
+        subclass whose nodes hold something about those keys updates it
+        here. '''
+        pass
+
+    def _insert_chain(self, head, items, pos, mergevalue):
+        ''' Inserts sorted ''items'' into the sibling chain ''head'', whose
+        nodes have prefixes of length ''pos'' (and are ordered by the
+        letter at pos - 1). Returns the new head of the chain. '''
+        # The new chain, entries are either an unchanged node or the
+        # (prefix, value, final, lcp) tuple of a changed or new node.
+        chain = []
+        node = head
+        i = 0
+        while i < len(items):
+            # The group of items that go under the same chain node
+            letter = items[i][0][pos-1:pos]
+            j = i + 1
+            while j < len(items) and items[j][0][pos-1:pos] == letter:
+                j += 1
+            group = items[i:j]
+            i = j
+            # Keep the smaller siblings
+            while node:
+                prefix, lcp, rsp = self.getfields(node, _search_fields)
+                if prefix[pos-1:pos] >= letter:
+                    break
+                chain.append(node)
+                node = rsp
+            if node and prefix[pos-1:pos] == letter:
+                fields = self._insert_node(node, group, pos, mergevalue)
+                if fields is None:
+                    chain.append(node)
+                else:
+                    chain.append(fields)
+                node = rsp
+            else:
+                chain.append(self._insert_node(Nulltrie, group, pos,
+                                               mergevalue))
+        # Nodes after the last change stay in the chain as they are
+        rsp = node
+        while chain and not isinstance(chain[-1], tuple):
+            rsp = chain.pop()
+        if not chain:
+            return head
+        rows = []
+        for entry in reversed(chain):
+            if not isinstance(entry, tuple):
+                f = self.getfields(entry)
+                entry = (f.prefix, f.value, f.final, f.lcp)
+            rows.append(entry + (BatchRef(len(rows) - 1) if rows else rsp,))
+        return self._make_many(rows)[-1]
+
+    def _insert_node(self, node, group, pos, mergevalue):
+        ''' Inserts ''group'', sorted items whose keys share their first
+        ''pos'' letters, into trie node ''node'' of that prefix (or into a
+        new node if ''node'' is Nulltrie). Returns the (prefix, value,
+        final, lcp) of the new node, or None if ''node'' is unchanged. '''
+        if node:
+            f = self.getfields(node)
+            value, final, lcp = f.value, f.final, f.lcp
+        else:
+            value, final, lcp = None, False, Nulltrie
+        changed = not node
+        k = 0
+        while k < len(group) and len(group[k][0]) == pos:
+            # Key is the prefix of this node
+            if not final:
+                value, final, changed = group[k][1], True, True
+            elif mergevalue is not None:
+                value, changed = mergevalue(value, group[k][1]), True
+            k += 1
+        if k < len(group):
+            newlcp = self._insert_chain(lcp, group[k:], pos + 1, mergevalue)
+            changed = changed or newlcp is not lcp
+            lcp = newlcp
+        if not changed:
+            return None
+        return (group[0][0][0:pos], value, final, lcp)
+
+    def build_from_sorted(self, items, mergevalue=replace_value):
+        ''' Builds a trie from ''items'', an iterable of (key, value) pairs
+        sorted by key. Equal keys are merged with mergevalue(oldval,
+        newval), or keep the first value if mergevalue is None, as in
+        insert(). Unlike insert(), every node is made exactly once: a node
+        is only made after all of its children and right siblings, so the
+        prefixes still "open" are kept on a stack. Returns the new trie. '''
+        # Each stack level is [prefix, value, final, children], children
+        # being the (prefix, value, final, lcp) of its closed child nodes,
+        # which are made once their rsp chain is complete.
+        stack = [['', None, False, []]]
+        prevkey = None
+        for key, value in items:
+            if prevkey is not None and key < prevkey:
+                raise ValueError("Keys are not sorted: '%s' after '%s'"
+                                 % (key, prevkey))
+            prevkey = key
+            # Close the open prefixes that key doesn't extend
+            while not key.startswith(stack[-1][0]):
+                self._close_level(stack)
+            level = stack[-1]
+            for p in xrange(len(level[0]) + 1, len(key) + 1):
+                level = [key[0:p], None, False, []]
+                stack.append(level)
+            if level[2]:
+                if mergevalue is not None:
+                    level[1] = mergevalue(level[1], value)
+            else:
+                level[1] = value
+                level[2] = True
+        if prevkey is None:
+            return Nulltrie
+        while len(stack) > 1:
+            self._close_level(stack)
+        prefix, value, final, children = stack[0]
+        return self.makeTnode(prefix, value, final,
+                              self._make_siblings(children), Nulltrie)
+
+    def _close_level(self, stack):
+        ''' Pops the top level of a build_from_sorted() stack and adds it to
+        the children of its parent level. '''
+        prefix, value, final, children = stack.pop()
+        stack[-1][3].append((prefix, value, final,
+                             self._make_siblings(children)))
+
+    def _make_siblings(self, children):
+        ''' Makes a sibling chain out of ''children'', (prefix, value, final,
+        lcp) tuples in key order, and returns the head of the chain. '''
+        if not children:
+            return Nulltrie
+        # Make the chain from the right: each node's rsp is made before it
+        rows = []
+        for prefix, value, final, lcp in reversed(children):
+            rsp = BatchRef(len(rows) - 1) if rows else Nulltrie
+            rows.append((prefix, value, final, lcp, rsp))
+        return self._make_many(rows)[-1]
+
     def merge_trie(self, t1, t2, mergevalue=replace_value):
-        ''' Merges two tries into one '''
+        ''' Merges two tries into one. Keys in both are merged with
+        mergevalue(t1's value, t2's value), or keep t1's value if mergevalue
+        is None. '''
         if not t1: return t2
         if not t2: return t1
         f1 = self.getfields(t1)
@@ -116,60 +309,142 @@ class Ptrie(object):
         # The trie with the shorter prefix is the "parent" trie (tp), the one
         # with the longer prefix will be the "child" trie (tc). tc will be
         # inserted into tp.
-        if len(f1['prefix']) < len(f2['prefix']):
+        if len(f1.prefix) < len(f2.prefix):
             tp = t1; fp = f1; tc = t2; fc = f2
-        elif len(f2['prefix']) < len(f1['prefix']):
+        elif len(f2.prefix) < len(f1.prefix):
             tp = t2; fp = f2; tc = t1; fc = f1
         else:
-            if f1['prefix'] == f2['prefix']:
+            if f1.prefix == f2.prefix:
                 return self._merge_tnodes(t1, t2, mergevalue)
-            elif f1['prefix'] < f2['prefix']:
+            elif f1.prefix < f2.prefix:
                 tp = t1; fp = f1; tc = t2; fc = f2
             else:
                 tp = t2; fp = f2; tc = t1; fc = f1
         # height(tc) >= height(tp)
-        return self._insert(tp, fc, mergevalue)
+        if tc is t1:
+            # The values of tc are the new ones in tp
+            mergevalue = _swapped(mergevalue)
+        # _insert() drops the rsp of the node it inserts, so the siblings of
+        # tc are merged on their own
+        merged = self._insert(tp, fc._replace(rsp=Nulltrie), mergevalue)
+        return self.merge_trie(merged, fc.rsp, mergevalue)
         
+    def merge_many(self, tries, mergevalue=replace_value):
+        ''' Merges ''tries'' into a new trie. All tries are scanned at the
+        same time in key order (see items()) and the merged trie is made in
+        the same pass (see build_from_sorted()), so that memory use is
+        bounded by the depth of the tries times their number. A key in
+        several tries gets mergevalue(oldval, newval) of their values, in
+        the order of ''tries''. '''
+        if mergevalue is None:
+            mergevalue = lambda v1, v2: v1
+        # (key, index of trie, value): equal keys come in trie order
+        def stream(i, trie):
+            for k, v in self.items(trie):
+                yield (k, i, v)
+        streams = [stream(i, t) for i, t in enumerate(tries)]
+        return self.build_from_sorted(((k, v) for k, i, v
+                                       in heapq.merge(*streams)), mergevalue)
+
+    def parallel_merge(self, tries, workdir, mergevalue=replace_value,
+                       processes=None):
+        ''' merge_many() with a pool of ''processes'' worker processes
+        (default: one per CPU). The first-level nodes of ''tries'' are
+        grouped by letter: the subtries of a letter found in one trie are
+        kept as they are, the others are merged by a worker in a temporary
+        PStor of its own under ''workdir'', which the worker removes once it
+        has sent back the merged (key, value) items. The merged subtries are
+        then built from those items in self.pstor, so the new trie is all
+        in self.pstor. ''mergevalue'' is sent to the workers, it must be a
+        module-level function (or None) so that it can be pickled. '''
+        tries = [t for t in tries if t]
+        if len(tries) < 2:
+            return tries[0] if tries else Nulltrie
+        value, final = None, False
+        # letter => first-level nodes, in the order of tries
+        groups = {}
+        for trie in tries:
+            f = self.getfields(trie)
+            if f.final:
+                if not final:
+                    value, final = f.value, True
+                elif mergevalue is not None:
+                    value = mergevalue(value, f.value)
+            node = f.lcp
+            while node:
+                prefix, lcp, rsp = self.getfields(node, _search_fields)
+                groups.setdefault(prefix, []).append(node)
+                node = rsp
+        workdir = os.path.abspath(workdir)
+        tasks = [(type(self), letter, [pdscache.write_coid(n) for n in nodes],
+                  workdir, mergevalue)
+                 for letter, nodes in groups.items() if len(nodes) > 1]
+        merged = {}
+        if tasks:
+            # The workers open self.pstor on their own
+            self.pstor.flush()
+            pool = multiprocessing.Pool(processes,
+                                        initializer=_merge_worker_init)
+            try:
+                merged = dict(pool.map(_merge_partition, tasks, 1))
+            finally:
+                pool.close()
+                pool.join()
+        rows = []
+        rsp = Nulltrie
+        for letter in sorted(groups.keys(), reverse=True):
+            if letter in merged:
+                trie = self.build_from_sorted(merged[letter])
+                node, = self.getfields(trie, ('lcp',))
+            else:
+                node = groups[letter][0]
+            f = self.getfields(node)
+            rows.append((f.prefix, f.value, f.final, f.lcp, rsp))
+            rsp = BatchRef(len(rows) - 1)
+        head = self._make_many(rows)[-1]
+        return self.makeTnode('', value, final, head, Nulltrie)
+
     def _merge_tnodes(self, tn1, tn2, mergevalue=replace_value):
         ''' Merges tries tn1 and tn2 into one. tn1 and tn2 must have the same
         prefix (key) '''
         f1 = self.getfields(tn1)
         f2 = self.getfields(tn2)
-        assert(f1['prefix'] == f2['prefix'])
-        final = f1['final'] or f2['final']
+        assert(f1.prefix == f2.prefix)
+        final = f1.final or f2.final
         # Merge old value with new value in mergevalue(oldval, newval)
-        if f1['final'] and f2['final']:
-            value = mergevalue(f1['value'], f2['value'])
-        elif f1['final']:
-            value = f1['value']
-        elif f2['final']:
-            value = f2['value']
+        if f1.final and f2.final:
+            if mergevalue is None:
+                value = f1.value
+            else:
+                value = mergevalue(f1.value, f2.value)
+        elif f1.final:
+            value = f1.value
+        elif f2.final:
+            value = f2.value
         else:
             value = None
-        rsp = self.merge_trie(f1['rsp'], f2['rsp'], mergevalue)
-        lcp = self.merge_trie(f1['lcp'], f2['lcp'], mergevalue)
-        return self.makeTnode(prefix=f1['prefix'], value=value, final=final,
-                              lcp=lcp, rsp=rsp)
+        rsp = self.merge_trie(f1.rsp, f2.rsp, mergevalue)
+        lcp = self.merge_trie(f1.lcp, f2.lcp, mergevalue)
+        return self.makeTnode(f1.prefix, value, final, lcp, rsp)
 
     def _create_trie_branch(self, pos, fields):
         ''' Creat a trie branch whose leaf is specified by ''fields''. Branch
         creation starts from ''pos'' of the prefix of the leaf node. '''
-        key = fields['prefix']
+        key = fields.prefix
         if pos > len(key):
             raise ValueError("pos %d is out of bounds for key %s" % (pos, key))
         # Create leaf node first, then work backwards
-        node = fields['lcp']
+        node = fields.lcp
         p = len(key)
         while p >= pos:
             val = None
             final = False
             rsp = Nulltrie
             if p == len(key): # leaf node
-                val = fields['value']
-                final = fields['final']
-                rsp = fields['rsp']
-            node = self.makeTnode(prefix=key[0:p], value=val, final=final,
-                                  lcp=node, rsp=rsp)
+                val = fields.value
+                final = fields.final
+                rsp = fields.rsp
+            node = self.makeTnode(key[0:p], val, final, node, rsp)
             p -= 1
         return node
 
@@ -201,21 +476,21 @@ class Ptrie(object):
             #print '<<<<<==%s==<<<<<' % res
             return res
         headfds = self.getfields(head)
-        assert(endpos == len(headfds['prefix']))
+        assert(endpos == len(headfds.prefix))
         # string[-1:0] is an empty string so this works fine for endpos == 0
         newkey = key[endpos-1:endpos]
-        headkey = headfds['prefix'][endpos-1:endpos]
+        headkey = headfds.prefix[endpos-1:endpos]
         diff = cmp(newkey, headkey)
         #print 'key %s headkey %s' % (newkey, headkey)
         if diff == 0:
             # Same prefix, but still need to update final and new children
-            lcp = self.orderedInsert(headfds['lcp'], key, value, endpos + 1)
+            lcp = self.orderedInsert(headfds.lcp, key, value, endpos + 1)
             # If head was final then it needs to remain final
-            final = final or headfds['final']
+            final = final or headfds.final
             res = self.makeTnode(prefix=prefix, final=final,
                                  value=intrmedValue(final),
                                  lcp=lcp,
-                                 rsp=headfds['rsp'])
+                                 rsp=headfds.rsp)
             #print '<<<<==%s==<<<<<<' % res
             return res
         elif diff < 0:
@@ -228,66 +503,270 @@ class Ptrie(object):
             return res
         else:
             # newkey is bigger, insert into head's rsp => newrsp
-            newrsp = self.orderedInsert(headfds['rsp'], key, value, endpos)
-            res = self.makeTnode(prefix=headfds['prefix'],
-                                 final=headfds['final'],
+            newrsp = self.orderedInsert(headfds.rsp, key, value, endpos)
+            res = self.makeTnode(prefix=headfds.prefix,
+                                 final=headfds.final,
                                  value=intrmedValue(final),
-                                 lcp=headfds['lcp'], rsp=newrsp)
+                                 lcp=headfds.lcp, rsp=newrsp)
             #print '<<<<<==%s==<<<<<' % res
             return res
 
-    def dfiter(self, trie):
-        """ An iterator that traverses the trie in depth-first order """
+    def dfiter(self, trie, prefetch=0):
+        """ An iterator that traverses the trie in depth-first order. With
+        ''prefetch'', the next ''prefetch'' nodes to visit are read in one
+        go, in storage order, when the next node hasn't been read yet. """
         if trie is Nulltrie:
             return
-        for node in self._dfs([trie]):
+        for node in self._dfs([trie], prefetch):
             yield node
 
-    def _dfs(self, rest):
+    def _dfs(self, rest, prefetch=0):
         ''' iterative version of dfs '''
+        prefetched = set()
         while len(rest):
             curr = rest.pop()
+            if prefetch and curr not in prefetched:
+                # Next nodes are at the end of the stack
+                self._prefetch(curr, reversed(rest), prefetch, prefetched)
+            prefetched.discard(curr)
             yield curr
-            f = self.getfields(curr)
-            if f['rsp']:
-                rest.append(f['rsp'])
-            if f['lcp']:
-                rest.append(f['lcp'])
-
-    def bfiter(self, trie):
-        ''' Iterate trie in breadth-first order '''
+            lcp, rsp = self.getfields(curr, _child_fields)
+            if rsp:
+                rest.append(rsp)
+            if lcp:
+                rest.append(lcp)
+
+    def bfiter(self, trie, prefetch=0):
+        ''' Iterate trie in breadth-first order, see dfiter() for
+        ''prefetch''. '''
         if trie is Nulltrie:
             return
-        for node in self._bfs([trie]):
+        for node in self._bfs(deque([trie]), prefetch):
             yield node
 
-    def _bfs(self, rest):
-        ''' Iterative version of bf search '''
+    def _bfs(self, rest, prefetch=0):
+        ''' Iterative version of bf search, ''rest'' is a deque '''
+        prefetched = set()
         while len(rest):
-            curr = rest.pop(0)
+            curr = rest.popleft()
+            if prefetch and curr not in prefetched:
+                self._prefetch(curr, rest, prefetch, prefetched)
+            prefetched.discard(curr)
             yield curr
-            fields = self.getfields(curr)
-            if fields['lcp']:
-                rest.append(fields['lcp'])
-            if fields['rsp']:
-                rest.insert(0, fields['rsp'])
+            lcp, rsp = self.getfields(curr, _child_fields)
+            if lcp:
+                rest.append(lcp)
+            if rsp:
+                rest.appendleft(rsp)
+
+    def _prefetch(self, curr, nextnodes, prefetch, prefetched):
+        ''' Reads the child fields of ''curr'' and of the next
+        ''prefetch'' - 1 of ''nextnodes'' that aren't in the set
+        ''prefetched'' in one go. Adds them to ''prefetched''. '''
+        nodes = [curr] + [n for n in islice(nextnodes, prefetch - 1)
+                          if n not in prefetched]
+        if len(nodes) == 1:
+            # Nothing to batch curr with, it is read when visited
+            return
+        self.pstruct.getfields_many(self.pstor, nodes, _child_fields)
+        prefetched.update(nodes)
+
+    def items(self, trie, prefix=None, start=None, stop=None, reverse=False,
+              limit=None):
+        ''' Iterates (key, value) of the final nodes of ''trie'' in key
+        order (descending if ''reverse''), lazily. Only keys starting with
+        ''prefix'', from ''start'' (inclusive) to ''stop'' (exclusive), and
+        at most ''limit'' of them. The iteration starts at the first key of
+        the range: only the nodes on the way there are read. '''
+        if not trie or limit == 0:
+            return
+        base = trie
+        if prefix:
+            pfinder = PtriePathFinder(self, trie)
+            pfinder.search(prefix)
+            base = pfinder.target
+            if not base:
+                return
+        if reverse:
+            nodes = self._rev_nodes(base, stop)
+        else:
+            nodes = self._fwd_nodes(base, start)
+        count = 0
+        for node, key, final in nodes:
+            if reverse and start is not None and key < start:
+                return
+            if not reverse and stop is not None and key >= stop:
+                return
+            if final:
+                value, = self.getfields(node, ('value',))
+                yield (key, value)
+                count += 1
+                if count == limit:
+                    return
+
+    def page(self, trie, limit, cursor=None, prefix=None, start=None,
+             stop=None, reverse=False):
+        ''' Returns a page of at most ''limit'' items() and a cursor for the
+        next page, None after the last page. Pass the cursor of a page to
+        get the next one, with the same arguments. '''
+        if cursor is not None:
+            # A cursor is the last key of its page, which is skipped
+            if reverse:
+                stop = cursor
+            else:
+                start = cursor
+                limit += 1
+        res = list(self.items(trie, prefix, start, stop, reverse, limit))
+        if cursor is not None and not reverse:
+            limit -= 1
+            if res and res[0][0] == cursor:
+                del res[0]
+            else:
+                del res[limit:]
+        if len(res) < limit:
+            return res, None
+        return res, res[-1][0]
+
+    def _fwd_nodes(self, base, start):
+        ''' Iterates (node, key, final) of the subtrie ''base'' in key order,
+        from the first key not less than ''start''. '''
+        # Entries are (node, follow rsp): rsp of base is not in the subtrie
+        stack = []
+        prefix, lcp = self.getfields(base, ('prefix', 'lcp'))
+        if start is None or start <= prefix:
+            stack.append((base, False))
+        elif start.startswith(prefix):
+            # Go down the path of start, keeping what comes after it
+            pos = len(prefix) + 1
+            node = lcp
+            while node:
+                prefix, lcp, rsp = self.getfields(node, _search_fields)
+                if prefix[pos-1] < start[pos-1]:
+                    node = rsp
+                    continue
+                if prefix[pos-1] > start[pos-1]:
+                    stack.append((node, True))
+                    break
+                if rsp:
+                    stack.append((rsp, True))
+                if pos == len(start):
+                    stack.append((node, False))
+                    break
+                node = lcp
+                pos += 1
+        while stack:
+            node, follow = stack.pop()
+            prefix, final, lcp, rsp = self.getfields(node, _scan_fields)
+            if follow and rsp:
+                stack.append((rsp, True))
+            if lcp:
+                stack.append((lcp, True))
+            yield (node, prefix, final)
+
+    def _rev_nodes(self, base, stop):
+        ''' Iterates (node, key, final) of the subtrie ''base'' in
+        descending key order, from the last key less than ''stop''. '''
+        # Entries are (node, is a chain): a chain's nodes and their subtries
+        # are visited, otherwise just the node itself.
+        stack = []
+        prefix, lcp = self.getfields(base, ('prefix', 'lcp'))
+        if stop is None or not stop.startswith(prefix):
+            if stop is None or prefix < stop:
+                stack.append((base, False))
+                stack.append((lcp, True))
+        elif stop != prefix:
+            stack.append((base, False))
+            pos = len(prefix) + 1
+            node = lcp
+            while node:
+                prefix, lcp, rsp = self.getfields(node, _search_fields)
+                if prefix[pos-1] > stop[pos-1]:
+                    break
+                if prefix[pos-1] < stop[pos-1]:
+                    stack.append((node, False))
+                    stack.append((lcp, True))
+                    node = rsp
+                    continue
+                if pos < len(stop):
+                    stack.append((node, False))
+                    node = lcp
+                    pos += 1
+                else:
+                    break
+        while stack:
+            node, chain = stack.pop()
+            if not chain:
+                prefix, final = self.getfields(node, ('prefix', 'final'))
+                yield (node, prefix, final)
+                continue
+            # Subtries of the chain come in reverse order, each after its
+            # children
+            while node:
+                stack.append((node, False))
+                lcp, rsp = self.getfields(node, _child_fields)
+                if lcp:
+                    stack.append((lcp, True))
+                node = rsp
 
     def find(self, trie, key, finalOnly=True):
         ''' Find a Ptrie node with the "final" prefix of key. '''
         if not trie:
             return Nulltrie
-        fields = self.getfields(trie)
-        if len(fields['prefix']) != 0:
+        prefix, = self.getfields(trie, ('prefix',))
+        if len(prefix) != 0:
             raise RuntimeError("Search must start from root")
         pfinder = PtriePathFinder(self, trie)
         pfinder.search(key)
         #print pfinder.path
         if pfinder.target:
-            fields = self.getfields(pfinder.target)
-            if (not finalOnly) or fields['final']:
+            final, = self.getfields(pfinder.target, ('final',))
+            if (not finalOnly) or final:
                 return pfinder.target
         return Nulltrie
 
+    def find_many(self, trie, keys, finalOnly=True):
+        ''' find() of each of ''keys''. Returns the nodes (or Nulltrie) in
+        the order of keys. The keys are looked up in sorted order, and a
+        search starts from where the search of the previous key left the
+        path they have in common: each node is read at most once per
+        batch. '''
+        results = [Nulltrie] * len(keys)
+        if not trie:
+            return results
+        prefix, = self.getfields(trie, ('prefix',))
+        if len(prefix) != 0:
+            raise RuntimeError("Search must start from root")
+        # path[d] is the node of key[:d] and chain[d] is the first of its
+        # children whose letter is not less than that of the previous key
+        path = [trie]
+        chain = [self.getfields(trie, ('lcp',))[0]]
+        prevkey = None
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            key = keys[i]
+            if prevkey is not None:
+                common = os.path.commonprefix((prevkey, key))
+                del path[len(common) + 1:]
+                del chain[len(common) + 1:]
+            prevkey = key
+            while len(path) <= len(key):
+                d = len(path) - 1
+                node = chain[d]
+                while node:
+                    prefix, lcp, rsp = self.getfields(node, _search_fields)
+                    if prefix[d] >= key[d]:
+                        break
+                    node = rsp
+                chain[d] = node
+                if not node or prefix[d] != key[d]:
+                    break
+                path.append(node)
+                chain.append(lcp)
+            if len(path) == len(key) + 1:
+                final, = self.getfields(path[-1], ('final',))
+                if (not finalOnly) or final:
+                    results[i] = path[-1]
+        return results
+
     def delete(self, trie, key):
         ''' Deletes a trie node whose prefix matches key from the trie. '''
         pfinder = PtriePathFinder(self, trie)
@@ -296,21 +775,17 @@ class Ptrie(object):
             return trie
         # Need to reconstruct new trie with the target removed
         fields = self.getfields(pfinder.target)
-        if not fields['final']: # This is an intermediate node, doesn't count
+        if not fields.final: # This is an intermediate node, doesn't count
             return trie
         # This is true match. Now if the trie node has children,
         # then the node is kept but its 'final' bit is marked off and the
         # ''value'' field is set to None. Otherwise remove the node and
         # returns its right sibling.
-        if fields['lcp']:
-            newnode = self.makeTnode(
-                prefix=fields['prefix'],
-                value=None,
-                final=False,
-                lcp=fields['lcp'],
-                rsp=fields['rsp'])
+        if fields.lcp:
+            newnode = self.makeTnode(fields.prefix, None, False, fields.lcp,
+                                     fields.rsp)
         else:
-            newnode = fields['rsp']
+            newnode = fields.rsp
         # Delete any "hanging" branch - an internal (non-final) node with
         # no children
         while not newnode:
@@ -322,16 +797,16 @@ class Ptrie(object):
             predecessor, rel = PtriePathFinder.decode_path_mark(pmark)
             fields = self.getfields(predecessor)
 #            print "<%s -> %s> (lcp %s rsp %s)" % \
-#                (fields['prefix'], rel, fields['lcp'], fields['rsp'])
+#                (fields.prefix, rel, fields.lcp, fields.rsp)
             # Predecessor is either
             # 1) a final node or
             # 2) an internal node with an lcp and that lcp is not the delete
             #    target (if delete target is the lcp of predecessor then
-            #    fields['lcp'] points to the "old" deletion target)
-            if fields['final'] or (rel != 'lcp' and fields['lcp']):
+            #    fields.lcp points to the "old" deletion target)
+            if fields.final or (rel != 'lcp' and fields.lcp):
                 break # stop here
             # Predecessor is an internal node with no children
-            newnode = fields['rsp']
+            newnode = fields.rsp
             pfinder.path.pop(0)
         return pfinder.retrace(newnode)
             
@@ -344,50 +819,38 @@ class Ptrie(object):
             return Nulltrie
         targetkey = key[endpos-1:endpos]
         fields = self.getfields(trie)
-        triekey = fields['prefix'][endpos-1:endpos]
+        triekey = fields.prefix[endpos-1:endpos]
         if targetkey == triekey:
             if endpos == len(key):
                 # whole key matched.
-                if not fields['final']:
+                if not fields.final:
                     # Not found, trie is left unchanged
                     return trie
                 # This is true match. Now if the trie node has children,
                 # then the node is kept but its 'final' bit is marked off.
                 # Otherwise remove the node and returns its right sibling.
-                if fields['lcp']:
-                    return self.makeTnode(
-                        prefix=fields['prefix'],
-                        value=fields['value'],
-                        final=False,
-                        lcp=fields['lcp'],
-                        rsp=fields['rsp'])
+                if fields.lcp:
+                    return self.makeTnode(fields.prefix, fields.value, False,
+                                          fields.lcp, fields.rsp)
                 else:
-                    return fields['rsp']
+                    return fields.rsp
             else:
                 # search children with the next position
-                newtrie = self.deleteByPosition(fields['lcp'], key, endpos+1)
-                if newtrie is fields['lcp']:
+                newtrie = self.deleteByPosition(fields.lcp, key, endpos+1)
+                if newtrie is fields.lcp:
                     # nothing deleted
                     return trie
                 else:
-                    return self.makeTnode(
-                        prefix=fields['prefix'],
-                        value=fields['value'],
-                        final=fields['final'],
-                        lcp=newtrie,
-                        rsp=fields['rsp'])
+                    return self.makeTnode(fields.prefix, fields.value,
+                                          fields.final, newtrie, fields.rsp)
         elif targetkey > triekey:
             # Keep going down the sibling chain
-            newtrie = self.deleteByPosition(fields['rsp'], key, endpos)
-            if newtrie is fields['rsp']:
+            newtrie = self.deleteByPosition(fields.rsp, key, endpos)
+            if newtrie is fields.rsp:
                 return trie
             else:
-                return self.makeTnode(
-                    prefix=fields['prefix'],
-                    value=fields['value'],
-                    final=fields['final'],
-                    lcp=fields['lcp'],
-                    rsp=newtrie)
+                return self.makeTnode(fields.prefix, fields.value,
+                                      fields.final, fields.lcp, newtrie)
         else:
             # not found
             return trie
@@ -401,11 +864,11 @@ class Ptrie(object):
         odict = {}
         for node in self.bfiter(trie):
             fields =self.getfields(node)
-            prefix = fields['prefix']
-            if fields['final']:
-                pfxString = "(%s : %s)" % (fields['prefix'], fields['value'])
+            prefix = fields.prefix
+            if fields.final:
+                pfxString = "(%s : %s)" % (fields.prefix, fields.value)
             else:
-                assert(fields['value'] is None)
+                assert(fields.value is None)
                 pfxString = prefix
             # Add debug info and store them into a dict of lists
             sz = node.oid.size
@@ -430,6 +893,146 @@ class Ptrie(object):
                 print "%04d: '%s'" % (node[2], node[0])
 
 
+# Cache size (number of entries) of the PStor of a parallel_merge() worker
+_merge_cache_size = 8192
+
+def _merge_worker_init():
+    ''' Worker process initializer of Ptrie.parallel_merge(). The PStors and
+    caches inherited from the parent can't be used, the worker opens its
+    own. '''
+    PStructStor.forget_all()
+    pdscache.forget_default_caches()
+
+def _merge_partition(task):
+    ''' Merges the first-level nodes of a letter in a worker process of
+    Ptrie.parallel_merge(), with an object of ''cls'' (Ptrie or a
+    subclass). Returns (letter, the sorted (key, value) items of the merged
+    node). The worker PStor is removed. '''
+    cls, letter, oids, workdir, mergevalue = task
+    stordir = tempfile.mkdtemp(prefix="merge-%02x-" % ord(letter),
+                               dir=workdir)
+    # A cache of its own, dropped with the PStor: the entries left in it
+    # are never written
+    pstor = PStructStor.mkpstor(stordir,
+                                pdscache.PDSCache(_merge_cache_size))
+    ptrieObj = cls(pstor)
+    trie = ptrieObj.merge_many([pdscache.read_oid(o) for o in oids],
+                               mergevalue)
+    items = list(ptrieObj.items(trie))
+    del trie
+    pstor.close()
+    shutil.rmtree(stordir)
+    return (letter, items)
+
+
+class TransientPtrie(object):
+    ''' A trie builder that changes its own nodes in place, in the manner
+    of Clojure's transients, instead of making the path to each new key
+    again. The nodes made by the builder are its own until they are
+    written to storage (e.g. when evicted from cache), other nodes are
+    copied when they first have to change. persistent() ends the builder
+    and returns the trie, an ordinary immutable trie from then on. The
+    trie must not be used in any other way before that. '''
+    def __init__(self, ptrieObj, trie=Nulltrie):
+        if trie:
+            prefix, = ptrieObj.getfields(trie, ('prefix',))
+            if len(prefix) != 0:
+                raise RuntimeError("Search must start from root")
+        self._ptrieObj = ptrieObj
+        self._root = trie
+        # seqnums of the nodes made by the builder
+        self._owned = set()
+
+    def _make(self, *fields):
+        node = self._ptrieObj.makeTnode(*fields)
+        self._owned.add(node.seqnum)
+        return node
+
+    def _link(self, owner, field, old, new):
+        ''' Makes the ''field'' of ''owner'' point to ''new'' instead of
+        ''old'' '''
+        if new is not old:
+            self._ptrieObj.pstruct.setfields(self._ptrieObj.pstor, owner,
+                                             **{field: new})
+
+    def _hold(self, node, held):
+        ''' Returns ''node'', or a copy of it if the builder doesn't own
+        it, pinned for the rest of an insert(): a node that is written
+        to storage can't change any more. The node is added to ''held''. '''
+        # A node is checked once pinned, a background flusher may write it
+        # until then (a new copy as well).
+        pdscache.pin(node)
+        while node.seqnum not in self._owned or node.oid is not None:
+            pdscache.unpin(node)
+            f = self._ptrieObj.getfields(node)
+            node = self._make(f.prefix, f.value, f.final, f.lcp, f.rsp)
+            pdscache.pin(node)
+        held.append(node)
+        return node
+
+    def insert(self, key, value, mergevalue=replace_value):
+        ''' Inserts (key, value) as Ptrie.insert() does '''
+        if self._ptrieObj is None:
+            raise RuntimeError("persistent() has been called")
+        held = []
+        try:
+            self._insert(key, value, mergevalue, held)
+        finally:
+            for node in held:
+                pdscache.unpin(node)
+
+    def _insert(self, key, value, mergevalue, held):
+        ''' insert(). ''held'' gets the nodes on the way to key (the root,
+        the nodes of key's prefixes and the siblings before them). '''
+        ptrieObj = self._ptrieObj
+        if not self._root:
+            self._root = self._make('', None, False, Nulltrie, Nulltrie)
+        node = self._root = self._hold(self._root, held)
+        for d in range(len(key)):
+            # Find the child of node for key[d]
+            owner, field = node, 'lcp'
+            child, = ptrieObj.getfields(node, ('lcp',))
+            while child:
+                prefix, rsp = ptrieObj.getfields(child, ('prefix', 'rsp'))
+                if prefix[d] >= key[d]:
+                    break
+                sibling = self._hold(child, held)
+                self._link(owner, field, child, sibling)
+                owner, field = sibling, 'rsp'
+                child = rsp
+            if child and prefix[d] == key[d]:
+                node = self._hold(child, held)
+                self._link(owner, field, child, node)
+                continue
+            # Make the nodes of key[:d+1] to key, in front of child
+            new = Nulltrie
+            for p in range(len(key), d, -1):
+                if p == len(key):
+                    new = self._make(key, value, True, new,
+                                     child if p == d + 1 else Nulltrie)
+                else:
+                    new = self._make(key[:p], None, False, new,
+                                     child if p == d + 1 else Nulltrie)
+            self._link(owner, field, child, new)
+            ptrieObj._transient_added(held)
+            return
+        oldval, final = ptrieObj.getfields(node, ('value', 'final'))
+        if final:
+            if mergevalue is not None:
+                ptrieObj.pstruct.setfields(ptrieObj.pstor, node,
+                                           value=mergevalue(oldval, value))
+        else:
+            ptrieObj.pstruct.setfields(ptrieObj.pstor, node, value=value,
+                                       final=True)
+            ptrieObj._transient_added(held)
+
+    def persistent(self):
+        ''' Ends the builder, returns the trie '''
+        self._ptrieObj = None
+        self._owned = None
+        return self._root
+
+
 class PtriePathFinder(object):
     ''' A Helper class that specializes in finding a node in a ptrie and saves
     the path leading to the node. Also helps in reconstructing a new ptrie
@@ -445,8 +1048,8 @@ class PtriePathFinder(object):
         if not self._root:
             # Empty trie: return empty path.
             return
-        fields = self._ptrieObj.getfields(self._root)
-        startpos = len(fields['prefix'])
+        prefix, = self._ptrieObj.getfields(self._root, ('prefix',))
+        startpos = len(prefix)
         if startpos > len(key):
             raise ValueError("Key length must be at least that of the root (%d)"
                              % startpos)
@@ -460,21 +1063,22 @@ class PtriePathFinder(object):
             if not trie:
                 return
             targetkey = key[pos-1:pos]
-            fields = self._ptrieObj.getfields(trie)
-            triekey = fields['prefix'][pos-1:pos]
-            #print "%s <=> %s" % (PtriePathFinder.markstrpos(key, pos), fields['prefix'])
+            # Only the fields needed to navigate, a node's value may be big
+            prefix, lcp, rsp = self._ptrieObj.getfields(trie, _search_fields)
+            triekey = prefix[pos-1:pos]
+            #print "%s <=> %s" % (PtriePathFinder.markstrpos(key, pos), prefix)
             if targetkey == triekey:
                 # This position is a match, now move on the next position,
                 #starting from the first child of this trie node.
                 self.path.insert(0, PtriePathFinder.make_path_mark(
                         trie, "lcp"))
-                trie = fields['lcp']
+                trie = lcp
                 pos += 1
             elif targetkey > triekey:
                 # Search next sibling at the same position
                 self.path.insert(0, PtriePathFinder.make_path_mark(
                         trie, "rsp"))
-                trie = fields['rsp']
+                trie = rsp
             else:
                 # siblings are ordered by key, so this means the target key is
                 # not present
@@ -491,19 +1095,13 @@ class PtriePathFinder(object):
             pn, rel = PtriePathFinder.decode_path_mark(pmark)
             pn_f = self._ptrieObj.getfields(pn)
             if rel == 'rsp':
-                newroot = self._ptrieObj.makeTnode(
-                    prefix=pn_f['prefix'],
-                    value=pn_f['value'],
-                    final=pn_f['final'],
-                    lcp=pn_f['lcp'],
-                    rsp=newroot)
+                newroot = self._ptrieObj.makeTnode(pn_f.prefix, pn_f.value,
+                                                   pn_f.final, pn_f.lcp,
+                                                   newroot)
             elif rel == 'lcp':
-                newroot = self._ptrieObj.makeTnode(
-                    prefix=pn_f['prefix'],
-                    value=pn_f['value'],
-                    final=pn_f['final'],
-                    lcp=newroot,
-                    rsp=pn_f['rsp'])
+                newroot = self._ptrieObj.makeTnode(pn_f.prefix, pn_f.value,
+                                                   pn_f.final, newroot,
+                                                   pn_f.rsp)
             else:
                 raise RuntimeError("Invalid Path Marker: %s" % rel)
         return newroot
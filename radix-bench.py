@@ -0,0 +1,79 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+# Compares a Ptrie with a RadixTrie (path compressed) holding the same long
+# keys: the number of nodes, their storage, and the cost of find(). Keys
+# share a few common prefixes, like URLs or ngrams do.
+#
+# Usage: radix-bench.py numkeys keylen cachesize
+
+
+import random
+import ptrie
+import radixtrie
+import benchutil
+
+
+def mkkeys(n, keylen):
+    random.seed(1)
+    heads = ["".join([random.choice("abcdefghijklmnop")
+                      for i in range(keylen / 2)]) for j in range(16)]
+    keys = set()
+    while len(keys) < n:
+        tail = "".join([random.choice("abcdefghijklmnop")
+                        for i in range(keylen - keylen / 2)])
+        keys.add(random.choice(heads) + tail)
+    return sorted(keys)
+
+def measure(trieObj, ofs, keys, name):
+    ''' Returns the nodes and bytes of the trie of ''keys'', the usec per
+    find(), and the values found '''
+    root = radixtrie.Nulltrie
+    for i, k in enumerate(keys):
+        root = trieObj.insert(root, k, i)
+    ofs.store(root, name)
+    ofs.gc()
+    root = ofs.load(name)
+    nodes = nbytes = 0
+    for node in trieObj.dfiter(root):
+        nodes += 1
+        nbytes += node.oid.size
+    def find():
+        found = []
+        for k in keys:
+            node = trieObj.find(root, k)
+            if not node:
+                raise RuntimeError("%s not found" % k)
+            found.append(node)
+        return found
+    elapsed, found = benchutil.timed(find)
+    values = [trieObj.getfields(n, ('value',))[0] for n in found]
+    return nodes, nbytes, elapsed * 1000000 / len(keys), values
+
+
+if __name__ == "__main__":
+    nkeys, keylen, cachesize = benchutil.getargs("numkeys keylen cachesize",
+                                                 3)
+    store = benchutil.BenchStore(cachesize)
+    keys = mkkeys(nkeys, keylen)
+    print "%-10s %10s %12s %12s" % ("", "nodes", "KB", "usec/find")
+    for name, trieObj in (("ptrie", ptrie.Ptrie(store.pstor)),
+                          ("radixtrie", radixtrie.RadixTrie(store.pstor))):
+        nodes, nbytes, usec, values = measure(trieObj, store.ofs, keys, name)
+        print "%-10s %10d %12d %12.1f" % (name, nodes, nbytes / 1024, usec)
+        # Each key finds the value inserted with it
+        benchutil.check(name, values, range(len(keys)))
+    store.close()
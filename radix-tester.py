@@ -0,0 +1,168 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Runs random inserts, deletes and merge_trie() on a RadixTrie and checks
+# items() and find() against a dict after each step, and that the nodes are
+# in shape: labels that are not empty, siblings in letter order and no
+# non-final node with one child (but the root). The keys share prefixes, so
+# that inserts and merges split edge labels and deletes collapse nodes;
+# these are counted and must all have happened.
+#
+# Usage: radix-tester.py [steps]
+
+
+import sys
+import random
+import shutil
+import tempfile
+import ostore
+import pdscache
+import radixtrie
+from ptrie import replace_value
+
+
+def add_values(v1, v2):
+    return v1 + v2
+
+class CountingRadixTrie(radixtrie.RadixTrie):
+    ''' Counts the node collapses and the edge splits of merges '''
+    counts = {"collapse": 0, "merge split": 0, "merge under": 0}
+
+    def _collapse(self, label, value, final, lcp, rsp):
+        res = radixtrie.RadixTrie._collapse(self, label, value, final, lcp,
+                                            rsp)
+        if isinstance(res, tuple) and res[0] != label:
+            self.counts["collapse"] += 1
+        return res
+
+    def _merge_nodes(self, f1, f2, mergevalue):
+        n = radixtrie._common_length(f1.label, f2.label)
+        if n < min(len(f1.label), len(f2.label)):
+            self.counts["merge split"] += 1
+        elif len(f1.label) != len(f2.label):
+            self.counts["merge under"] += 1
+        return radixtrie.RadixTrie._merge_nodes(self, f1, f2, mergevalue)
+
+def random_key():
+    return "".join([random.choice("abc") for j in range(random.randint(0, 6))])
+
+def random_trie(radixObj, ref, n):
+    trie = radixtrie.Nulltrie
+    for i in range(n):
+        key = random_key()
+        trie = radixObj.insert(trie, key, i)
+        ref[key] = i
+    return trie
+
+def merge_dicts(d1, d2, mergevalue):
+    res = dict(d2)
+    for k, v in d1.items():
+        if k in d2 and mergevalue is not None:
+            res[k] = mergevalue(v, d2[k])
+        else:
+            res[k] = v
+    return res
+
+def check_nodes(radixObj, trie):
+    ''' Checks the shape of the nodes of ''trie'' '''
+    if not trie:
+        return
+    rest = [(trie, True)]
+    while rest:
+        node, root = rest.pop()
+        f = radixObj.getfields(node)
+        nchildren = 0
+        prev = None
+        child = f.lcp
+        while child:
+            label, rsp = radixObj.getfields(child, ('label', 'rsp'))
+            if not label or (prev is not None and label[0] <= prev):
+                raise AssertionError("Bad sibling label '%s'" % label)
+            prev = label[0]
+            rest.append((child, False))
+            nchildren += 1
+            child = rsp
+        if root:
+            if f.label or f.rsp or not (f.final or nchildren):
+                raise AssertionError("Bad root")
+        elif not f.final and nchildren < 2:
+            raise AssertionError("Node '%s' is not collapsed" % f.label)
+
+def check(radixObj, trie, ref):
+    if list(radixObj.items(trie)) != sorted(ref.items()):
+        raise AssertionError("Keys differ from the reference")
+    for i in range(20):
+        key = random_key()
+        node = radixObj.find(trie, key)
+        if bool(node) != (key in ref):
+            raise AssertionError("find('%s') is wrong" % key)
+        if node and radixObj.getfields(node, ('value',))[0] != ref[key]:
+            raise AssertionError("Bad value of '%s'" % key)
+    check_nodes(radixObj, trie)
+
+
+if __name__ == "__main__":
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    ostore_path = tempfile.mkdtemp()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(500))
+    radixObj = CountingRadixTrie(pstor)
+    random.seed(1)
+    trie = radixtrie.Nulltrie
+    ref = {}
+    for step in range(steps):
+        op = random.random()
+        if op < 0.4:
+            key = random_key()
+            mergevalue = random.choice((replace_value, None, add_values))
+            trie = radixObj.insert(trie, key, step, mergevalue)
+            ref[key] = merge_dicts(ref, {key: step}, mergevalue)[key]
+        elif op < 0.8:
+            if ref and random.random() < 0.8:
+                key = random.choice(ref.keys())
+            else:
+                key = random_key()
+            trie = radixObj.delete(trie, key)
+            ref.pop(key, None)
+        else:
+            mergevalue = random.choice((replace_value, None, add_values))
+            other = {}
+            if random.random() < 0.5:
+                # A trie made from this one, they share nodes. The values of
+                # a shared subtrie are not merged with themselves.
+                mergevalue = random.choice((replace_value, None))
+                other.update(ref)
+                t2 = trie
+                for i in range(random.randint(1, 5)):
+                    key = random_key()
+                    t2 = radixObj.insert(t2, key, -i)
+                    other[key] = -i
+            else:
+                t2 = random_trie(radixObj, other, random.randint(0, 15))
+            trie = radixObj.merge_trie(trie, t2, mergevalue)
+            ref = merge_dicts(ref, other, mergevalue)
+        if step % 500 == 0:
+            # Stored nodes, that merge_trie() compares by OID
+            ofs.store(trie, "trie")
+            ofs.gc()
+            trie = ofs.load("trie")
+        check(radixObj, trie, ref)
+    for what, n in sorted(CountingRadixTrie.counts.items()):
+        if not n:
+            raise AssertionError("No %s happened" % what)
+        print "%-12s %6d" % (what, n)
+    print "RadixTrie: OK"
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
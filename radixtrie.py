@@ -0,0 +1,384 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import deque
+import persistds
+from oid import OID
+from pstructstor import BatchRef
+from ptrie import replace_value
+
+#
+# Path-compressed (radix) trie node PStruct
+# A Ptrie node holds its whole prefix and there is a node per letter of a
+# key. A radix trie node only holds the label of the edge leading to it,
+# and a chain of nodes with one child each is collapsed into one node.
+# Fields:
+# label:        The text on the edge from the parent. A node's key is the
+#               labels on the path from the root. Only the root has an
+#               empty label.
+# final:        If final is True, then the node's key is an actual text.
+# lcp:          The "Left Child Pointer". Siblings are ordered by the
+#               first letter of their labels, which are all different.
+# rsp:          The "Right Sibling Pointer"
+#
+
+Nulltrie = OID.Nulloid
+
+_default_rnode_fields = (
+        ('label', ''),
+        ('value', None),
+        ('final', False),
+        ('lcp', Nulltrie),
+        ('rsp', Nulltrie),);
+
+radixStruct = persistds.PStruct.mkpstruct('radixnode', _default_rnode_fields)
+
+# Fields needed to walk a trie, see RadixTrie.getfields()
+_child_fields = ('lcp', 'rsp')
+_search_fields = ('label', 'lcp', 'rsp')
+
+def _same(n1, n2):
+    ''' True if nodes ''n1'' and ''n2'' are the same node '''
+    return n1 is n2 or (n1.oid is not None and n1.pstor is n2.pstor and
+                        n1.oid == n2.oid)
+
+def _merge_values(f1, f2, mergevalue):
+    ''' Returns the (value, final) of the merged node of fields ''f1'' and
+    ''f2'', see RadixTrie.merge_trie(). '''
+    if f1.final and f2.final:
+        if mergevalue is None:
+            return f1.value, True
+        return mergevalue(f1.value, f2.value), True
+    if f2.final:
+        return f2.value, True
+    return f1.value, f1.final
+
+def _common_length(s1, s2):
+    ''' Returns the length of the common prefix of s1 and s2 '''
+    n = min(len(s1), len(s2))
+    i = 0
+    while i < n and s1[i] == s2[i]:
+        i += 1
+    return i
+
+class RadixTrie(object):
+    ''' A Ptrie with path compression. The API is that of Ptrie: a trie is
+    the OID of its root, and insert() and delete() return a new trie. '''
+
+    def __init__(self, pstor):
+        self.pstor = pstor
+
+    def makeTnode(self, *args, **kwargs):
+        ''' Makes a trie node. Fields are passed in radixStruct order
+        (label, value, final, lcp, rsp) and/or by name. '''
+        return radixStruct.make(self.pstor, *args, **kwargs)
+
+    def getfields(self, oid, fnames=None):
+        ''' Returns the fields of trie node ''oid'' as a record, or just the
+        fields named in the tuple ''fnames'' as a list. '''
+        return radixStruct.getfields(self.pstor, oid, fnames)
+
+    def insert(self, trie, key, value, mergevalue=replace_value):
+        ''' Insert a (key, value) into ''trie''. If key exists then the
+        values are merged with mergevalue(oldval, newval), or the trie is
+        left unchanged if mergevalue is None. '''
+        if not trie:
+            if not key:
+                return self.makeTnode('', value, True, Nulltrie, Nulltrie)
+            leaf = self.makeTnode(key, value, True, Nulltrie, Nulltrie)
+            return self.makeTnode('', None, False, leaf, Nulltrie)
+        f = self.getfields(trie)
+        if not key:
+            if f.final:
+                if mergevalue is None:
+                    return trie
+                value = mergevalue(f.value, value)
+            return self.makeTnode('', value, True, f.lcp, f.rsp)
+        lcp = self._insert_chain(f.lcp, key, value, mergevalue)
+        if lcp is f.lcp:
+            return trie
+        return self.makeTnode('', f.value, f.final, lcp, f.rsp)
+
+    def _insert_chain(self, head, key, value, mergevalue):
+        ''' Inserts non-empty ''key'' into the sibling chain ''head''.
+        Returns the new head, or ''head'' if nothing changed. '''
+        left, node, label = self._find_sibling(head, key[0])
+        if node and label[0] == key[0]:
+            new = self._insert_node(self.getfields(node), key, value,
+                                    mergevalue)
+            if new is None:
+                return head
+        else:
+            new = (key, value, True, Nulltrie, node)
+        return self._relink(left, new)
+
+    def _insert_node(self, f, key, value, mergevalue):
+        ''' Inserts ''key'' into the node of fields ''f'', whose label
+        starts with the same letter. Returns the fields of the new node, or
+        None if the node is unchanged. '''
+        label = f.label
+        n = _common_length(label, key)
+        if n == len(label):
+            if n == len(key):
+                if f.final:
+                    if mergevalue is None:
+                        return None
+                    value = mergevalue(f.value, value)
+                return (label, value, True, f.lcp, f.rsp)
+            lcp = self._insert_chain(f.lcp, key[n:], value, mergevalue)
+            if lcp is f.lcp:
+                return None
+            return (label, f.value, f.final, lcp, f.rsp)
+        # Split the edge after the common part: the node becomes the child
+        # of a new node labelled with the common part.
+        child = (label[n:], f.value, f.final, f.lcp)
+        if n == len(key):
+            rows = [child + (Nulltrie,)]
+            return (key, value, True,
+                    radixStruct.make_many(self.pstor, rows)[-1], f.rsp)
+        leaf = (key[n:], value, True, Nulltrie)
+        if leaf[0] < child[0]:
+            rows = [child + (Nulltrie,), leaf + (BatchRef(0),)]
+        else:
+            rows = [leaf + (Nulltrie,), child + (BatchRef(0),)]
+        return (label[:n], None, False,
+                radixStruct.make_many(self.pstor, rows)[-1], f.rsp)
+
+    def _find_sibling(self, head, letter):
+        ''' Walks the sibling chain ''head'' up to the first node whose
+        label starts with ''letter'' or a bigger letter. Returns the fields
+        of the nodes before it, the node (or Nulltrie) and its label. '''
+        left = []
+        node = head
+        label = None
+        while node:
+            label, lcp, rsp = self.getfields(node, _search_fields)
+            if label[0] >= letter:
+                break
+            left.append(node)
+            node = rsp
+        return left, node, label
+
+    def _relink(self, left, new):
+        ''' Remakes the siblings ''left'' in front of ''new'', which are the
+        fields of a new node or an existing node (the rest of the chain).
+        Returns the new head of the chain. '''
+        if isinstance(new, tuple):
+            rows = [new]
+            rsp = BatchRef(0)
+        else:
+            rows = []
+            rsp = new
+        for node in reversed(left):
+            f = self.getfields(node)
+            rows.append((f.label, f.value, f.final, f.lcp, rsp))
+            rsp = BatchRef(len(rows) - 1)
+        if not rows:
+            return new
+        return radixStruct.make_many(self.pstor, rows)[-1]
+
+    def find(self, trie, key, finalOnly=True):
+        ''' Find the node of ''key''. With finalOnly=False, also returns a
+        node whose key is ''key'' but is not final (only keys that end at a
+        branch have such a node). '''
+        if not trie:
+            return Nulltrie
+        node = trie
+        pos = 0
+        while pos < len(key):
+            lcp, = self.getfields(node, ('lcp',))
+            unused, node, label = self._find_sibling(lcp, key[pos])
+            if not node or not key.startswith(label, pos):
+                return Nulltrie
+            pos += len(label)
+        final, = self.getfields(node, ('final',))
+        if (not finalOnly) or final:
+            return node
+        return Nulltrie
+
+    def delete(self, trie, key):
+        ''' Deletes ''key'' from the trie. Returns the new trie, or ''trie''
+        if key is not found. '''
+        if not trie:
+            return trie
+        f = self.getfields(trie)
+        if not key:
+            if not f.final:
+                return trie
+            lcp = f.lcp
+        else:
+            lcp = self._delete_chain(f.lcp, key)
+            if lcp is f.lcp:
+                return trie
+        # The root is never collapsed
+        final = f.final and bool(key)
+        if not final and not lcp:
+            return Nulltrie
+        return self.makeTnode('', f.value if final else None, final, lcp,
+                              f.rsp)
+
+    def _delete_chain(self, head, key):
+        ''' Deletes non-empty ''key'' from the sibling chain ''head''.
+        Returns the new head, or ''head'' if key is not found. '''
+        left, node, label = self._find_sibling(head, key[0])
+        if not node or not key.startswith(label):
+            return head
+        f = self.getfields(node)
+        if len(key) > len(label):
+            lcp = self._delete_chain(f.lcp, key[len(label):])
+            if lcp is f.lcp:
+                return head
+            new = self._collapse(label, f.value, f.final, lcp, f.rsp)
+        else:
+            if not f.final:
+                return head
+            new = self._collapse(label, None, False, f.lcp, f.rsp)
+        return self._relink(left, new)
+
+    def _collapse(self, label, value, final, lcp, rsp):
+        ''' Returns the fields of a node, or its right sibling if a non-final
+        node has no children. A non-final node with one child is merged with
+        that child. '''
+        if final:
+            return (label, value, final, lcp, rsp)
+        if not lcp:
+            return rsp
+        cf = self.getfields(lcp)
+        if cf.rsp:
+            return (label, None, False, lcp, rsp)
+        return (label + cf.label, cf.value, cf.final, cf.lcp, rsp)
+
+    def merge_trie(self, t1, t2, mergevalue=replace_value):
+        ''' Merges two tries into one. Keys in both are merged with
+        mergevalue(t1's value, t2's value), or keep t1's value if mergevalue
+        is None. Both tries are walked together: a subtrie found in only
+        one of them is kept as it is, and so is a subtrie they share (the
+        same node), whose values are not merged with themselves. '''
+        if not t1: return t2
+        if not t2: return t1
+        if _same(t1, t2):
+            return t1
+        f1 = self.getfields(t1)
+        f2 = self.getfields(t2)
+        value, final = _merge_values(f1, f2, mergevalue)
+        lcp = self._merge_chain(f1.lcp, f2.lcp, mergevalue)
+        return self.makeTnode('', value, final, lcp, f1.rsp)
+
+    def _merge_chain(self, h1, h2, mergevalue):
+        ''' Merges the sibling chains ''h1'' (of t1) and ''h2''. Returns the
+        head of the new chain. '''
+        # Entries of the new chain: an existing node, whose rsp is to
+        # change, or the (label, value, final, lcp) of a new node
+        entries = []
+        n1, n2 = h1, h2
+        while n1 and n2 and not _same(n1, n2):
+            f1 = self.getfields(n1)
+            f2 = self.getfields(n2)
+            if f1.label[0] < f2.label[0]:
+                entries.append(n1)
+                n1 = f1.rsp
+            elif f2.label[0] < f1.label[0]:
+                entries.append(n2)
+                n2 = f2.rsp
+            else:
+                entries.append(self._merge_nodes(f1, f2, mergevalue))
+                n1, n2 = f1.rsp, f2.rsp
+        # The rest of the chain that is left (or the shared rest) is kept
+        rsp = n1 or n2
+        if not entries:
+            return rsp
+        rows = []
+        for entry in reversed(entries):
+            if not isinstance(entry, tuple):
+                f = self.getfields(entry)
+                entry = (f.label, f.value, f.final, f.lcp)
+            rows.append(entry + (rsp,))
+            rsp = BatchRef(len(rows) - 1)
+        return radixStruct.make_many(self.pstor, rows)[-1]
+
+    def _merge_nodes(self, f1, f2, mergevalue):
+        ''' Merges the nodes of fields ''f1'' and ''f2'', whose labels start
+        with the same letter. Returns the (label, value, final, lcp) of the
+        merged node. '''
+        l1, l2 = f1.label, f2.label
+        n = _common_length(l1, l2)
+        if n == len(l1) == len(l2):
+            value, final = _merge_values(f1, f2, mergevalue)
+            return (l1, value, final,
+                    self._merge_chain(f1.lcp, f2.lcp, mergevalue))
+        if n == len(l1):
+            # Node 2 goes under node 1
+            child = self.makeTnode(l2[n:], f2.value, f2.final, f2.lcp,
+                                   Nulltrie)
+            return (l1, f1.value, f1.final,
+                    self._merge_chain(f1.lcp, child, mergevalue))
+        if n == len(l2):
+            child = self.makeTnode(l1[n:], f1.value, f1.final, f1.lcp,
+                                   Nulltrie)
+            return (l2, f2.value, f2.final,
+                    self._merge_chain(child, f2.lcp, mergevalue))
+        # Split both edges after the common part
+        c1 = (l1[n:], f1.value, f1.final, f1.lcp)
+        c2 = (l2[n:], f2.value, f2.final, f2.lcp)
+        if c2[0] < c1[0]:
+            c1, c2 = c2, c1
+        rows = [c2 + (Nulltrie,), c1 + (BatchRef(0),)]
+        return (l1[:n], None, False,
+                radixStruct.make_many(self.pstor, rows)[-1])
+
+    def items(self, trie):
+        ''' Iterates (key, value) of the final nodes of ''trie'' in key
+        order. '''
+        if trie is Nulltrie:
+            return
+        rest = [(trie, '')]
+        while rest:
+            node, parentkey = rest.pop()
+            f = self.getfields(node)
+            key = parentkey + f.label
+            if f.final:
+                yield (key, f.value)
+            if f.rsp:
+                rest.append((f.rsp, parentkey))
+            if f.lcp:
+                rest.append((f.lcp, key))
+
+    def dfiter(self, trie):
+        """ An iterator that traverses the trie in depth-first order """
+        if trie is Nulltrie:
+            return
+        rest = [trie]
+        while rest:
+            curr = rest.pop()
+            yield curr
+            lcp, rsp = self.getfields(curr, _child_fields)
+            if rsp:
+                rest.append(rsp)
+            if lcp:
+                rest.append(lcp)
+
+    def bfiter(self, trie):
+        ''' Iterate trie in breadth-first order '''
+        if trie is Nulltrie:
+            return
+        rest = deque([trie])
+        while rest:
+            curr = rest.popleft()
+            yield curr
+            lcp, rsp = self.getfields(curr, _child_fields)
+            if lcp:
+                rest.append(lcp)
+            if rsp:
+                rest.appendleft(rsp)
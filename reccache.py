@@ -0,0 +1,106 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import zlib
+from collections import OrderedDict
+import pstructstor
+
+
+class RecordCache(object):
+    ''' A second level cache for PDSCache. It keeps the records of clean
+    entries evicted from a PDSCache as packed (and optionally compressed)
+    bytes, within a memory budget of ''max_bytes''. A record is keyed by its
+    OID (pstor, size and oid value), so that a miss in the PDSCache can be
+    served from here instead of from disk. Records are dropped in least
+    recently used order when over budget. The cache is exclusive: a record
+    that is read moves back to the PDSCache and is dropped from here. '''
+
+    # Estimated memory used by an entry besides the record bytes (key tuple
+    # and the dictionary slot)
+    entry_overhead = 128
+
+    def __init__(self, max_bytes, compress=True):
+        self.max_bytes = max_bytes
+        self.compress = compress
+        # OID key => packed record. Most recent at the end.
+        self._recs = OrderedDict()
+        self.nbytes = 0
+
+    @staticmethod
+    def _key(o):
+        return (o.pstor, o.size, o.oid)
+
+    def _cost(self, data):
+        return len(data) + RecordCache.entry_overhead
+
+    def put(self, o, ofields):
+        ''' Caches ''ofields'', the fields of the OID ''o''. OID fields must
+        be "real" OIDs. '''
+        self.put_raw(o, pstructstor.PStructStor.default_packer.pack(ofields,
+                                                                    o.pstor))
+
+    def put_raw(self, o, data):
+        ''' Caches ''data'', the record of the OID ''o'' as packed by the
+        default packer (with o.pstor as stordir). '''
+        if self.compress:
+            data = zlib.compress(data, 1)
+        cost = self._cost(data)
+        if cost > self.max_bytes:
+            return
+        key = RecordCache._key(o)
+        if key in self._recs:
+            self.nbytes -= self._cost(self._recs.pop(key))
+        self._recs[key] = data
+        self.nbytes += cost
+        while self.nbytes > self.max_bytes:
+            unused, old = self._recs.popitem(last=False)
+            self.nbytes -= self._cost(old)
+
+    def get(self, o):
+        ''' Returns the fields of OID ''o'' and drops it from cache, or None
+        if ''o'' is not cached. '''
+        data = self.get_raw(o)
+        if data is None:
+            return None
+        return pstructstor.PStructStor.default_packer.unpack(data, o.pstor)
+
+    def get_raw(self, o):
+        ''' Same as get(), returns the packed record of ''o''. '''
+        data = self._recs.pop(RecordCache._key(o), None)
+        if data is None:
+            return None
+        self.nbytes -= self._cost(data)
+        if self.compress:
+            data = zlib.decompress(data)
+        return data
+
+    def discard_pstor(self, stordir):
+        ''' Drops all records of the pstor at ''stordir''. This must be done
+        whenever OIDs of the pstor are moved (garbage collected). '''
+        for key in [k for k in self._recs if k[0] == stordir]:
+            self.nbytes -= self._cost(self._recs.pop(key))
+
+    def clear(self):
+        ''' Drops all records. '''
+        self._recs = OrderedDict()
+        self.nbytes = 0
+
+    def oids(self, stordir):
+        ''' Returns the (size, oid) of the records of the pstor at
+        ''stordir'', most recently used first. '''
+        return [(k[1], k[2]) for k in reversed(self._recs) if k[0] == stordir]
+
+    def __len__(self):
+        return len(self._recs)
@@ -0,0 +1,80 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+# Measures full scans of a stored Ptrie with dfiter() and bfiter(), node
+# by node and with prefetching of the next nodes to visit. Counts the
+# reads of storage (single records and batches) per node. The cache is
+# small, so that most nodes are read back from storage.
+#
+# Usage: scan-bench.py numwords cachesize [prefetch]
+
+
+import random
+import ptrie
+import benchutil
+
+
+def count_reads(pstor, reads):
+    ''' Counts records read from the active pds of ''pstor'' in reads[0]
+    and the calls doing the reads in reads[1] '''
+    pds = pstor.active_pds
+    getrec, getrecs = pds.getrec, pds.getrecs
+    def counting_getrec(o):
+        reads[0] += 1
+        reads[1] += 1
+        return getrec(o)
+    def counting_getrecs(oids):
+        reads[0] += len(oids)
+        reads[1] += 1
+        return getrecs(oids)
+    pds.getrec, pds.getrecs = counting_getrec, counting_getrecs
+
+
+if __name__ == "__main__":
+    nwords, cachesize, prefetch = benchutil.getargs(
+        "numwords cachesize [prefetch]", 2, (64,))
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    # Insert in random order, so that nodes are scattered in storage
+    random.seed(1)
+    root = ptrie.Nulltrie
+    for w in benchutil.mkwords(nwords):
+        root = ptrieObj.insert(root, w, None)
+    store.ofs.store(root, "words")
+    store.ofs.gc()
+    reads = [0, 0]
+    count_reads(store.pstor, reads)
+    print "%-16s %10s %12s %12s" % ("", "usec/node", "reads/node",
+                                    "records/read")
+    visits = {}
+    for name, prefetch in (("dfiter", 0), ("dfiter prefetch", prefetch),
+                           ("bfiter", 0), ("bfiter prefetch", prefetch)):
+        root = store.ofs.load("words")
+        reads[0] = reads[1] = 0
+        if name.startswith("dfiter"):
+            iterator = ptrieObj.dfiter(root, prefetch)
+        else:
+            iterator = ptrieObj.bfiter(root, prefetch)
+        # The OIDs of the nodes, in the order visited
+        elapsed, oids = benchutil.timed(lambda: [n.oid for n in iterator])
+        nodes = len(oids)
+        print "%-16s %10.1f %12.3f %12.1f" % (name,
+            elapsed * 1000000 / nodes, float(reads[1]) / nodes,
+            float(reads[0]) / max(reads[1], 1))
+        # Prefetching must not change the order of the visit
+        order = name.split()[0]
+        benchutil.check(name, oids, visits.setdefault(order, oids))
+    store.close()
@@ -0,0 +1,73 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Measures lookup throughput of a Ptrie as reader threads scale. A trie of
+# random words is built and stored, then a "lookup server" running on a
+# thread pool serves find() requests for all words with 1, 2, 4 and 8
+# threads. A small cache makes most lookups go to disk.
+#
+# Usage: thread-bench.py numwords cachesize [numlookups]
+
+
+import random
+from multiprocessing.pool import ThreadPool
+import ptrie
+import benchutil
+
+
+def serve(ptrieObj, root, requests, nthreads):
+    ''' Looks up all keys in ''requests'' with a pool of ''nthreads''
+    threads. Returns the number of lookups per second and the values
+    found. '''
+    def lookup(key):
+        node = ptrieObj.find(root, key)
+        if not node:
+            raise RuntimeError("%s not found" % key)
+        return ptrieObj.getfields(node, ('value',))[0]
+    pool = ThreadPool(nthreads)
+    elapsed, values = benchutil.timed(
+        lambda: pool.map(lookup, requests, chunksize=64))
+    pool.close()
+    pool.join()
+    return len(requests) / elapsed, values
+
+
+if __name__ == "__main__":
+    nwords, cachesize, nlookups = benchutil.getargs(
+        "numwords cachesize [numlookups]", 2, (None,))
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    words = benchutil.mkwords(nwords)
+    nlookups = nlookups or nwords
+    root = ptrie.Nulltrie
+    for i, w in enumerate(words):
+        root = ptrieObj.insert(root, w, i)
+    store.ofs.store(root, "words")
+    store.ofs.gc()
+    root = store.ofs.load("words")
+    requests = [random.randrange(nwords) for i in range(nlookups)]
+    keys = [words[i] for i in requests]
+    print "%8s %12s %10s" % ("threads", "lookups/s", "hitrate")
+    for nthreads in (1, 2, 4, 8):
+        start = store.cache.metrics.snapshot()
+        rate, values = serve(ptrieObj, root, keys, nthreads)
+        delta = store.cache.metrics.delta(start)
+        # Each lookup finds the value inserted with its word
+        benchutil.check("%d threads" % nthreads, values, requests)
+        total = delta["hits"] + delta["misses"]
+        hitrate = float(delta["hits"]) / total if total else 0.0
+        print "%8d %12.0f %10.4f" % (nthreads, rate, hitrate)
+    store.close()
@@ -0,0 +1,56 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Builds a trie of random words with one insert() per word and with a
+# TransientPtrie, and reports the trie nodes each made and the garbage the
+# cache had to sweep.
+#
+# Usage: transient-bench.py numwords cachesize
+
+
+import random
+import ptrie
+import benchutil
+
+
+if __name__ == "__main__":
+    nwords, cachesize = benchutil.getargs("numwords cachesize", 2)
+    store = benchutil.BenchStore(cachesize)
+    ptrieObj = ptrie.Ptrie(store.pstor)
+    random.seed(1)
+    words = benchutil.mkwords(nwords)
+    def insert():
+        trie = ptrie.Nulltrie
+        for i, w in enumerate(words):
+            trie = ptrieObj.insert(trie, w, i)
+        return trie
+    def transient():
+        t = ptrieObj.transient()
+        for i, w in enumerate(words):
+            t.insert(w, i)
+        return t.persistent()
+    print "%-12s %10s %12s %12s" % ("", "seconds", "nodes made", "swept")
+    expected = sorted((w, i) for i, w in enumerate(words))
+    for name, func in (("insert", insert), ("transient", transient)):
+        def build():
+            trie = func()
+            store.ofs.store(trie, name)
+            return trie
+        elapsed, delta, trie = benchutil.measure(store.cache, build)
+        print "%-12s %10.2f %12d %12d" % (name, elapsed,
+                                          delta["coids"] - delta["coldloads"],
+                                          delta["dead_swept"])
+        benchutil.check(name, list(ptrieObj.items(trie)), expected)
+    store.close()
@@ -0,0 +1,71 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Builds tries with TransientPtrie on a small cache while the background
+# flusher writes dirty entries behind, and checks the keys (and counts, for
+# CountedPtrie) against a dict.
+#
+# Usage: transient-tester.py [numkeys [cachesize]]
+
+
+import sys
+import random
+import shutil
+import tempfile
+import ostore
+import ptrie
+import countedptrie
+import pdscache
+
+
+def check(ptrieObj, trie, ref):
+    if list(ptrieObj.items(trie)) != sorted(ref.items()):
+        raise AssertionError("Keys differ from the reference")
+    if isinstance(ptrieObj, countedptrie.CountedPtrie):
+        for node in ptrieObj.dfiter(trie):
+            f = ptrieObj.getfields(node)
+            if f.count != (int(f.final) + ptrieObj._count(f.lcp) +
+                           ptrieObj._count(f.rsp)):
+                raise AssertionError("Bad count of '%s'" % f.prefix)
+
+
+if __name__ == "__main__":
+    nkeys = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    cachesize = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    ostore_path = tempfile.mkdtemp()
+    cache = pdscache.PDSCache(cachesize)
+    cache.start_flusher(0.2, 0.05, 0.001)
+    pstor, ofs = ostore.init_ostore(ostore_path, cache)
+    random.seed(1)
+    for cls in (ptrie.Ptrie, countedptrie.CountedPtrie):
+        ptrieObj = cls(pstor)
+        # On an empty trie, then on a trie made by insert()
+        base = ptrie.Nulltrie
+        for start in range(2):
+            ref = dict([(k, v) for k, v in ptrieObj.items(base)])
+            t = ptrieObj.transient(base)
+            for i in range(nkeys):
+                key = "".join([random.choice("abcdefgh")
+                               for j in range(random.randint(0, 8))])
+                t.insert(key, i)
+                ref[key] = i
+            check(ptrieObj, t.persistent(), ref)
+            for i in range(nkeys / 10):
+                base = ptrieObj.insert(base, str(i), i)
+        print "%s: OK" % cls.__name__
+    cache.stop_flusher()
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
@@ -0,0 +1,87 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+# Compares lookups in a Ptrie and in a WideTrie holding the same keys of
+# random bytes, so nodes near the root have up to 256 children. Counts the
+# records read from storage per find(); the cache is small so that most
+# nodes are read back.
+#
+# Usage: wide-bench.py numkeys keylen cachesize
+
+
+import random
+import ptrie
+import widetrie
+import benchutil
+
+
+def mkkeys(n, keylen):
+    random.seed(1)
+    keys = set()
+    while len(keys) < n:
+        keys.add("".join([chr(random.randint(0, 255))
+                          for i in range(keylen)]))
+    return list(keys)
+
+def count_reads(pstor, reads):
+    ''' Counts records read from the active pds of ''pstor'' in reads[0] '''
+    pds = pstor.active_pds
+    getrec, getrecs = pds.getrec, pds.getrecs
+    def counting_getrec(o):
+        reads[0] += 1
+        return getrec(o)
+    def counting_getrecs(oids):
+        reads[0] += len(oids)
+        return getrecs(oids)
+    pds.getrec, pds.getrecs = counting_getrec, counting_getrecs
+
+
+if __name__ == "__main__":
+    nkeys, keylen, cachesize = benchutil.getargs("numkeys keylen cachesize",
+                                                 3)
+    store = benchutil.BenchStore(cachesize)
+    keys = mkkeys(nkeys, keylen)
+    tries = (("ptrie", ptrie.Ptrie(store.pstor)),
+             ("widetrie", widetrie.WideTrie(store.pstor)))
+    for name, trieObj in tries:
+        root = ptrie.Nulltrie
+        for i, k in enumerate(keys):
+            root = trieObj.insert(root, k, i)
+        store.ofs.store(root, name)
+    store.ofs.gc()
+    reads = [0]
+    count_reads(store.pstor, reads)
+    expected = dict((k, i) for i, k in enumerate(keys))
+    random.shuffle(keys)
+    print "%-10s %12s %12s" % ("", "reads/find", "usec/find")
+    for name, trieObj in tries:
+        root = store.ofs.load(name)
+        reads[0] = 0
+        def find():
+            found = []
+            for k in keys:
+                node = trieObj.find(root, k)
+                if not node:
+                    raise RuntimeError("%r not found" % k)
+                found.append(node)
+            return found
+        elapsed, found = benchutil.timed(find)
+        print "%-10s %12.1f %12.1f" % (name, float(reads[0]) / len(keys),
+                                       elapsed * 1000000 / len(keys))
+        # Each key finds the value inserted with it
+        benchutil.check(name, [trieObj.getfields(n, ('value',))[0]
+                               for n in found], [expected[k] for k in keys])
+    store.close()
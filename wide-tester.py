@@ -0,0 +1,136 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Runs random inserts, deletes and merge_trie() on a WideTrie and checks
+# items() and find() against a dict, and that every node is of the
+# smallest kind that holds its children. The number of letters keys start
+# with goes up to more than 48 and back down, phase by phase, so that the
+# root grows through the 4, 16, 48 and 256 node kinds and shrinks back;
+# each of these changes must have happened.
+#
+# Usage: wide-tester.py [steps per phase]
+
+
+import sys
+import random
+import shutil
+import tempfile
+import ostore
+import pdscache
+import widetrie
+from ptrie import replace_value
+
+
+def add_values(v1, v2):
+    return v1 + v2
+
+def merge_dicts(d1, d2, mergevalue):
+    res = dict(d2)
+    for k, v in d1.items():
+        if k in d2 and mergevalue is not None:
+            res[k] = mergevalue(v, d2[k])
+        else:
+            res[k] = v
+    return res
+
+def kind(node):
+    ''' The capacity of ''node'' '''
+    return widetrie._kinds[node.name][1]
+
+def check_nodes(wideObj, trie):
+    ''' Checks the kinds of the nodes of ''trie'' '''
+    for node in wideObj.dfiter(trie):
+        value, final, children = wideObj._children(node)
+        fits = [c for c in widetrie._capacities if len(children) <= c]
+        if kind(node) != fits[0]:
+            raise AssertionError("%d children in a node of %d" %
+                                 (len(children), kind(node)))
+        if not final and not children:
+            raise AssertionError("Empty node")
+
+def check(wideObj, trie, ref, keys):
+    if list(wideObj.items(trie)) != sorted(ref.items()):
+        raise AssertionError("Keys differ from the reference")
+    for key in keys:
+        node = wideObj.find(trie, key)
+        if bool(node) != (key in ref):
+            raise AssertionError("find(%r) is wrong" % key)
+        if node and wideObj.getfields(node, ('value',))[0] != ref[key]:
+            raise AssertionError("Bad value of %r" % key)
+    check_nodes(wideObj, trie)
+
+
+if __name__ == "__main__":
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    ostore_path = tempfile.mkdtemp()
+    pstor, ofs = ostore.init_ostore(ostore_path, pdscache.PDSCache(500))
+    wideObj = widetrie.WideTrie(pstor)
+    random.seed(1)
+    # The first letters of keys, "\xff" (see widetrie._noslot) and "\0"
+    # first
+    letters = [chr(i) for i in range(1, 255)]
+    random.shuffle(letters)
+    letters = ["\xff", "\0"] + letters
+    def random_key(width):
+        return (random.choice(letters[:width]) +
+                "".join([random.choice("ab")
+                         for j in range(random.randint(0, 3))]))
+    trie = widetrie.Nulltrie
+    ref = {}
+    kinds = [0]
+    for width in (3, 12, 40, 200, 40, 12, 3, 1):
+        for step in range(steps):
+            op = random.random()
+            mergevalue = random.choice((replace_value, None, add_values))
+            if op < 0.45:
+                key = random_key(width)
+                trie = wideObj.insert(trie, key, step, mergevalue)
+                ref[key] = merge_dicts(ref, {key: step}, mergevalue)[key]
+            elif op < 0.9:
+                # Keys beyond the letters of this phase go first
+                outside = [k for k in ref if k[0] not in letters[:width]]
+                if outside:
+                    key = random.choice(outside)
+                elif ref and random.random() < 0.5:
+                    key = random.choice(ref.keys())
+                else:
+                    key = random_key(width)
+                trie = wideObj.delete(trie, key)
+                ref.pop(key, None)
+            else:
+                other = {}
+                t2 = widetrie.Nulltrie
+                for i in range(random.randint(0, 10)):
+                    key = random_key(width)
+                    t2 = wideObj.insert(t2, key, -i)
+                    other[key] = -i
+                trie = wideObj.merge_trie(trie, t2, mergevalue)
+                ref = merge_dicts(ref, other, mergevalue)
+            check(wideObj, trie, ref, [random_key(width) for i in range(10)])
+            if trie and kind(trie) != kinds[-1]:
+                kinds.append(kind(trie))
+        print "%3d letters: root of %d" % (width, kind(trie) if trie else 0)
+    ofs.store(trie, "trie")
+    ofs.gc()
+    check(wideObj, ofs.load("trie"), ref, ref.keys())
+    changes = set(zip(kinds[1:], kinds[2:]))
+    for c1, c2 in zip(widetrie._capacities, widetrie._capacities[1:]):
+        for change in ((c1, c2), (c2, c1)):
+            if change not in changes:
+                raise AssertionError("No change from %d to %d" % change)
+    print "WideTrie: OK"
+    ofs.close()
+    pstor.close()
+    shutil.rmtree(ostore_path)
@@ -0,0 +1,281 @@
+# Copyright 2012 Ning Ke
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from bisect import bisect_left
+from collections import deque
+import persistds
+from oid import OID
+from ptrie import replace_value
+
+#
+# Wide trie node PStructs
+# A Ptrie node has its children on a sibling chain, finding a child may take
+# as many node reads as there are children. A wide trie node holds all of
+# its children, so going down one level reads one node. There is a node per
+# letter of a key as in Ptrie, keys are byte strings. As in ART (the
+# Adaptive Radix Tree), nodes come in four kinds that hold up to 4, 16, 48
+# and 256 children, a node grows and shrinks into the smallest kind that
+# holds its children.
+# Fields:
+# value, final: As in Ptrie. The key of a node is the letters on its path.
+# labels:       Finds the child of a letter:
+#               4 and 16: The sorted letters of the children, the child of
+#                         labels[i] is c<i>.
+#               48:       256 letters, the child of letter l is
+#                         c<ord(labels[ord(l)])>, or none if that's "\xff".
+#               256:      Unused, the child of letter l is c<ord(l)>.
+# c0, c1, ...:  The children
+#
+
+Nulltrie = OID.Nulloid
+
+_capacities = (4, 16, 48, 256)
+
+def _mkwidestruct(capacity):
+    fields = (('value', None), ('final', False), ('labels', ''))
+    fields += tuple([('c%d' % i, Nulltrie) for i in range(capacity)])
+    return persistds.PStruct.mkpstruct('widenode%d' % capacity, fields)
+
+# PStruct and capacity of each node kind, by PStruct name
+_kinds = dict([('widenode%d' % c, (_mkwidestruct(c), c)) for c in _capacities])
+
+# Field of each child, see WideTrie._child()
+_child_fields = [('c%d' % i,) for i in range(max(_capacities))]
+
+_noslot = "\xff"
+
+class WideTrie(object):
+    ''' A trie of wide nodes. The API is that of Ptrie: a trie is the OID of
+    its root, and insert() and delete() return a new trie. '''
+
+    def __init__(self, pstor):
+        self.pstor = pstor
+
+    def getfields(self, oid, fnames=None):
+        ''' Returns the fields of trie node ''oid'' as a record, or just the
+        fields named in the tuple ''fnames'' as a list. '''
+        ps, capacity = _kinds[oid.name]
+        return ps.getfields(self.pstor, oid, fnames)
+
+    def _child(self, node, letter):
+        ''' Returns the child of ''node'' for ''letter'', or Nulltrie. Only
+        the labels and that child are unpacked. '''
+        ps, capacity = _kinds[node.name]
+        if capacity == 256:
+            slot = ord(letter)
+        else:
+            labels, = ps.getfields(self.pstor, node, ('labels',))
+            if capacity == 48:
+                slot = ord(labels[ord(letter)])
+                if slot == ord(_noslot):
+                    return Nulltrie
+            else:
+                slot = bisect_left(labels, letter)
+                if slot == len(labels) or labels[slot] != letter:
+                    return Nulltrie
+        child, = ps.getfields(self.pstor, node, _child_fields[slot])
+        return child
+
+    def _children(self, node):
+        ''' Returns (value, final, children) of ''node'', children being a
+        list of (letter, child) in letter order. '''
+        ps, capacity = _kinds[node.name]
+        f = ps.getfields(self.pstor, node)
+        labels, cs = f.labels, f[3:]
+        if capacity == 256:
+            children = [(chr(i), c) for i, c in enumerate(cs) if c]
+        elif capacity == 48:
+            children = [(chr(i), cs[ord(s)]) for i, s in enumerate(labels)
+                        if s != _noslot]
+        else:
+            children = zip(labels, cs)
+        return f.value, f.final, children
+
+    def _make(self, value, final, children):
+        ''' Makes a node of the smallest kind that holds ''children'' (see
+        _children()). A node that is not final and has no children is
+        Nulltrie. '''
+        if not final and not children:
+            return Nulltrie
+        for capacity in _capacities:
+            if len(children) <= capacity:
+                break
+        ps, capacity = _kinds['widenode%d' % capacity]
+        cs = [Nulltrie] * capacity
+        if capacity == 256:
+            labels = ''
+            for l, c in children:
+                cs[ord(l)] = c
+        elif capacity == 48:
+            index = [_noslot] * 256
+            for i, (l, c) in enumerate(children):
+                index[ord(l)] = chr(i)
+                cs[i] = c
+            labels = ''.join(index)
+        else:
+            labels = ''.join([l for l, c in children])
+            cs[0:len(children)] = [c for l, c in children]
+        return ps.make(self.pstor, value, final, labels, *cs)
+
+    def _search(self, trie, key):
+        ''' Returns the nodes on the path to ''key'', the last one being the
+        node of key or the last node found on the way. '''
+        path = []
+        node = trie
+        pos = 0
+        while node:
+            path.append(node)
+            if pos == len(key):
+                break
+            node = self._child(node, key[pos])
+            pos += 1
+        return path
+
+    def _retrace(self, path, key, node):
+        ''' Remakes the nodes of ''path'', path[i] being the node of
+        key[:i], with ''node'' as the new node of key[:len(path)]. Returns
+        the new root. '''
+        for i in range(len(path) - 1, -1, -1):
+            value, final, children = self._children(path[i])
+            letters = [l for l, c in children]
+            j = bisect_left(letters, key[i])
+            found = j < len(letters) and letters[j] == key[i]
+            if node:
+                if found:
+                    children[j] = (key[i], node)
+                else:
+                    children.insert(j, (key[i], node))
+            elif found:
+                del children[j]
+            node = self._make(value, final, children)
+        return node
+
+    def insert(self, trie, key, value, mergevalue=replace_value):
+        ''' Insert a (key, value) into ''trie''. If key exists then the
+        values are merged with mergevalue(oldval, newval), or the trie is
+        left unchanged if mergevalue is None. '''
+        path = self._search(trie, key)
+        if len(path) == len(key) + 1:
+            # key exists
+            node = path.pop()
+            oldval, final, children = self._children(node)
+            if final:
+                if mergevalue is None:
+                    return trie
+                value = mergevalue(oldval, value)
+            node = self._make(value, True, children)
+        else:
+            # Make the missing nodes of key[:len(path)] to key
+            node = self._make(value, True, [])
+            for p in range(len(key) - 1, len(path) - 1, -1):
+                node = self._make(None, False, [(key[p], node)])
+        return self._retrace(path, key, node)
+
+    def find(self, trie, key, finalOnly=True):
+        ''' Find the node of ''key''. '''
+        path = self._search(trie, key)
+        if len(path) != len(key) + 1:
+            return Nulltrie
+        node = path[-1]
+        final, = self.getfields(node, ('final',))
+        if (not finalOnly) or final:
+            return node
+        return Nulltrie
+
+    def delete(self, trie, key):
+        ''' Deletes ''key'' from the trie. Returns the new trie, or ''trie''
+        if key is not found. Nodes left with no children and no key are
+        removed. '''
+        path = self._search(trie, key)
+        if len(path) != len(key) + 1:
+            return trie
+        value, final, children = self._children(path.pop())
+        if not final:
+            return trie
+        return self._retrace(path, key, self._make(None, False, children))
+
+    def merge_trie(self, t1, t2, mergevalue=replace_value):
+        ''' Merges two tries into one. Keys in both are merged with
+        mergevalue(t1's value, t2's value), or keep t1's value if mergevalue
+        is None. Both tries are walked together: a subtrie found in only
+        one of them is kept as it is, and so is a subtrie they share (the
+        same node), whose values are not merged with themselves. '''
+        if not t1: return t2
+        if not t2: return t1
+        if t1 is t2 or (t1.oid is not None and t1.pstor is t2.pstor and
+                        t1.oid == t2.oid):
+            return t1
+        v1, final1, c1 = self._children(t1)
+        v2, final2, c2 = self._children(t2)
+        if final1 and final2:
+            value = v1 if mergevalue is None else mergevalue(v1, v2)
+        elif final2:
+            value = v2
+        else:
+            value = v1
+        # Merge the children, both in letter order
+        children = []
+        i = j = 0
+        while i < len(c1) and j < len(c2):
+            if c1[i][0] < c2[j][0]:
+                children.append(c1[i])
+                i += 1
+            elif c2[j][0] < c1[i][0]:
+                children.append(c2[j])
+                j += 1
+            else:
+                children.append((c1[i][0], self.merge_trie(c1[i][1], c2[j][1],
+                                                           mergevalue)))
+                i += 1
+                j += 1
+        children.extend(c1[i:])
+        children.extend(c2[j:])
+        return self._make(value, final1 or final2, children)
+
+    def items(self, trie):
+        ''' Iterates (key, value) of the final nodes of ''trie'' in key
+        order. '''
+        if trie is Nulltrie:
+            return
+        rest = [(trie, '')]
+        while rest:
+            node, key = rest.pop()
+            value, final, children = self._children(node)
+            if final:
+                yield (key, value)
+            for l, c in reversed(children):
+                rest.append((c, key + l))
+
+    def dfiter(self, trie):
+        """ An iterator that traverses the trie in depth-first order """
+        if trie is Nulltrie:
+            return
+        rest = [trie]
+        while rest:
+            curr = rest.pop()
+            yield curr
+            value, final, children = self._children(curr)
+            rest.extend([c for l, c in reversed(children)])
+
+    def bfiter(self, trie):
+        ''' Iterate trie in breadth-first order '''
+        if trie is Nulltrie:
+            return
+        rest = deque([trie])
+        while rest:
+            curr = rest.popleft()
+            yield curr
+            value, final, children = self._children(curr)
+            rest.extend([c for l, c in children])